@@ -0,0 +1,293 @@
+"""Grading endpoints."""
+
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+import structlog
+from fastapi import APIRouter, HTTPException, Request, status
+
+from app.core.config import settings
+from app.core.executor import run_cpu_bound
+from app.schemas.grading import (
+    AttemptScore,
+    ExamStatsSnapshot,
+    ItemAnalysisRequest,
+    ItemAnalysisResponse,
+    QuestionAnalysis,
+    RegradedAttempt,
+    RegradeRequest,
+    RegradeResponse,
+)
+from app.services.grading import (
+    NO_OPTION,
+    answer_key_vector,
+    finite_or_none,
+    grade,
+    item_analysis,
+    key_to_list,
+    percentage,
+    selection_matrix,
+)
+from app.services.exam_stats import get_exam_stats
+from app.services.intensity_store import get_intensity_store
+
+router = APIRouter()
+logger = structlog.get_logger()
+
+
+@router.post("/regrade", response_model=RegradeResponse)
+async def regrade_exam(request: RegradeRequest, http_request: Request) -> RegradeResponse:
+    """
+    Re-score every stored attempt of an exam with a corrected answer key.
+
+    Uses the selected options kept by the intensity store (no image is
+    downloaded or processed) and publishes one compact message per changed
+    attempt to omr.results (`regrade: true`, new totals, `scoreDelta` and the
+    questions whose correctness changed). With `publish: false` it is a dry
+    run: nothing is published and the stored key is kept.
+
+    - **exam_id**: UUID of the exam
+    - **answer_key**: Corrected key ([[0], [3], ...] or [0, 3, ...])
+    - **previous_answer_key**: Key used so far (default: the one stored by the consumer)
+    """
+    if not settings.ENABLE_INTENSITY_STORE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"code": "INTENSITY_STORE_DISABLED", "message": "ENABLE_INTENSITY_STORE is off"},
+        )
+    consumer = getattr(http_request.app.state, "consumer", None)
+    if request.publish and consumer is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"code": "CONSUMER_UNAVAILABLE", "message": "Not connected to RabbitMQ"},
+        )
+
+    try:
+        response, messages, new_key = await run_cpu_bound(_run_regrade, request)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": f"Invalid answer key: {e}"},
+        )
+
+    if request.publish:
+        for message in messages:
+            await consumer.publish_result(message)
+        response.published = len(messages)
+        await run_cpu_bound(get_intensity_store().save_answer_key, request.exam_id, new_key)
+
+    logger.info(
+        "Exam re-graded",
+        exam_id=request.exam_id,
+        attempts=response.attempts,
+        changed_attempts=response.changed_attempts,
+        published=response.published,
+        processing_time_ms=response.processing_time_ms,
+    )
+    return response
+
+
+def _run_regrade(request: RegradeRequest) -> Tuple[RegradeResponse, List[dict], list]:
+    """Blocking part of regrade_exam: one vectorized scoring pass over the exam."""
+    start_time = time.time()
+    store = get_intensity_store()
+    records = store.find(exam_id=request.exam_id)
+    response = RegradeResponse(exam_id=request.exam_id, attempts=len(records))
+    if not records:
+        return response, [], []
+
+    totals = np.array([record.intensities.shape[0] for record in records])
+    selected = selection_matrix([record.selected_options() for record in records])
+    width = selected.shape[1]
+    new_key = answer_key_vector(request.answer_key, width)
+    new = grade(selected, new_key, totals)
+
+    previous = request.previous_answer_key
+    if previous is None:
+        previous = store.get_answer_key(request.exam_id)
+    old_key = None if previous is None else answer_key_vector(previous, width)
+    if old_key is not None and (old_key != NO_OPTION).any():
+        old = grade(selected, old_key, totals)
+        changed = new.correct != old.correct
+        deltas = new.total_correct - old.total_correct
+    else:
+        # No previous key (none stored, or graded without one): full totals, no delta
+        old = None
+        changed = np.ones_like(new.correct)
+        deltas = None
+
+    processed_at = datetime.now(timezone.utc).isoformat()
+    messages = []
+    for row, record in enumerate(records):
+        changed_idx = np.flatnonzero(changed[row, :totals[row]])
+        if old is not None and changed_idx.size == 0:
+            continue
+        score = int(new.total_correct[row])
+        score_delta = None if deltas is None else int(deltas[row])
+        total_questions = int(totals[row])
+        response.results.append(RegradedAttempt(
+            attempt_id=record.attempt_id,
+            score=score,
+            score_delta=score_delta,
+            total_correct=score,
+            total_incorrect=int(new.total_incorrect[row]),
+            total_blank=int(new.total_blank[row]),
+            total_questions=total_questions,
+            percentage=percentage(score, total_questions),
+            changed_questions=[] if old is None else (changed_idx + 1).tolist(),
+        ))
+        messages.append({
+            "attemptId": record.attempt_id,
+            "examId": record.exam_id,
+            "success": True,
+            "regrade": True,
+            "score": score,
+            "scoreDelta": score_delta,
+            "totalCorrect": score,
+            "totalIncorrect": int(new.total_incorrect[row]),
+            "totalBlank": int(new.total_blank[row]),
+            "totalQuestions": total_questions,
+            "percentage": percentage(score, total_questions),
+            "changedAnswers": [
+                {
+                    "questionNumber": int(q_idx) + 1,
+                    "selectedOption": None if selected[row, q_idx] < 0 else int(selected[row, q_idx]),
+                    "correctOption": None if new_key[q_idx] < 0 else int(new_key[q_idx]),
+                    "isCorrect": bool(new.correct[row, q_idx]),
+                }
+                for q_idx in changed_idx
+            ],
+            "processedAt": processed_at,
+        })
+
+    response.changed_attempts = len(messages)
+    response.processing_time_ms = int((time.time() - start_time) * 1000)
+    return response, messages, key_to_list(new_key)
+
+
+@router.post("/item-analysis", response_model=ItemAnalysisResponse)
+async def analyse_items(request: ItemAnalysisRequest) -> ItemAnalysisResponse:
+    """
+    Score a whole cohort and compute per-question item analysis: difficulty,
+    discrimination index (upper/lower 27%), point-biserial, option
+    distribution and blank rate.
+
+    - **exam_id**: Use the exam's stored attempts (ENABLE_INTENSITY_STORE) and key
+    - **selections** / **attempt_ids**: Or an explicit (students x questions) matrix
+    - **answer_key**: Key to grade with (required unless stored for the exam)
+    - **num_options**: Options per question (default: detected)
+    """
+    if request.selections is None:
+        if request.exam_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"code": "VALIDATION_ERROR", "message": "exam_id or selections is required"},
+            )
+        if not settings.ENABLE_INTENSITY_STORE:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={"code": "INTENSITY_STORE_DISABLED", "message": "ENABLE_INTENSITY_STORE is off"},
+            )
+    elif request.attempt_ids is not None and len(request.attempt_ids) != len(request.selections):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": "attempt_ids must match selections rows"},
+        )
+
+    try:
+        response = await run_cpu_bound(_run_item_analysis, request)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": str(e)},
+        )
+
+    logger.info(
+        "Item analysis computed",
+        exam_id=request.exam_id,
+        attempts=response.attempts,
+        total_questions=response.total_questions,
+        processing_time_ms=response.processing_time_ms,
+    )
+    return response
+
+
+def _run_item_analysis(request: ItemAnalysisRequest) -> ItemAnalysisResponse:
+    """Blocking part of analyse_items: builds the cohort matrix and analyses it."""
+    start_time = time.time()
+    answer_key = request.answer_key
+    num_options: Optional[int] = request.num_options
+
+    if request.selections is not None:
+        attempt_ids = request.attempt_ids or [str(i) for i in range(len(request.selections))]
+        selected = selection_matrix(request.selections)
+    else:
+        store = get_intensity_store()
+        records = store.find(exam_id=request.exam_id)
+        attempt_ids = [record.attempt_id for record in records]
+        selected = selection_matrix([record.selected_options() for record in records])
+        if num_options is None and records:
+            num_options = max(record.intensities.shape[1] for record in records)
+        if answer_key is None:
+            answer_key = store.get_answer_key(request.exam_id)
+
+    response = ItemAnalysisResponse(exam_id=request.exam_id, attempts=len(attempt_ids))
+    if not attempt_ids:
+        return response
+    if answer_key is None:
+        raise ValueError("answer_key is required (no stored key for this exam)")
+
+    total_questions = selected.shape[1]
+    key = answer_key_vector(answer_key, total_questions)
+    if num_options is None:
+        num_options = int(max(selected.max(initial=NO_OPTION), key.max(initial=NO_OPTION))) + 1
+    if selected.min(initial=0) < NO_OPTION or num_options < 1:
+        raise ValueError("options must be 0-indexed")
+
+    analysis = item_analysis(selected, key, num_options)
+    scores = analysis.scores.astype(np.float64)
+    response.total_questions = total_questions
+    response.mean_score = round(float(scores.mean()), 4)
+    response.std_score = round(float(scores.std()), 4)
+    response.questions = [
+        QuestionAnalysis(
+            question_number=q_idx + 1,
+            correct_option=None if key[q_idx] == NO_OPTION else int(key[q_idx]),
+            difficulty=finite_or_none(analysis.difficulty[q_idx]),
+            discrimination=finite_or_none(analysis.discrimination[q_idx]),
+            point_biserial=finite_or_none(analysis.point_biserial[q_idx]),
+            blank_rate=round(float(analysis.blank_rate[q_idx]), 4),
+            option_distribution=analysis.option_counts[q_idx].tolist(),
+        )
+        for q_idx in range(total_questions)
+    ]
+    if request.include_scores:
+        response.scores = [
+            AttemptScore(
+                attempt_id=attempt_id,
+                score=int(score),
+                percentage=percentage(int(score), total_questions),
+            )
+            for attempt_id, score in zip(attempt_ids, analysis.scores, strict=True)
+        ]
+
+    response.processing_time_ms = int((time.time() - start_time) * 1000)
+    return response
+
+
+@router.get("/exams/{exam_id}/stats", response_model=ExamStatsSnapshot)
+async def exam_stats(exam_id: str) -> ExamStatsSnapshot:
+    """
+    Live statistics of an exam (score histogram, per-question correct/blank
+    counts, mean confidence, review-needed count), updated by the consumer
+    as each result is published. In-memory and per process: no database query.
+    """
+    snapshot = get_exam_stats().snapshot(exam_id) if settings.ENABLE_EXAM_STATS else None
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"code": "EXAM_STATS_NOT_FOUND", "message": "No results processed for this exam"},
+        )
+    return ExamStatsSnapshot(**snapshot)
@@ -1,31 +1,156 @@
 """OMR Processing endpoints."""
 
+import hmac
 import time
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 import structlog
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, UploadFile, status
+from fastapi.responses import FileResponse, PlainTextResponse
 
-from app.core.constants import ProcessingStatus
+from app.core.admission import AdmissionRejectedError, estimate_pixels, get_admission_controller
+from app.core.config import settings
+from app.core.constants import ErrorCode, ProcessingStatus
+from app.core.deadline import DEADLINE_HEADER, TIME_BUDGET_HEADER, Deadline, DeadlineExceededError
+from app.core.executor import run_cpu_bound
+from app.core.metrics import observe_answers, observe_error, observe_stages
+from app.core.profiling import ProfilingNotAllowedError, authorize, profile_file, run_profiled
+from app.core.sampler import get_stack_sampler
+from app.core.timing import StageTimer
 from app.schemas.processing import (
     ProcessingRequest,
     ProcessingResponse,
     DetectedAnswer,
     ImageValidationResult,
+    RedecideRequest,
+    RedecideResponse,
+    RedecidedAttempt,
 )
-from app.services.omr_processor import OMRProcessor
+from app.services.calibration_cache import calibration_key
+from app.services.engines import ContrastDecider, get_engine
+from app.services.intensity_store import get_intensity_store, redecide, store_attempt
+from app.services.omr_processor import OMRProcessor, resolve_capture_mode, resolve_engine
 from app.services.image_validator import ImageValidator
 
 router = APIRouter()
 logger = structlog.get_logger()
 
 
-@router.post("/answer-key", response_model=ProcessingResponse)
+def _deadline_exceeded(stage: str) -> HTTPException:
+    observe_error(ErrorCode.DEADLINE_EXCEEDED.value, "api")
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail={
+            "code": ErrorCode.DEADLINE_EXCEEDED.value,
+            "message": f"Deadline exceeded before stage '{stage}'",
+        },
+    )
+
+
+def request_deadline(
+    x_deadline: Optional[float] = Header(None, description="Absolute deadline (epoch ms)"),
+    x_time_budget_ms: Optional[float] = Header(None, description="Time budget in ms"),
+) -> Optional[Deadline]:
+    """Deadline from X-Deadline / X-Time-Budget-Ms; already-expired requests are dropped."""
+    try:
+        deadline = Deadline.from_headers(
+            {DEADLINE_HEADER: x_deadline, TIME_BUDGET_HEADER: x_time_budget_ms}
+        )
+    except ValueError as e:  # nan / inf pass the float header validation
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": str(e)},
+        ) from None
+    if deadline is not None and deadline.expired():
+        raise _deadline_exceeded("admission")
+    return deadline
+
+
+def request_profile(
+    profile: Optional[str] = Form(None, description="Profile this sheet: pstats | collapsed"),
+    x_omr_profile: Optional[str] = Header(None, description="Profile this sheet: pstats | collapsed"),
+    x_omr_profile_token: Optional[str] = Header(None, description="PROFILING_TOKEN"),
+) -> Optional[str]:
+    """Profile format requested for the sheet (ENABLE_PROFILING + token), None if not asked."""
+    try:
+        return authorize(x_omr_profile or profile, x_omr_profile_token)
+    except ProfilingNotAllowedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={"code": "PROFILING_NOT_ALLOWED", "message": str(e)},
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": str(e)},
+        )
+
+
+def _check_engine(
+    engine: Optional[str], template: Optional[str], capture_mode: Optional[str] = None
+) -> None:
+    """Reject unknown engine/template/capture mode names with 400 before any work is done."""
+    try:
+        resolve_engine(engine, template)
+        resolve_capture_mode(capture_mode)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "INVALID_ENGINE", "message": str(e)},
+        )
+
+
+def _calibration_for(
+    exam_id: str, batch_id: Optional[str], device_id: Optional[str]
+) -> Optional[dict]:
+    key = calibration_key(exam_id, batch_id, device_id)
+    return {"key": key} if key else None
+
+
+async def admission_control(
+    file: UploadFile = File(...),
+    deadline: Optional[Deadline] = Depends(request_deadline),
+) -> AsyncIterator[None]:
+    """Reserve processing budget for the uploaded image (429 when saturated)."""
+    if not settings.ENABLE_ADMISSION_CONTROL:
+        yield
+        return
+
+    controller = get_admission_controller()
+    max_wait_s = controller.max_wait_s
+    if deadline is not None:
+        # No point queueing past the caller's deadline
+        max_wait_s = min(max_wait_s, deadline.remaining_ms() / 1000.0)
+
+    pixels = estimate_pixels(file.file)
+    try:
+        async with controller.admit(pixels, max_wait_s=max_wait_s):
+            yield
+    except AdmissionRejectedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={"code": "OVERLOADED", "message": e.reason},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+@router.post(
+    "/answer-key",
+    response_model=ProcessingResponse,
+    dependencies=[Depends(admission_control)],
+)
 async def process_answer_key(
     file: UploadFile = File(...),
     exam_id: str = Form(...),
     total_questions: int = Form(...),
     options_per_question: int = Form(5),
+    engine: Optional[str] = Form(None),
+    template: Optional[str] = Form(None),
+    batch_id: Optional[str] = Form(None),
+    device_id: Optional[str] = Form(None),
+    capture_mode: Optional[str] = Form(None),
+    deadline: Optional[Deadline] = Depends(request_deadline),
+    profile_format: Optional[str] = Depends(request_profile),
 ) -> ProcessingResponse:
     """
     Process an answer key image and detect correct answers.
@@ -34,6 +159,11 @@ async def process_answer_key(
     - **exam_id**: UUID of the exam
     - **total_questions**: Total number of questions
     - **options_per_question**: Number of options per question (default: 5)
+    - **engine**: Detection engine (default: template engine or OMR_ENGINE)
+    - **template**: Sheet template (default: OMR_TEMPLATE)
+    - **batch_id** / **device_id**: Scanner batch or device; consecutive sheets reuse the calibration
+    - **capture_mode**: auto (default, from metadata) | photo | scanner
+    - **profile** (or X-OMR-Profile header): pstats | collapsed profile of this sheet (ENABLE_PROFILING)
     """
     start_time = time.time()
     logger.info(
@@ -43,13 +173,17 @@ async def process_answer_key(
         filename=file.filename,
     )
 
+    _check_engine(engine, template, capture_mode)
+
     try:
         # Read image data
         image_data = await file.read()
 
         # Validate image
         validator = ImageValidator()
-        validation = validator.validate(image_data)
+        timer = StageTimer()
+        with timer.stage("validate"):
+            validation = await run_cpu_bound(validator.validate, image_data)
 
         if not validation.is_valid:
             logger.warning(
@@ -75,13 +209,25 @@ async def process_answer_key(
 
         # Process OMR
         processor = OMRProcessor()
-        result = processor.process_image(
+        result, profile = await run_cpu_bound(
+            run_profiled,
+            profile_format,
+            f"answer-key-{exam_id}",
+            processor.process_image,
             image_data=image_data,
             total_questions=total_questions,
             options_per_question=options_per_question,
+            deadline=deadline,
+            engine=engine,
+            template=template,
+            calibration=_calibration_for(exam_id, batch_id, device_id),
+            capture_mode=capture_mode,
+            timer=timer,
         )
 
         processing_time = int((time.time() - start_time) * 1000)
+        observe_stages(timer, "api", result.engine)
+        observe_answers((a.status.value for a in result.answers), "api")
 
         # Log formatted answers table
         logger.info("=" * 70)
@@ -123,12 +269,23 @@ async def process_answer_key(
             quality_level=validation.quality_level,
             processing_time_ms=processing_time,
             warnings=result.warnings,
+            degraded=result.degraded,
+            engine=result.engine,
+            stage_timings_ms=timer.rounded(),
+            stage_peak_bytes=timer.peak_bytes,
+            processing_steps=timer.steps(),
+            profile=profile.to_dict() if profile else None,
+            capture_mode=result.capture_mode,
         )
 
     except HTTPException:
         raise
+    except DeadlineExceededError as e:
+        logger.warning("Deadline exceeded", exam_id=exam_id, stage=e.stage)
+        raise _deadline_exceeded(e.stage)
     except Exception as e:
         logger.exception("Error processing answer key", exam_id=exam_id, error=str(e))
+        observe_error(ErrorCode.PROCESSING_ERROR.value, "api")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={
@@ -138,7 +295,7 @@ async def process_answer_key(
         )
 
 
-@router.post("/debug-detection")
+@router.post("/debug-detection", dependencies=[Depends(admission_control)])
 async def debug_detection(
     file: UploadFile = File(...),
     total_questions: int = Form(90),
@@ -148,20 +305,30 @@ async def debug_detection(
     Debug endpoint: processes image and saves debug images to see what's being detected.
     Uses rectangle detection and perspective correction.
     """
+    logger.info("Debug detection started")
+    
+    # Read image
+    image_data = await file.read()
+    return await run_cpu_bound(
+        _run_debug_detection, image_data, total_questions, options_per_question
+    )
+
+
+def _run_debug_detection(
+    image_data: bytes,
+    total_questions: int,
+    options_per_question: int,
+) -> dict:
+    """Blocking part of debug_detection (runs on the processing executor)."""
     import cv2
     import numpy as np
     import os
     from datetime import datetime
-    from app.services.omr_processor import OMRProcessor
-    
-    logger.info("Debug detection started")
     
     # Create debug output directory
     debug_dir = os.path.join(os.path.dirname(__file__), "..", "..", "debug_output")
     os.makedirs(debug_dir, exist_ok=True)
     
-    # Read image
-    image_data = await file.read()
     np_array = np.frombuffer(image_data, np.uint8)
     original = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
     
@@ -267,7 +434,11 @@ async def debug_detection(
     }
 
 
-@router.post("/student-answer", response_model=ProcessingResponse)
+@router.post(
+    "/student-answer",
+    response_model=ProcessingResponse,
+    dependencies=[Depends(admission_control)],
+)
 async def process_student_answer(
     file: UploadFile = File(...),
     exam_id: str = Form(...),
@@ -275,6 +446,13 @@ async def process_student_answer(
     attempt_id: str = Form(...),
     total_questions: int = Form(...),
     options_per_question: int = Form(5),
+    engine: Optional[str] = Form(None),
+    template: Optional[str] = Form(None),
+    batch_id: Optional[str] = Form(None),
+    device_id: Optional[str] = Form(None),
+    capture_mode: Optional[str] = Form(None),
+    deadline: Optional[Deadline] = Depends(request_deadline),
+    profile_format: Optional[str] = Depends(request_profile),
 ) -> ProcessingResponse:
     """
     Process a student answer sheet image.
@@ -285,6 +463,11 @@ async def process_student_answer(
     - **attempt_id**: UUID of the exam attempt
     - **total_questions**: Total number of questions
     - **options_per_question**: Number of options per question (default: 5)
+    - **engine**: Detection engine (default: template engine or OMR_ENGINE)
+    - **template**: Sheet template (default: OMR_TEMPLATE)
+    - **batch_id** / **device_id**: Scanner batch or device; consecutive sheets reuse the calibration
+    - **capture_mode**: auto (default, from metadata) | photo | scanner
+    - **profile** (or X-OMR-Profile header): pstats | collapsed profile of this sheet (ENABLE_PROFILING)
     """
     start_time = time.time()
     logger.info(
@@ -295,13 +478,17 @@ async def process_student_answer(
         filename=file.filename,
     )
 
+    _check_engine(engine, template, capture_mode)
+
     try:
         # Read image data
         image_data = await file.read()
 
         # Validate image
         validator = ImageValidator()
-        validation = validator.validate(image_data)
+        timer = StageTimer()
+        with timer.stage("validate"):
+            validation = await run_cpu_bound(validator.validate, image_data)
 
         if not validation.is_valid:
             raise HTTPException(
@@ -315,13 +502,27 @@ async def process_student_answer(
 
         # Process OMR
         processor = OMRProcessor()
-        result = processor.process_image(
+        result, profile = await run_cpu_bound(
+            run_profiled,
+            profile_format,
+            attempt_id,
+            processor.process_image,
             image_data=image_data,
             total_questions=total_questions,
             options_per_question=options_per_question,
+            deadline=deadline,
+            engine=engine,
+            template=template,
+            calibration=_calibration_for(exam_id, batch_id, device_id),
+            capture_mode=capture_mode,
+            timer=timer,
         )
 
+        await run_cpu_bound(store_attempt, attempt_id, exam_id, result)
+
         processing_time = int((time.time() - start_time) * 1000)
+        observe_stages(timer, "api", result.engine)
+        observe_answers((a.status.value for a in result.answers), "api")
 
         logger.info(
             "Student answer processed successfully",
@@ -342,10 +543,20 @@ async def process_student_answer(
             quality_level=validation.quality_level,
             processing_time_ms=processing_time,
             warnings=result.warnings,
+            degraded=result.degraded,
+            engine=result.engine,
+            stage_timings_ms=timer.rounded(),
+            stage_peak_bytes=timer.peak_bytes,
+            processing_steps=timer.steps(),
+            profile=profile.to_dict() if profile else None,
+            capture_mode=result.capture_mode,
         )
 
     except HTTPException:
         raise
+    except DeadlineExceededError as e:
+        logger.warning("Deadline exceeded", exam_id=exam_id, stage=e.stage)
+        raise _deadline_exceeded(e.stage)
     except Exception as e:
         logger.exception(
             "Error processing student answer",
@@ -353,6 +564,7 @@ async def process_student_answer(
             student_id=student_id,
             error=str(e),
         )
+        observe_error(ErrorCode.PROCESSING_ERROR.value, "api")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={
@@ -362,7 +574,139 @@ async def process_student_answer(
         )
 
 
-@router.post("/validate-image", response_model=ImageValidationResult)
+@router.post("/redecide", response_model=RedecideResponse)
+async def redecide_attempts(request: RedecideRequest) -> RedecideResponse:
+    """
+    Re-run only the decision stage over stored intensity matrices
+    (ENABLE_INTENSITY_STORE), e.g. after retuning the contrast thresholds.
+    No image is downloaded or processed.
+    
+    - **exam_id** / **attempt_ids**: Attempts to re-decide (at least one is required)
+    - **engine**: Use this engine's decider instead of the attempt's
+    - **min_row_range** / **min_contrast**: Contrast decider thresholds to try
+    - **persist**: Keep the new answers as the attempts' current answers
+    """
+    if not settings.ENABLE_INTENSITY_STORE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"code": "INTENSITY_STORE_DISABLED", "message": "ENABLE_INTENSITY_STORE is off"},
+        )
+    if request.exam_id is None and not request.attempt_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"code": "VALIDATION_ERROR", "message": "exam_id or attempt_ids is required"},
+        )
+    if request.engine is not None:
+        _check_engine(request.engine, None)
+    
+    return await run_cpu_bound(_run_redecide, request)
+
+
+def _run_redecide(request: RedecideRequest) -> RedecideResponse:
+    """Blocking part of redecide_attempts (runs on the processing executor)."""
+    start_time = time.time()
+    store = get_intensity_store()
+    records = store.find(exam_id=request.exam_id, attempt_ids=request.attempt_ids)
+    
+    decider = None
+    if request.min_row_range is not None or request.min_contrast is not None:
+        decider = ContrastDecider(request.min_row_range, request.min_contrast)
+    elif request.engine is not None:
+        decider = get_engine(request.engine).decider
+    
+    processor = OMRProcessor()
+    response = RedecideResponse(attempts=len(records))
+    for record in records:
+        answers, changed = redecide(processor, record, decider)
+        if changed:
+            response.changed_attempts += 1
+            response.changed_answers += len(changed)
+            if request.persist:
+                record.selections = [(a.selected_option, a.status.value) for a in answers]
+                store.save(record)
+        response.results.append(RedecidedAttempt(
+            attempt_id=record.attempt_id,
+            exam_id=record.exam_id,
+            engine=record.engine,
+            changed_questions=changed,
+            detected_answers=answers if request.include_answers else [],
+        ))
+    
+    response.processing_time_ms = int((time.time() - start_time) * 1000)
+    logger.info(
+        "Attempts re-decided",
+        exam_id=request.exam_id,
+        attempts=response.attempts,
+        changed_attempts=response.changed_attempts,
+        changed_answers=response.changed_answers,
+        processing_time_ms=response.processing_time_ms,
+    )
+    return response
+
+
+def profiling_token(
+    x_omr_profile_token: Optional[str] = Header(None, description="PROFILING_TOKEN"),
+) -> None:
+    """PROFILING_TOKEN (if set) guards every profiling output."""
+    expected = settings.PROFILING_TOKEN
+    if expected and not hmac.compare_digest(x_omr_profile_token or "", expected):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={"code": "PROFILING_NOT_ALLOWED", "message": "Invalid profiling token"},
+        )
+
+
+@router.get("/profiles/{filename}", dependencies=[Depends(profiling_token)])
+async def download_profile(filename: str) -> FileResponse:
+    """Download a stored profile capture (file name from the result's `profile.file`)."""
+    path = profile_file(filename) if settings.ENABLE_PROFILING else None
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"code": "PROFILE_NOT_FOUND", "message": "Profile not found"},
+        )
+    return FileResponse(path, media_type="application/octet-stream", filename=filename)
+
+
+def sampler_access(_: None = Depends(profiling_token)) -> None:
+    """The sampler must be enabled; PROFILING_TOKEN (if set) guards its output."""
+    if not settings.ENABLE_SAMPLING_PROFILER:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"code": "SAMPLER_DISABLED", "message": "ENABLE_SAMPLING_PROFILER is off"},
+        )
+
+
+@router.get("/sampler", dependencies=[Depends(sampler_access)])
+async def sampler_stats() -> dict:
+    """Continuous sampler state: rate, samples, distinct stacks and measured overhead."""
+    return get_stack_sampler().stats()
+
+
+@router.get(
+    "/sampler/stacks",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(sampler_access)],
+)
+async def sampler_stacks(reset: bool = False) -> PlainTextResponse:
+    """
+    Stacks sampled since start (or the last reset) in collapsed format:
+    `flamegraph.pl stacks.txt > cpu.svg` or drop into speedscope.
+
+    - **reset**: Clear the aggregate after reading (e.g. one window per exam day)
+    """
+    sampler = get_stack_sampler()
+    body = sampler.collapsed()
+    if reset:
+        sampler.reset()
+    return PlainTextResponse(body)
+
+
+@router.post(
+    "/validate-image",
+    response_model=ImageValidationResult,
+    dependencies=[Depends(admission_control)],
+)
 async def validate_image(file: UploadFile = File(...)) -> ImageValidationResult:
     """
     Validate an image for OMR processing.
@@ -372,7 +716,7 @@ async def validate_image(file: UploadFile = File(...)) -> ImageValidationResult:
     try:
         image_data = await file.read()
         validator = ImageValidator()
-        return validator.validate(image_data)
+        return await run_cpu_bound(validator.validate, image_data)
     except Exception as e:
         logger.exception("Error validating image", error=str(e))
         raise HTTPException(
@@ -2,9 +2,10 @@
 
 from fastapi import APIRouter
 
-from app.api.endpoints import health, processing
+from app.api.endpoints import grading, health, processing
 
 router = APIRouter()
 
 router.include_router(health.router, prefix="/health", tags=["health"])
 router.include_router(processing.router, prefix="/processing", tags=["processing"])
+router.include_router(grading.router, prefix="/grading", tags=["grading"])
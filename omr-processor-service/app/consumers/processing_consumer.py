@@ -7,15 +7,46 @@ Publica los resultados en omr.results.
 
 import json
 import asyncio
-from typing import Optional
+import time
+import tracemalloc
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Optional, Set
 import aio_pika
 from aio_pika import IncomingMessage
 import structlog
 
+from app.core.admission import AdmissionRejectedError, estimate_pixels, get_admission_controller
 from app.core.config import settings
+from app.core.deadline import Deadline, DeadlineExceededError
+from app.core.executor import run_cpu_bound, shutdown_processing_executor
+from app.core.metrics import (
+    CONSUMER_IN_FLIGHT,
+    CONSUMER_LAG,
+    CONSUMER_MESSAGES,
+    DOWNLOAD_BYTES,
+    QUEUE_DEPTH,
+    observe_answers,
+    observe_error,
+    observe_stages,
+)
+from app.core.profiling import (
+    PROFILE_HEADER,
+    PROFILE_TOKEN_HEADER,
+    ProfilingNotAllowedError,
+    authorize,
+    run_profiled,
+)
+from app.core.sampler import get_stack_sampler
+from app.core.timing import StageTimer
+from app.services.calibration_cache import calibration_key
+from app.services.exam_stats import get_exam_stats
+from app.services.grading import NO_OPTION, answer_key_vector, key_to_list
+from app.services.grading import percentage as grade_percentage
+from app.services.intensity_store import store_attempt
 from app.services.omr_processor import OMRProcessor
 from app.services.image_validator import ImageValidator
-from app.core.constants import ProcessingStatus, AnswerStatus
+from app.core.constants import ProcessingStatus, AnswerStatus, ErrorCode
 
 logger = structlog.get_logger(__name__)
 
@@ -28,6 +59,9 @@ class ProcessingConsumer:
         self.channel: Optional[aio_pika.Channel] = None
         self.omr_processor = OMRProcessor()
         self.image_validator = ImageValidator()
+        self.concurrency = max(1, settings.CONSUMER_CONCURRENCY)
+        self._tasks: Set[asyncio.Task] = set()
+        self._queue_poller: Optional[asyncio.Task] = None
         
     async def connect(self) -> None:
         """Conectar a RabbitMQ"""
@@ -37,7 +71,7 @@ class ProcessingConsumer:
                 loop=asyncio.get_event_loop()
             )
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=1)
+            await self.channel.set_qos(prefetch_count=self.concurrency)
             
             logger.info(
                 "Conectado a RabbitMQ",
@@ -64,14 +98,58 @@ class ProcessingConsumer:
             durable=True
         )
         
-        logger.info("Iniciando consumo de cola omr.processing")
+        logger.info(
+            "Iniciando consumo de cola omr.processing",
+            concurrency=self.concurrency
+        )
+        
+        if settings.ENABLE_METRICS and settings.METRICS_QUEUE_POLL_S > 0:
+            self._queue_poller = asyncio.create_task(self._poll_queue_depth())
         
         async with processing_queue.iterator() as queue_iter:
             async for message in queue_iter:
-                await self.process_message(message)
+                if self.concurrency == 1:
+                    await self.process_message(message)
+                    continue
+                
+                # El prefetch limita cuántos mensajes hay en vuelo a la vez
+                task = asyncio.create_task(self.process_message(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._on_task_done)
+    
+    async def _poll_queue_depth(self) -> None:
+        """Mensajes listos en las colas (lag del consumer) para /metrics"""
+        while True:
+            for name in ("omr.processing", "omr.results"):
+                try:
+                    queue = await self.channel.declare_queue(name, passive=True)
+                    QUEUE_DEPTH.labels(name).set(queue.declaration_result.message_count)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.debug("No se pudo consultar la cola", queue=name, error=str(e))
+            await asyncio.sleep(settings.METRICS_QUEUE_POLL_S)
+    
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        """Liberar la tarea y consumir su excepción (ya registrada en process_message)"""
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
     
     async def process_message(self, message: IncomingMessage) -> None:
         """Procesar un mensaje de la cola"""
+        if message.timestamp is not None:
+            sent_at = message.timestamp
+            if sent_at.tzinfo is None:
+                sent_at = sent_at.replace(tzinfo=timezone.utc)
+            CONSUMER_LAG.observe(max(0.0, time.time() - sent_at.timestamp()))
+        CONSUMER_IN_FLIGHT.inc()
+        try:
+            await self._process_message(message)
+        finally:
+            CONSUMER_IN_FLIGHT.dec()
+    
+    async def _process_message(self, message: IncomingMessage) -> None:
         async with message.process():
             try:
                 raw_body = json.loads(message.body.decode())
@@ -103,18 +181,36 @@ class ProcessingConsumer:
                         "Mensaje recibido sin attemptId válido, descartando",
                         raw_body=str(raw_body)[:500]
                     )
+                    CONSUMER_MESSAGES.labels("discarded").inc()
                     return  # Descartar mensaje inválido
                 
+                # Deadline opcional (headers x-deadline / x-time-budget-ms)
+                deadline = self._deadline(message.headers, message.timestamp, body)
+                
+                # Profiling opcional de la hoja (propiedad x-omr-profile o campo profile)
+                profile_format = self._profile_format(message.headers, body)
+                
                 # Procesar la imagen
-                result = await self.process_student_answer(body)
+                result = await self.process_student_answer(
+                    body, deadline=deadline, profile_format=profile_format
+                )
                 
-                # Publicar resultado
-                await self.publish_result(result)
+                # Publicar resultado (no entra en processingSteps: el mensaje ya está armado)
+                publish_timer = StageTimer()
+                with publish_timer.stage("publish"):
+                    await self.publish_result(result)
                 
+                # Agregados del examen en vivo (O(preguntas) por hoja)
+                if settings.ENABLE_EXAM_STATS:
+                    get_exam_stats().record(result)
+                
+                CONSUMER_MESSAGES.labels("ack").inc()
                 logger.info(
                     "Mensaje procesado exitosamente",
                     attempt_id=body.get("attemptId"),
-                    success=result.get("success")
+                    success=result.get("success"),
+                    duration_ms=result.get("durationMs"),
+                    publish_ms=publish_timer.rounded(1)["publish"]
                 )
                 
             except Exception as e:
@@ -123,15 +219,56 @@ class ProcessingConsumer:
                     error=str(e),
                     message_body=message.body.decode()[:200]
                 )
+                CONSUMER_MESSAGES.labels("reject").inc()
                 # El mensaje se rechaza y reencola automáticamente
                 raise
     
-    async def process_student_answer(self, data: dict) -> dict:
+    def _deadline(
+        self, headers: Optional[dict], sent_at: Optional[datetime], body: dict
+    ) -> Optional[Deadline]:
+        """Deadline del mensaje; headers inválidos se ignoran (queda el presupuesto por defecto)"""
+        try:
+            return Deadline.from_headers(headers, sent_at=sent_at)
+        except ValueError as e:
+            logger.warning(
+                "Deadline inválido ignorado",
+                attempt_id=body.get("attemptId"),
+                reason=str(e)
+            )
+            return Deadline.from_headers(None, sent_at=sent_at)
+    
+    def _profile_format(self, headers: Optional[dict], body: dict) -> Optional[str]:
+        """Formato de profiling pedido por el mensaje; None si no se pidió o no se permite"""
+        normalized = {str(k).lower(): v for k, v in (headers or {}).items()}
+        value = normalized.get(PROFILE_HEADER, body.get("profile"))
+        token = normalized.get(PROFILE_TOKEN_HEADER, body.get("profileToken"))
+        if isinstance(value, bytes):
+            value = value.decode()
+        if isinstance(token, bytes):
+            token = token.decode()
+        try:
+            return authorize(value, token)
+        except (ProfilingNotAllowedError, ValueError) as e:
+            logger.warning(
+                "Profiling solicitado e ignorado",
+                attempt_id=body.get("attemptId"),
+                reason=str(e)
+            )
+            return None
+    
+    async def process_student_answer(
+        self,
+        data: dict,
+        deadline: Optional[Deadline] = None,
+        profile_format: Optional[str] = None
+    ) -> dict:
         """
         Procesar respuesta de estudiante usando el OMRProcessor real
         
         Args:
             data: Mensaje con imageUrl, answerKey, etc.
+            deadline: Deadline del job; si ya venció se descarta sin procesar
+            profile_format: pstats | collapsed para perfilar esta hoja (ver app.core.profiling)
             
         Returns:
             Resultado del procesamiento
@@ -143,6 +280,23 @@ class ProcessingConsumer:
         answer_key = data.get("answerKey", [])
         total_questions = data.get("totalQuestions", 100)
         options_per_question = data.get("optionsPerQuestion", 5)
+        engine = data.get("engine")  # Opcional: motor de detección
+        template = data.get("template")  # Opcional: plantilla de hoja
+        # Opcional: lote/dispositivo del escáner para reutilizar la calibración
+        cache_key = calibration_key(exam_id, data.get("batchId"), data.get("deviceId"))
+        capture_mode = data.get("captureMode")  # Opcional: auto | photo | scanner
+        # Tiempos por etapa (descarga, OMR, scoring) para ProcessingLog.processingSteps
+        timer = StageTimer()
+        
+        if deadline is not None and deadline.expired():
+            logger.warning(
+                "Deadline vencido, mensaje descartado sin procesar",
+                attempt_id=attempt_id,
+                overdue_ms=round(-deadline.remaining_ms())
+            )
+            return self._error_result(
+                data, ErrorCode.DEADLINE_EXCEEDED.value, "Deadline exceeded before processing", timer
+            )
         
         try:
             logger.info(
@@ -154,10 +308,12 @@ class ProcessingConsumer:
             
             # 1. Descargar imagen desde la URL (MinIO/S3)
             import httpx
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(image_url)
-                response.raise_for_status()
-                image_data = response.content
+            with timer.stage("download"):
+                async with httpx.AsyncClient(timeout=30.0) as client:
+                    response = await client.get(image_url)
+                    response.raise_for_status()
+                    image_data = response.content
+            DOWNLOAD_BYTES.inc(len(image_data))
             
             logger.info(
                 "Imagen descargada",
@@ -165,54 +321,88 @@ class ProcessingConsumer:
                 size_bytes=len(image_data)
             )
             
-            # 2. Procesar imagen con OMRProcessor
-            omr_result = self.omr_processor.process_image(
-                image_data=image_data,
-                total_questions=total_questions,
-                options_per_question=options_per_question
+            # 2. Procesar imagen con OMRProcessor (en el executor, fuera del event loop)
+            # El consumer comparte el presupuesto de admisión con la API, pero espera
+            # en lugar de rechazar: el mensaje ya está en la cola. Con deadline la
+            # espera no pasa del tiempo que le queda al job.
+            max_wait_s = None if deadline is None else max(0.0, deadline.remaining_ms() / 1000)
+            admission = (
+                get_admission_controller().admit(
+                    estimate_pixels(image_data), block=True, max_wait_s=max_wait_s
+                )
+                if settings.ENABLE_ADMISSION_CONTROL
+                else nullcontext()
             )
+            async with admission:
+                omr_result, profile = await run_cpu_bound(
+                    run_profiled,
+                    profile_format,
+                    attempt_id,
+                    self.omr_processor.process_image,
+                    image_data=image_data,
+                    total_questions=total_questions,
+                    options_per_question=options_per_question,
+                    deadline=deadline,
+                    engine=engine,
+                    template=template,
+                    calibration={"key": cache_key} if cache_key else None,
+                    capture_mode=capture_mode,
+                    timer=timer
+                )
             
-            # 3. Comparar con answer_key y calcular score
-            detected_answers = []
-            correct_count = 0
-            incorrect_count = 0
-            blank_count = 0
+            # answer_key es una lista de listas: [[0], [3], [4], ...]
+            # donde cada sublista contiene la opción correcta (0-indexed)
+            key = answer_key_vector(answer_key, total_questions)
             
-            for answer in omr_result.answers:
-                q_num = answer.question_number
-                selected = answer.selected_option
-                
-                # Obtener respuesta correcta del answer_key
-                # answer_key es una lista de listas: [[0], [3], [4], ...]
-                # donde cada sublista contiene la opción correcta (0-indexed)
-                correct = None
-                if q_num <= len(answer_key) and answer_key[q_num - 1]:
-                    correct = answer_key[q_num - 1][0] if isinstance(answer_key[q_num - 1], list) else answer_key[q_num - 1]
-                
-                # Determinar si es correcto
-                is_correct = False
-                if selected is not None and correct is not None:
-                    is_correct = selected == correct
+            # Matriz de intensidades (y clave usada) para re-decidir / re-calificar sin reprocesar.
+            # Sin answerKey no se guarda clave: una re-calificación no tiene contra qué comparar
+            stored_key = key_to_list(key) if (key != NO_OPTION).any() else None
+            with timer.stage("store"):
+                await run_cpu_bound(store_attempt, attempt_id, exam_id, omr_result, stored_key)
+            
+            # 3. Comparar con answer_key y calcular score
+            with timer.stage("scoring"):
+                detected_answers = []
+                correct_count = 0
+                incorrect_count = 0
+                blank_count = 0
                 
-                # Contabilizar
-                if answer.status == AnswerStatus.BLANK or selected is None:
-                    blank_count += 1
-                elif is_correct:
-                    correct_count += 1
-                else:
-                    incorrect_count += 1
+                for answer in omr_result.answers:
+                    q_num = answer.question_number
+                    selected = answer.selected_option
+                    
+                    # Obtener respuesta correcta del answer_key
+                    correct = None
+                    if q_num <= len(key) and key[q_num - 1] != NO_OPTION:
+                        correct = int(key[q_num - 1])
+                    
+                    # Determinar si es correcto
+                    is_correct = False
+                    if selected is not None and correct is not None:
+                        is_correct = selected == correct
+                    
+                    # Contabilizar
+                    if answer.status == AnswerStatus.BLANK or selected is None:
+                        blank_count += 1
+                    elif is_correct:
+                        correct_count += 1
+                    else:
+                        incorrect_count += 1
+                    
+                    detected_answers.append({
+                        "questionNumber": q_num,
+                        "selectedOption": selected,
+                        "correctOption": correct,
+                        "isCorrect": is_correct,
+                        "status": answer.status.value if hasattr(answer.status, 'value') else str(answer.status),
+                        "confidenceScore": answer.confidence_score
+                    })
                 
-                detected_answers.append({
-                    "questionNumber": q_num,
-                    "selectedOption": selected,
-                    "correctOption": correct,
-                    "isCorrect": is_correct,
-                    "status": answer.status.value if hasattr(answer.status, 'value') else str(answer.status),
-                    "confidenceScore": answer.confidence_score
-                })
+                score = correct_count
+                percentage = grade_percentage(correct_count, total_questions)
             
-            score = correct_count
-            percentage = round((correct_count / total_questions) * 100, 2) if total_questions > 0 else 0
+            observe_stages(timer, "consumer", omr_result.engine)
+            observe_answers((a["status"] for a in detected_answers), "consumer")
             
             logger.info(
                 "Procesamiento completado",
@@ -225,7 +415,7 @@ class ProcessingConsumer:
                 confidence=omr_result.confidence_score
             )
             
-            return {
+            result = {
                 "attemptId": attempt_id,
                 "examId": exam_id,
                 "studentId": student_id,
@@ -237,9 +427,39 @@ class ProcessingConsumer:
                 "totalQuestions": total_questions,
                 "percentage": percentage,
                 "confidenceScore": omr_result.confidence_score,
+                "degraded": omr_result.degraded,
+                "engine": omr_result.engine,
+                "stageTimingsMs": timer.rounded(),
+                "processingSteps": timer.steps(),
+                "durationMs": round(timer.total_ms()),
+                "captureMode": omr_result.capture_mode,
                 "answers": detected_answers,
                 "processedAt": self._get_timestamp()
             }
+            if timer.peak_bytes:
+                result["stagePeakBytes"] = dict(timer.peak_bytes)
+            if profile is not None:
+                result["profile"] = profile.to_dict()
+            return result
+            
+        except DeadlineExceededError as e:
+            logger.warning(
+                "Deadline vencido durante el procesamiento",
+                attempt_id=attempt_id,
+                stage=e.stage
+            )
+            return self._error_result(data, ErrorCode.DEADLINE_EXCEEDED.value, str(e), timer)
+        
+        except AdmissionRejectedError:
+            # Solo con deadline: venció esperando presupuesto, no se procesa
+            logger.warning(
+                "Deadline vencido esperando admisión",
+                attempt_id=attempt_id,
+                overdue_ms=round(-deadline.remaining_ms())
+            )
+            return self._error_result(
+                data, ErrorCode.DEADLINE_EXCEEDED.value, str(DeadlineExceededError("admission")), timer
+            )
             
         except Exception as e:
             logger.error(
@@ -247,17 +467,28 @@ class ProcessingConsumer:
                 attempt_id=attempt_id,
                 error=str(e)
             )
-            return {
-                "attemptId": attempt_id,
-                "examId": exam_id,
-                "studentId": student_id,
-                "success": False,
-                "error": {
-                    "code": "PROCESSING_ERROR",
-                    "message": str(e)
-                },
-                "processedAt": self._get_timestamp()
-            }
+            return self._error_result(data, ErrorCode.PROCESSING_ERROR.value, str(e), timer)
+    
+    def _error_result(
+        self, data: dict, code: str, message: str, timer: Optional[StageTimer] = None
+    ) -> dict:
+        """Construir resultado de error para omr.results (con las etapas alcanzadas)"""
+        observe_error(code, "consumer")
+        result = {
+            "attemptId": data.get("attemptId"),
+            "examId": data.get("examId"),
+            "studentId": data.get("studentId"),
+            "success": False,
+            "error": {
+                "code": code,
+                "message": message
+            },
+            "processedAt": self._get_timestamp()
+        }
+        if timer is not None:
+            result["processingSteps"] = timer.steps()
+            result["durationMs"] = round(timer.total_ms())
+        return result
     
     async def publish_result(self, result: dict) -> None:
         """Publicar resultado en cola omr.results"""
@@ -287,6 +518,8 @@ class ProcessingConsumer:
     
     async def close(self) -> None:
         """Cerrar conexión"""
+        if self._queue_poller is not None:
+            self._queue_poller.cancel()
         if self.connection:
             await self.connection.close()
             logger.info("Desconectado de RabbitMQ")
@@ -296,6 +529,10 @@ class ProcessingConsumer:
 async def main():
     """Ejecutar consumer"""
     consumer = ProcessingConsumer()
+    if settings.ENABLE_SAMPLING_PROFILER:
+        get_stack_sampler().start()
+    if settings.ENABLE_MEMORY_PROFILING:
+        tracemalloc.start(settings.MEMORY_PROFILING_FRAMES)
     
     try:
         await consumer.connect()
@@ -304,6 +541,8 @@ async def main():
         logger.info("Consumer detenido por usuario")
     finally:
         await consumer.close()
+        shutdown_processing_executor()
+        get_stack_sampler().stop()
 
 
 if __name__ == "__main__":
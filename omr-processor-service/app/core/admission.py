@@ -0,0 +1,148 @@
+"""Cost-aware admission control for processing work.
+
+In-flight work is budgeted by decoded pixel count (memory) and CPU slots
+(executor workers). When the budget is exhausted a request waits briefly and
+is then rejected, so callers get a fast 429 instead of an unbounded queue.
+"""
+
+import asyncio
+import io
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, BinaryIO, Optional, Union
+
+import structlog
+from PIL import Image
+
+from app.core.config import settings
+from app.core.constants import MAX_IMAGE_HEIGHT, MAX_IMAGE_WIDTH
+from app.core.executor import get_worker_count
+
+logger = structlog.get_logger()
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when the processing budget is saturated."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_pixels(image: Union[bytes, BinaryIO]) -> int:
+    """
+    Estimate decoded pixel count from the image header (no full decode).
+    Unreadable images are charged at the maximum accepted size.
+    File objects are rewound to their original position.
+    """
+    fp = io.BytesIO(image) if isinstance(image, bytes) else image
+    position = fp.tell()
+    try:
+        with Image.open(fp) as img:
+            width, height = img.size
+        return width * height
+    except Exception:
+        return MAX_IMAGE_WIDTH * MAX_IMAGE_HEIGHT
+    finally:
+        fp.seek(position)
+
+
+class AdmissionController:
+    """Budgets in-flight sheets by decoded pixels and CPU slots."""
+
+    def __init__(
+        self,
+        max_pixels: int,
+        max_slots: int,
+        max_wait_s: float,
+        retry_after_s: int,
+    ):
+        self.max_pixels = max_pixels
+        self.max_slots = max_slots
+        self.max_wait_s = max_wait_s
+        self.retry_after_s = retry_after_s
+        self.in_flight_pixels = 0
+        self.in_flight_slots = 0
+        self.rejected_total = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _fits(self, pixels: int) -> bool:
+        if self.in_flight_slots >= self.max_slots:
+            return False
+        # An oversized sheet is still admitted when it can run alone
+        if self.in_flight_slots == 0:
+            return True
+        return self.in_flight_pixels + pixels <= self.max_pixels
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        pixels: int,
+        block: bool = False,
+        max_wait_s: Optional[float] = None,
+    ) -> AsyncIterator[None]:
+        """
+        Reserve budget for one sheet for the duration of the context.
+
+        Args:
+            pixels: Decoded pixel count of the sheet
+            block: Wait without timeout instead of rejecting (queue consumers),
+                unless max_wait_s caps the wait
+            max_wait_s: Override the configured wait (e.g. capped by a deadline)
+
+        Raises:
+            AdmissionRejectedError: If the budget does not free up within max_wait_s
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        condition = self._condition
+        wait_s = self.max_wait_s if max_wait_s is None else max_wait_s
+
+        async with condition:
+            if not self._fits(pixels):
+                try:
+                    if block and max_wait_s is None:
+                        await condition.wait_for(lambda: self._fits(pixels))
+                    elif wait_s > 0:
+                        await asyncio.wait_for(
+                            condition.wait_for(lambda: self._fits(pixels)),
+                            timeout=wait_s,
+                        )
+                    else:
+                        raise asyncio.TimeoutError
+                except asyncio.TimeoutError:
+                    self.rejected_total += 1
+                    logger.warning(
+                        "Admission rejected",
+                        pixels=pixels,
+                        in_flight_pixels=self.in_flight_pixels,
+                        in_flight_slots=self.in_flight_slots,
+                    )
+                    raise AdmissionRejectedError(
+                        retry_after=self.retry_after_s,
+                        reason="Processing capacity exhausted",
+                    ) from None
+
+            self.in_flight_pixels += pixels
+            self.in_flight_slots += 1
+
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight_pixels -= pixels
+                self.in_flight_slots -= 1
+                condition.notify_all()
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    """Get the process-wide admission controller."""
+    max_slots = settings.ADMISSION_MAX_SLOTS or get_worker_count()
+    return AdmissionController(
+        max_pixels=int(settings.ADMISSION_MAX_MEGAPIXELS * 1_000_000),
+        max_slots=max_slots,
+        max_wait_s=settings.ADMISSION_MAX_WAIT_MS / 1000.0,
+        retry_after_s=settings.ADMISSION_RETRY_AFTER_S,
+    )
@@ -87,6 +87,25 @@ GIB_DNIVEL_CONFIG: Final[dict] = {
     "answer_area_right_percent": 0.98,
 }
 
+# Marcas de sincronismo (motor "timing-marks"): una marca por fila de preguntas
+# en el margen lateral y una por columna de burbujas en el margen superior/inferior.
+# Las plantillas pueden sobreescribirlo con una entrada "timing_marks".
+TIMING_MARK_DEFAULTS: Final[dict] = {
+    "row_edge": "left",        # left | right
+    "column_edge": "top",      # top | bottom
+    "strip_percent": 0.08,     # Ancho de la franja del margen donde buscar
+    "max_residual": 0.05,      # Desvío máximo de una marca respecto del ajuste (fracción del paso)
+    "max_skew_mismatch": 0.005,  # Diferencia máxima de inclinación entre ambas franjas
+}
+
+# Plantillas de hoja: layout + motor de detección opcional ("engine").
+# Sin "engine" se usa settings.OMR_ENGINE.
+SHEET_TEMPLATES: Final[dict] = {
+    "gib-dnivel": GIB_DNIVEL_CONFIG,
+}
+
+DEFAULT_SHEET_TEMPLATE: Final[str] = "gib-dnivel"
+
 # ============================================
 # Quality Thresholds
 # ============================================
@@ -116,4 +135,5 @@ class ErrorCode(str, Enum):
     MULTIPLE_MARKS = "MULTIPLE_MARKS"
     INVALID_FORMAT = "INVALID_FORMAT"
     TIMING_MARKS_NOT_FOUND = "TIMING_MARKS_NOT_FOUND"
+    DEADLINE_EXCEEDED = "DEADLINE_EXCEEDED"
     PROCESSING_ERROR = "PROCESSING_ERROR"
@@ -0,0 +1,106 @@
+"""Deadlines (time budgets) propagated from HTTP headers or message properties."""
+
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Mapping, Optional
+
+from app.core.config import settings
+
+# Header names (HTTP headers are matched case-insensitively)
+DEADLINE_HEADER = "x-deadline"  # Absolute deadline, Unix epoch milliseconds
+TIME_BUDGET_HEADER = "x-time-budget-ms"  # Relative budget in milliseconds
+
+
+def _milliseconds(name: str, value: Any) -> float:
+    """Header value as a finite number of milliseconds (ValueError otherwise)."""
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} header: {value!r}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid {name} header: {value!r} is not finite")
+    return number
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a job runs past its deadline."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before stage '{stage}'")
+        self.stage = stage
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """A point in time (monotonic clock) by which a job must finish."""
+
+    expires_at: float
+
+    @classmethod
+    def after_ms(cls, budget_ms: float, start: Optional[float] = None) -> "Deadline":
+        """Deadline `budget_ms` after `start` (monotonic seconds, default now)."""
+        start = time.monotonic() if start is None else start
+        return cls(expires_at=start + budget_ms / 1000.0)
+
+    @classmethod
+    def at_epoch_ms(cls, epoch_ms: float) -> "Deadline":
+        """Deadline at an absolute wall-clock time (Unix epoch milliseconds)."""
+        remaining_s = epoch_ms / 1000.0 - time.time()
+        return cls(expires_at=time.monotonic() + remaining_s)
+
+    @classmethod
+    def from_headers(
+        cls,
+        headers: Optional[Mapping[str, Any]],
+        sent_at: Optional[datetime] = None,
+    ) -> Optional["Deadline"]:
+        """
+        Build a deadline from request/message headers.
+
+        `x-deadline` (epoch ms) wins over `x-time-budget-ms`. A relative budget
+        counts from `sent_at` when known (e.g. AMQP timestamp), otherwise from now.
+        Falls back to DEFAULT_TIME_BUDGET_MS; returns None when there is no budget.
+
+        Raises:
+            ValueError: A header is not a finite number (e.g. "abc", "nan", "inf")
+        """
+        normalized = {str(k).lower(): v for k, v in (headers or {}).items()}
+
+        absolute = normalized.get(DEADLINE_HEADER)
+        if absolute not in (None, ""):
+            return cls.at_epoch_ms(_milliseconds(DEADLINE_HEADER, absolute))
+
+        budget = normalized.get(TIME_BUDGET_HEADER)
+        if budget in (None, ""):
+            if settings.DEFAULT_TIME_BUDGET_MS <= 0:
+                return None
+            budget = settings.DEFAULT_TIME_BUDGET_MS
+        budget = _milliseconds(TIME_BUDGET_HEADER, budget)
+
+        start = None
+        if sent_at is not None:
+            if sent_at.tzinfo is None:
+                sent_at = sent_at.replace(tzinfo=timezone.utc)
+            age_s = time.time() - sent_at.timestamp()
+            start = time.monotonic() - max(0.0, age_s)
+        return cls.after_ms(budget, start=start)
+
+    def remaining_ms(self) -> float:
+        """Milliseconds left (negative once expired)."""
+        return (self.expires_at - time.monotonic()) * 1000.0
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+    def is_tight(self) -> bool:
+        """Whether slow optional stages should be skipped."""
+        return self.remaining_ms() < settings.DEADLINE_TIGHT_MS
+
+    def check(self, stage: str) -> None:
+        """Raise DeadlineExceededError if the deadline already passed."""
+        if self.expired():
+            raise DeadlineExceededError(stage)
@@ -0,0 +1,79 @@
+"""Dedicated executor for CPU-bound OMR work.
+
+OpenCV and NumPy release the GIL inside their heavy kernels, so a thread pool
+keeps the event loop free (health checks, uploads, RabbitMQ heartbeats) while
+sheets are processed in parallel across cores.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+# Separate small pool for intra-sheet work (OMR_PARALLEL_COLUMNS): tasks
+# submitted from a processing worker must not wait behind other sheets.
+_column_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_worker_count() -> int:
+    """Number of worker threads (PROCESSING_WORKERS=0 means one per CPU)."""
+    if settings.PROCESSING_WORKERS > 0:
+        return settings.PROCESSING_WORKERS
+    return os.cpu_count() or 1
+
+
+def get_processing_executor() -> ThreadPoolExecutor:
+    """Get (lazily creating) the shared processing executor."""
+    global _executor
+    if _executor is None:
+        workers = get_worker_count()
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="omr-worker")
+        logger.info("Processing executor started", workers=workers)
+    return _executor
+
+
+def get_column_executor() -> ThreadPoolExecutor:
+    """Get (lazily creating) the per-sheet column executor."""
+    global _column_executor
+    if _column_executor is None:
+        workers = settings.COLUMN_WORKERS or min(4, os.cpu_count() or 1)
+        _column_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="omr-column")
+        logger.info("Column executor started", workers=workers)
+    return _column_executor
+
+
+def get_queued_tasks() -> int:
+    """Tasks submitted to the processing executor and not yet started."""
+    if _executor is None:
+        return 0
+    return _executor._work_queue.qsize()
+
+
+async def run_cpu_bound(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function on the processing executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_processing_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_processing_executor() -> None:
+    """Shut down the executors, waiting for in-flight sheets to finish."""
+    global _executor, _column_executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+        logger.info("Processing executor stopped")
+    if _column_executor is not None:
+        _column_executor.shutdown(wait=True, cancel_futures=True)
+        _column_executor = None
@@ -0,0 +1,162 @@
+"""Prometheus metrics.
+
+Hot-path instrumentation is a handful of lock-protected additions per sheet
+(stage histograms, answer/error counters). Values that already live in other
+components (admission budget, executor queue, calibration cache, exam stats)
+are read by a collector at scrape time instead of being mirrored on every
+change, so leaving /metrics on costs nothing between scrapes.
+"""
+
+import tracemalloc
+from typing import Iterable, Optional
+
+from prometheus_client import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from app.core.admission import get_admission_controller
+from app.core.config import settings
+from app.core.executor import get_queued_tasks
+from app.core.timing import StageTimer
+from app.services.calibration_cache import get_calibration_cache
+from app.services.exam_stats import get_exam_stats
+
+# Stage latencies span sub-millisecond (decide) to tens of seconds (download, locate)
+STAGE_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+# Per-stage allocation peaks: 64 KiB .. 1 GiB
+MEMORY_BUCKETS = tuple(float(2 ** exponent) for exponent in range(16, 31, 2))
+REQUEST_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_DURATION = Histogram(
+    "omr_stage_duration_seconds",
+    "Exclusive duration of each processing stage",
+    ["stage", "source"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_PEAK_BYTES = Histogram(
+    "omr_stage_peak_bytes",
+    "Peak traced allocation of each stage (ENABLE_MEMORY_PROFILING)",
+    ["stage", "source"],
+    buckets=MEMORY_BUCKETS,
+)
+SHEET_DURATION = Histogram(
+    "omr_sheet_duration_seconds",
+    "End-to-end duration of one sheet",
+    ["source", "engine"],
+    buckets=REQUEST_BUCKETS,
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "omr_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=REQUEST_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("omr_http_requests_in_flight", "HTTP requests being served")
+ANSWERS = Counter("omr_answers_total", "Detected answers by status", ["status", "source"])
+ERRORS = Counter("omr_errors_total", "Processing errors by error code", ["code", "source"])
+DOWNLOAD_BYTES = Counter("omr_download_bytes_total", "Image bytes downloaded by the consumer")
+CONSUMER_MESSAGES = Counter(
+    "omr_consumer_messages_total", "omr.processing messages by outcome", ["outcome"]
+)
+CONSUMER_IN_FLIGHT = Gauge("omr_consumer_messages_in_flight", "Messages being processed")
+CONSUMER_LAG = Histogram(
+    "omr_consumer_lag_seconds",
+    "Time between a message being published and picked up",
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0),
+)
+QUEUE_DEPTH = Gauge("omr_queue_messages", "Ready messages in a RabbitMQ queue", ["queue"])
+
+
+def observe_stages(timer: StageTimer, source: str, engine: Optional[str] = None) -> None:
+    """Record every stage of a sheet's timer and its total duration."""
+    for stage, ms in timer.timings_ms.items():
+        STAGE_DURATION.labels(stage, source).observe(ms / 1000)
+    for stage, peak in timer.peak_bytes.items():
+        STAGE_PEAK_BYTES.labels(stage, source).observe(peak)
+    SHEET_DURATION.labels(source, engine or "unknown").observe(timer.total_ms() / 1000)
+
+
+def observe_answers(statuses: Iterable[str], source: str) -> None:
+    counts: dict = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    for status, count in counts.items():
+        ANSWERS.labels(status, source).inc(count)
+
+
+def observe_error(code: str, source: str) -> None:
+    ERRORS.labels(code, source).inc()
+
+
+class _StateCollector(Collector):
+    """Scrape-time view of the admission budget, executor and caches."""
+
+    def collect(self):
+        admission = get_admission_controller()
+        yield GaugeMetricFamily(
+            "omr_admission_in_flight_slots", "Sheets holding an admission slot",
+            value=admission.in_flight_slots,
+        )
+        yield GaugeMetricFamily(
+            "omr_admission_in_flight_pixels", "Decoded pixels admitted in flight",
+            value=admission.in_flight_pixels,
+        )
+        yield GaugeMetricFamily(
+            "omr_admission_max_slots", "Admission slot budget", value=admission.max_slots,
+        )
+        yield CounterMetricFamily(
+            "omr_admission_rejected", "Requests shed with 429", value=admission.rejected_total,
+        )
+
+        yield GaugeMetricFamily(
+            "omr_executor_queued_tasks", "Tasks waiting for a processing worker",
+            value=get_queued_tasks(),
+        )
+
+        if tracemalloc.is_tracing():
+            current, _ = tracemalloc.get_traced_memory()
+            yield GaugeMetricFamily(
+                "omr_traced_memory_bytes", "Python allocations traced by tracemalloc",
+                value=current,
+            )
+
+        if settings.ENABLE_CALIBRATION_CACHE:
+            cache = get_calibration_cache()
+            lookups = CounterMetricFamily(
+                "omr_calibration_cache_lookups", "Calibration cache lookups by result",
+                labels=["result"],
+            )
+            lookups.add_metric(["hit"], cache.hits)
+            lookups.add_metric(["miss"], cache.misses)
+            lookups.add_metric(["rejected"], cache.rejected)
+            yield lookups
+
+        if settings.ENABLE_EXAM_STATS:
+            yield GaugeMetricFamily(
+                "omr_exam_stats_exams", "Exams with live statistics in memory",
+                value=len(get_exam_stats().exam_ids()),
+            )
+
+
+_collector_registered = False
+
+
+def setup_metrics() -> None:
+    """Register the scrape-time collector once per process."""
+    global _collector_registered
+    if not _collector_registered:
+        REGISTRY.register(_StateCollector())
+        _collector_registered = True
+
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
+
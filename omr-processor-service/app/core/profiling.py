@@ -0,0 +1,239 @@
+"""On-demand profiling of a single sheet.
+
+A request (X-OMR-Profile header / `profile` form field) or a queue message
+(`x-omr-profile` header / `profile` field) can ask for its sheet to run under
+a deterministic profiler. Profiling must be enabled by config and, when
+PROFILING_TOKEN is set, the caller must present it. The dump is written to
+PROFILE_OUTPUT_DIR next to a short summary returned with the result:
+
+- "pstats": cProfile stats (snakeviz, `python -m pstats`)
+- "collapsed": full call stacks with self time in microseconds, one
+  "a;b;c <us>" line per stack (flamegraph.pl, speedscope)
+
+Only the thread running the sheet is profiled: per-column work farmed
+out with OMR_PARALLEL_COLUMNS shows up as time waiting on its futures.
+"""
+
+import cProfile
+import hmac
+import os
+import pstats
+import re
+import sys
+import time
+import types
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+PROFILE_FORMATS = ("pstats", "collapsed")
+PROFILE_HEADER = "x-omr-profile"
+PROFILE_TOKEN_HEADER = "x-omr-profile-token"
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+_SUMMARY_SIZE = 15
+
+
+def frame_label(frame: Any) -> str:
+    """module.qualname of a Python frame, as used in collapsed stacks."""
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class ProfilingNotAllowedError(Exception):
+    """Raised when a profile is requested but not allowed by config/token."""
+
+
+def requested_format(value: Optional[str]) -> Optional[str]:
+    """Profile format asked for by a header/field value (None = not requested)."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in _TRUE_VALUES:
+        return settings.PROFILE_FORMAT
+    if value not in PROFILE_FORMATS:
+        raise ValueError(f"Unknown profile format '{value}' (use {', '.join(PROFILE_FORMATS)})")
+    return value
+
+
+def authorize(value: Optional[str], token: Optional[str]) -> Optional[str]:
+    """
+    Format to profile with, or None when not requested.
+
+    Raises:
+        ProfilingNotAllowedError: Requested while ENABLE_PROFILING is off or with a bad token
+        ValueError: Unknown format
+    """
+    fmt = requested_format(value)
+    if fmt is None:
+        return None
+    if not settings.ENABLE_PROFILING:
+        raise ProfilingNotAllowedError("Profiling is disabled (ENABLE_PROFILING)")
+    expected = settings.PROFILING_TOKEN
+    if expected and not hmac.compare_digest(str(token or ""), expected):
+        raise ProfilingNotAllowedError("Invalid profiling token")
+    return fmt
+
+
+@dataclass
+class ProfileCapture:
+    """Where a profile was stored and its hottest entries."""
+    format: str
+    path: str
+    duration_ms: float
+    top: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "file": self.filename,
+            "durationMs": round(self.duration_ms, 3),
+            "top": self.top,
+        }
+
+
+class CollapsedStackProfiler:
+    """
+    Deterministic profiler recording self time per full call stack
+    (Python and C calls), via sys.setprofile on the current thread.
+    """
+
+    def __init__(self) -> None:
+        self.self_ns: Dict[str, int] = defaultdict(int)
+        self._stack: List[List[Any]] = []  # [frame label, start ns, child ns]
+        self._names: List[str] = []
+
+    @staticmethod
+    def _label(frame: Any, event: str, arg: Any) -> str:
+        if event == "c_call":
+            owner = getattr(arg, "__self__", None)
+            if isinstance(owner, types.ModuleType):
+                module = owner.__name__
+            elif owner is not None:
+                module = type(owner).__name__
+            else:
+                module = getattr(arg, "__module__", None)  # None for extension functions (cv2)
+            name = getattr(arg, "__name__", repr(arg))
+            return f"{module}.{name}" if module else name
+        return frame_label(frame)
+
+    def _callback(self, frame: Any, event: str, arg: Any) -> None:
+        now = time.perf_counter_ns()
+        if event in ("call", "c_call"):
+            label = self._label(frame, event, arg)
+            self._stack.append([label, now, 0])
+            self._names.append(label)
+        elif event in ("return", "c_return", "c_exception") and self._stack:
+            _, start, child_ns = self._stack.pop()
+            key = ";".join(self._names)
+            self._names.pop()
+            elapsed = now - start
+            self.self_ns[key] += elapsed - child_ns
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def enable(self) -> None:
+        sys.setprofile(self._callback)
+
+    def disable(self) -> None:
+        sys.setprofile(None)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, ns in sorted(self.self_ns.items()):
+                us = ns // 1000
+                if us > 0:
+                    fh.write(f"{stack} {us}\n")
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        by_function: Dict[str, int] = defaultdict(int)
+        for stack, ns in self.self_ns.items():
+            by_function[stack.rsplit(";", 1)[-1]] += ns
+        ranked = sorted(by_function.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{"function": name, "selfMs": round(ns / 1e6, 3)} for name, ns in ranked]
+
+
+def _cprofile_top(profiler: cProfile.Profile, limit: int) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profiler)
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "selfMs": round(self_s * 1000, 3),
+            "cumulativeMs": round(cum_s * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, self_s, cum_s, _) in ranked
+    ]
+
+
+def _profile_path(label: Optional[str], fmt: str) -> str:
+    os.makedirs(settings.PROFILE_OUTPUT_DIR, exist_ok=True)
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", label or "sheet")[:80]
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    extension = "prof" if fmt == "pstats" else "collapsed"
+    filename = f"{safe}-{stamp}-{uuid.uuid4().hex[:8]}.{extension}"
+    return os.path.join(settings.PROFILE_OUTPUT_DIR, filename)
+
+
+def run_profiled(
+    fmt: Optional[str],
+    label: Optional[str],
+    func: Callable[..., T],
+    *args: Any,
+    **kwargs: Any,
+) -> Tuple[T, Optional[ProfileCapture]]:
+    """
+    Call `func` (in the current thread), under the `fmt` profiler when given.
+    The dump is written even if `func` raises; a failure to write it is
+    logged and never fails the sheet.
+    """
+    if fmt is None:
+        return func(*args, **kwargs), None
+
+    profiler = cProfile.Profile() if fmt == "pstats" else CollapsedStackProfiler()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+        capture = None
+        try:
+            path = _profile_path(label, fmt)
+            if fmt == "pstats":
+                profiler.dump_stats(path)
+                top = _cprofile_top(profiler, _SUMMARY_SIZE)
+            else:
+                profiler.dump(path)
+                top = profiler.top(_SUMMARY_SIZE)
+            capture = ProfileCapture(format=fmt, path=path, duration_ms=duration_ms, top=top)
+            logger.info("Profile captured", label=label, format=fmt, path=path,
+                        duration_ms=round(duration_ms, 1))
+        except Exception as e:
+            logger.warning("Could not write profile", label=label, error=str(e))
+    return result, capture
+
+
+def profile_file(filename: str) -> Optional[str]:
+    """Path of a stored profile by file name (None if missing or not a plain name)."""
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        return None
+    path = os.path.join(settings.PROFILE_OUTPUT_DIR, filename)
+    return path if os.path.isfile(path) else None
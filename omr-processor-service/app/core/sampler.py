@@ -0,0 +1,197 @@
+"""Continuous low-overhead stack sampling.
+
+A daemon thread wakes SAMPLING_PROFILER_HZ times per second, reads the
+current frame of the selected threads (sys._current_frames) and counts each
+stack as one collapsed line "thread;module.func;... <samples>". Counts
+aggregate in memory across all sheets, so the output is a flame graph of
+where CPU goes over thousands of sheets (flamegraph.pl, speedscope).
+
+Overhead is bounded by construction: one sample walks at most
+SAMPLING_PROFILER_MAX_DEPTH frames of each sampled thread, with frame labels
+cached per code object. The walk itself takes ~10 µs; waking up and taking
+the GIL from a busy worker dominates, for ~100 µs of CPU per sample under
+load. That is ~0.2% of one core at the default 19 Hz (~1% at 97 Hz);
+`overhead` reports the measured fraction. Idle pool workers are skipped.
+The number of distinct stacks is capped
+(SAMPLING_PROFILER_MAX_STACKS); samples of new stacks beyond the cap are
+counted under a single "[overflow]" line. Stacks are only sampled, so C
+calls (OpenCV) are attributed to the Python function that made them.
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import thread as _futures_thread
+from functools import lru_cache
+from types import CodeType
+from typing import Dict, List, Optional
+
+import structlog
+
+from app.core.config import settings
+from app.core.profiling import frame_label
+
+logger = structlog.get_logger()
+
+OVERFLOW_STACK = "[overflow]"
+# Innermost frame of an idle ThreadPoolExecutor worker (blocked on its queue)
+_POOL_IDLE_CODE = _futures_thread._worker.__code__
+
+
+class StackSampler:
+    """Background thread sampling the stacks of the selected threads."""
+
+    def __init__(
+        self,
+        hz: float,
+        thread_prefixes: List[str],
+        max_stacks: int,
+        max_depth: int,
+        dump_path: Optional[str] = None,
+        dump_interval_s: float = 60.0,
+    ):
+        self.interval_s = 1.0 / max(hz, 0.1)
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.dump_path = dump_path
+        self.dump_interval_s = dump_interval_s
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._sampling_ns = 0
+        self._counts: Dict[str, int] = {}
+        self._labels: Dict[CodeType, str] = {}  # Frame label per code object
+        self.idle_samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="omr-sampler", daemon=True)
+        self._thread.start()
+        logger.info("Stack sampler started", hz=round(1 / self.interval_s, 1),
+                    threads=list(self.thread_prefixes) or "all")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self.dump_path:
+            self.dump(self.dump_path)
+        logger.info("Stack sampler stopped", samples=self.samples, overhead=self.overhead())
+
+    def _run(self) -> None:
+        last_dump = time.monotonic()
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            # CPU time of this thread (wall time would include waiting for the GIL)
+            start = time.thread_time_ns()
+            self.sample(skip_ident=own_id)
+            self._sampling_ns += time.thread_time_ns() - start
+            if self.dump_path and time.monotonic() - last_dump >= self.dump_interval_s:
+                last_dump = time.monotonic()
+                self.dump(self.dump_path)
+
+    def _stack(self, frame, thread_name: str) -> str:
+        labels = self._labels
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            label = labels.get(frame.f_code)
+            if label is None:
+                label = labels[frame.f_code] = frame_label(frame)
+            names.append(label)
+            frame = frame.f_back
+        names.append(thread_name)
+        return ";".join(reversed(names))
+
+    def sample(self, skip_ident: Optional[int] = None) -> None:
+        """Take one sample of every selected thread."""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        stacks = []
+        idle = 0
+        for ident, frame in frames.items():
+            name = names.get(ident, "unknown")
+            if ident == skip_ident:
+                continue
+            if self.thread_prefixes and not name.startswith(self.thread_prefixes):
+                continue
+            if frame.f_code is _POOL_IDLE_CODE:
+                idle += 1  # Pool worker waiting for a task: not CPU
+                continue
+            # Thread names carry a per-thread suffix (omr-worker_3): aggregate by pool
+            stacks.append(self._stack(frame, name.split("_", 1)[0]))
+        del frames
+        with self._lock:
+            self.samples += 1
+            self.idle_samples += idle
+            for stack in stacks:
+                if stack not in self._counts and len(self._counts) >= self.max_stacks:
+                    stack = OVERFLOW_STACK
+                self._counts[stack] = self._counts.get(stack, 0) + 1
+
+    def collapsed(self) -> str:
+        """Aggregated stacks in collapsed ("folded") flame graph format."""
+        with self._lock:
+            items = sorted(self._counts.items())
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def overhead(self) -> float:
+        """Fraction of one core spent sampling since start."""
+        if self.started_at is None:
+            return 0.0
+        elapsed_s = max(time.time() - self.started_at, 1e-9)
+        return round(self._sampling_ns / 1e9 / elapsed_s, 6)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stacks = len(self._counts)
+        return {
+            "running": self.running,
+            "hz": round(1 / self.interval_s, 2),
+            "samples": self.samples,
+            "idle_thread_samples": self.idle_samples,
+            "stacks": stacks,
+            "overhead": self.overhead(),
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self.samples = 0
+            self.idle_samples = 0
+        self._sampling_ns = 0
+        self.started_at = time.time()
+
+    def dump(self, path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(self.collapsed())
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning("Could not write sampled stacks", path=path, error=str(e))
+
+
+@lru_cache
+def get_stack_sampler() -> StackSampler:
+    """Get the process-wide stack sampler (not started)."""
+    return StackSampler(
+        hz=settings.SAMPLING_PROFILER_HZ,
+        thread_prefixes=settings.SAMPLING_PROFILER_THREADS,
+        max_stacks=settings.SAMPLING_PROFILER_MAX_STACKS,
+        max_depth=settings.SAMPLING_PROFILER_MAX_DEPTH,
+        dump_path=settings.SAMPLING_PROFILER_DUMP_PATH,
+    )
@@ -0,0 +1,125 @@
+"""High-resolution stage timing (and optional per-stage memory peaks)."""
+
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _iso(epoch_s: float) -> str:
+    return datetime.fromtimestamp(epoch_s, timezone.utc).isoformat()
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (0 where /proc is not available)."""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class StageTimer:
+    """
+    Accumulates wall-clock milliseconds per named stage.
+
+    Nested stages are exclusive: time spent in an inner stage (e.g. "warp"
+    inside "locate") is not counted again in the outer one, so the stages of
+    a timer add up to its total. Each stage also keeps its first start, last
+    end and status for ProcessingLog.processingSteps.
+
+    With memory tracking (default: whenever tracemalloc is tracing, see
+    ENABLE_MEMORY_PROFILING) each stage also records its peak traced bytes
+    above the stage's starting allocation and its RSS growth. Memory peaks
+    are inclusive (a stage's peak covers its inner stages) and the largest
+    of repeated calls is kept. tracemalloc is process-wide, so per-stage
+    peaks are exact only while one sheet is processed at a time.
+    """
+
+    def __init__(self, track_memory: Optional[bool] = None) -> None:
+        self.timings_ms: Dict[str, float] = {}
+        self.track_memory = tracemalloc.is_tracing() if track_memory is None else track_memory
+        self.peak_bytes: Dict[str, int] = {}
+        self.rss_delta_bytes: Dict[str, int] = {}
+        self._steps: Dict[str, Dict[str, Any]] = {}
+        self._child_ns: List[int] = []  # Inner-stage time of each open stage
+        self._memory: List[List[int]] = []  # [start bytes, peak seen, start RSS] per open stage
+        self._created_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as `name` (repeated stages accumulate)."""
+        step = self._steps.setdefault(
+            name, {"started_at": time.time(), "calls": 0, "failed": False}
+        )
+        if self.track_memory:
+            self._enter_memory()
+        start = time.perf_counter_ns()
+        self._child_ns.append(0)
+        try:
+            yield
+        except BaseException:
+            step["failed"] = True
+            raise
+        finally:
+            if self.track_memory:
+                self._exit_memory(name)
+            elapsed_ns = time.perf_counter_ns() - start
+            inner_ns = self._child_ns.pop()
+            if self._child_ns:
+                self._child_ns[-1] += elapsed_ns
+            self.timings_ms[name] = self.timings_ms.get(name, 0.0) + (elapsed_ns - inner_ns) / 1e6
+            step["completed_at"] = time.time()
+            step["calls"] += 1
+
+    def _enter_memory(self) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory:
+            # The outer stage's peak so far survives the reset below
+            self._memory[-1][1] = max(self._memory[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memory.append([current, current, current_rss_bytes()])
+
+    def _exit_memory(self, name: str) -> None:
+        _, peak = tracemalloc.get_traced_memory()
+        start, seen, rss_start = self._memory.pop()
+        stage_peak = max(seen, peak)
+        if self._memory:
+            self._memory[-1][1] = max(self._memory[-1][1], stage_peak)
+        self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), stage_peak - start)
+        rss_delta = current_rss_bytes() - rss_start
+        self.rss_delta_bytes[name] = max(self.rss_delta_bytes.get(name, rss_delta), rss_delta)
+
+    def rounded(self, digits: int = 3) -> Dict[str, float]:
+        """Timings rounded for payloads/logs."""
+        return {name: round(ms, digits) for name, ms in self.timings_ms.items()}
+
+    def total_ms(self) -> float:
+        """Wall-clock milliseconds since the timer was created."""
+        return (time.perf_counter_ns() - self._created_ns) / 1e6
+
+    def steps(self, digits: int = 3) -> List[Dict[str, Any]]:
+        """Stages in start order, shaped like ProcessingLog.processingSteps entries."""
+        steps = []
+        for name, step in self._steps.items():
+            entry: Dict[str, Any] = {
+                "step": name,
+                "status": "failed" if step["failed"] else "completed",
+                "startedAt": _iso(step["started_at"]),
+                "completedAt": _iso(step.get("completed_at", step["started_at"])),
+                "duration": round(self.timings_ms.get(name, 0.0), digits),
+            }
+            details: Dict[str, Any] = {}
+            if step["calls"] > 1:
+                details["calls"] = step["calls"]
+            if name in self.peak_bytes:
+                details["peakBytes"] = self.peak_bytes[name]
+                details["rssDeltaBytes"] = self.rss_delta_bytes[name]
+            if details:
+                entry["details"] = details
+            steps.append(entry)
+        return steps
@@ -1,16 +1,27 @@
 """Main FastAPI application entry point."""
 
 import asyncio
+import time
+import tracemalloc
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator, Optional
 
 import structlog
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from app.api.routes import router as api_router
 from app.core.config import settings
+from app.core.executor import get_processing_executor, shutdown_processing_executor
 from app.core.logging import setup_logging
+from app.core.sampler import get_stack_sampler
+from app.core.metrics import (
+    HTTP_IN_FLIGHT,
+    HTTP_REQUEST_DURATION,
+    render_metrics,
+    setup_metrics,
+)
 
 logger = structlog.get_logger()
 
@@ -30,13 +41,28 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         environment=settings.ENVIRONMENT,
     )
     
+    # Executor dedicado para el trabajo CPU (OpenCV) fuera del event loop
+    get_processing_executor()
+    
+    if settings.ENABLE_METRICS:
+        setup_metrics()
+    
+    if settings.ENABLE_SAMPLING_PROFILER:
+        get_stack_sampler().start()
+    
+    if settings.ENABLE_MEMORY_PROFILING and not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_PROFILING_FRAMES)
+    
     # Iniciar consumer de RabbitMQ en background
+    # (app.state.consumer también publica los re-calificados en omr.results)
+    app.state.consumer = None
     if settings.ENABLE_CONSUMER:
         try:
             from app.consumers.processing_consumer import ProcessingConsumer
             consumer = ProcessingConsumer()
             await consumer.connect()
             consumer_task = asyncio.create_task(consumer.start_consuming())
+            app.state.consumer = consumer
             logger.info("Consumer de RabbitMQ iniciado")
         except Exception as e:
             logger.warning(f"No se pudo iniciar consumer de RabbitMQ: {e}")
@@ -51,6 +77,9 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         except asyncio.CancelledError:
             pass
     
+    shutdown_processing_executor()
+    get_stack_sampler().stop()
+    
     logger.info("Shutting down OMR Processor Service")
 
 
@@ -72,6 +101,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.ENABLE_METRICS:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        """Latency per route template (not raw path: ids would explode the label set)."""
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = request.scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                request.method, getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - start)
+
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
@@ -86,6 +133,15 @@ async def health_check() -> dict:
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Prometheus scrape endpoint."""
+    if not settings.ENABLE_METRICS:
+        return Response(status_code=404)
+    # Header set verbatim: media_type would append a second charset
+    return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
 if __name__ == "__main__":
     import uvicorn
 
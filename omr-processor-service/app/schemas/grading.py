@@ -0,0 +1,118 @@
+"""Grading schemas."""
+
+from typing import Any, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class RegradeRequest(BaseModel):
+    """Re-score the stored attempts of an exam with a corrected answer key."""
+
+    exam_id: str = Field(..., description="Exam UUID")
+    answer_key: List[Any] = Field(
+        ..., description="New answer key: [[0], [3], ...] or [0, 3, ...] (0-indexed options)"
+    )
+    previous_answer_key: Optional[List[Any]] = Field(
+        None, description="Key the attempts were graded with (default: the stored one)"
+    )
+    publish: bool = Field(True, description="Publish the score deltas to omr.results")
+
+
+class RegradedAttempt(BaseModel):
+    """New totals of one attempt."""
+
+    attempt_id: str
+    score: int
+    score_delta: Optional[int] = Field(None, description="New score - previous score (None without previous key)")
+    total_correct: int
+    total_incorrect: int
+    total_blank: int
+    total_questions: int
+    percentage: float
+    changed_questions: List[int] = Field(default_factory=list, description="Questions whose correctness changed")
+
+
+class RegradeResponse(BaseModel):
+    """Re-grade summary."""
+
+    exam_id: str
+    attempts: int = Field(0, description="Stored attempts re-scored")
+    changed_attempts: int = Field(0, description="Attempts whose correctness changed on any question")
+    published: int = Field(0, description="Messages published to omr.results")
+    processing_time_ms: int = Field(0, ge=0)
+    results: List[RegradedAttempt] = Field(default_factory=list)
+
+
+class ItemAnalysisRequest(BaseModel):
+    """Score a cohort and analyse its questions."""
+
+    exam_id: Optional[str] = Field(None, description="Analyse every stored attempt of this exam")
+    selections: Optional[List[List[Optional[int]]]] = Field(
+        None, description="(students x questions) selected options (0-indexed, null = blank)"
+    )
+    attempt_ids: Optional[List[str]] = Field(None, description="Ids of the `selections` rows")
+    answer_key: Optional[List[Any]] = Field(
+        None, description="[[0], [3], ...] or [0, 3, ...] (default: the exam's stored key)"
+    )
+    num_options: Optional[int] = Field(None, ge=1, description="Options per question (default: detected)")
+    include_scores: bool = Field(True, description="Return the score of every attempt")
+
+
+class QuestionAnalysis(BaseModel):
+    """Statistics of one question over the cohort."""
+
+    question_number: int
+    correct_option: Optional[int] = None
+    difficulty: Optional[float] = Field(None, description="Proportion of correct answers")
+    discrimination: Optional[float] = Field(
+        None, description="Upper 27% minus lower 27% proportion correct"
+    )
+    point_biserial: Optional[float] = Field(
+        None, description="Correlation with the score on the rest of the exam"
+    )
+    blank_rate: float
+    option_distribution: List[int] = Field(default_factory=list, description="Answers per option")
+
+
+class AttemptScore(BaseModel):
+    """Score of one attempt."""
+
+    attempt_id: str
+    score: int
+    percentage: float
+
+
+class ItemAnalysisResponse(BaseModel):
+    """Cohort scores and item analysis."""
+
+    exam_id: Optional[str] = None
+    attempts: int = 0
+    total_questions: int = 0
+    mean_score: Optional[float] = None
+    std_score: Optional[float] = None
+    processing_time_ms: int = Field(0, ge=0)
+    questions: List[QuestionAnalysis] = Field(default_factory=list)
+    scores: List[AttemptScore] = Field(default_factory=list)
+
+
+class ExamStatsSnapshot(BaseModel):
+    """Live aggregates of an exam, maintained as results stream out of the consumer."""
+
+    exam_id: str
+    attempts: int = Field(0, description="Successful attempts folded in")
+    failed: int = Field(0, description="Failed processing results")
+    review_needed: int = Field(0, description="Low confidence or ambiguous/multiple answers")
+    degraded: int = Field(0, description="Attempts processed on the degraded fast path")
+    mean_score: Optional[float] = None
+    std_score: Optional[float] = None
+    mean_percentage: Optional[float] = None
+    mean_confidence: Optional[float] = None
+    score_histogram: List[int] = Field(
+        default_factory=list, description="Attempts per 10-point percentage bucket"
+    )
+    question_correct: List[int] = Field(default_factory=list)
+    question_blank: List[int] = Field(default_factory=list)
+    question_correct_rate: List[float] = Field(default_factory=list)
+    question_blank_rate: List[float] = Field(default_factory=list)
+    started_at: float
+    updated_at: float
@@ -1,6 +1,6 @@
 """Processing schemas."""
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -40,10 +40,56 @@ class ProcessingResponse(BaseModel):
     processed_image_url: Optional[str] = Field(None, description="URL of processed image with annotations")
     processing_time_ms: int = Field(0, ge=0, description="Processing time in milliseconds")
     warnings: List[str] = Field(default_factory=list, description="Processing warnings")
+    degraded: bool = Field(False, description="Whether slow stages were skipped to meet the deadline")
+    engine: Optional[str] = Field(None, description="Detection engine used")
+    stage_timings_ms: Dict[str, float] = Field(default_factory=dict, description="Time per processing stage (ms)")
+    stage_peak_bytes: Dict[str, int] = Field(
+        default_factory=dict,
+        description="Peak traced bytes per stage (only with ENABLE_MEMORY_PROFILING)",
+    )
+    processing_steps: List[Dict[str, Any]] = Field(
+        default_factory=list, description="Stages as ProcessingLog.processingSteps entries"
+    )
+    profile: Optional[Dict[str, Any]] = Field(
+        None, description="Profile capture (file, format, top functions) when requested"
+    )
+    capture_mode: Optional[str] = Field(None, description="Capture mode used (photo | scanner)")
     error_code: Optional[str] = Field(None, description="Error code if failed")
     error_message: Optional[str] = Field(None, description="Error message if failed")
 
 
+class RedecideRequest(BaseModel):
+    """Re-run the decision stage over stored intensity matrices."""
+
+    exam_id: Optional[str] = Field(None, description="Re-decide every stored attempt of this exam")
+    attempt_ids: Optional[List[str]] = Field(None, description="Re-decide only these attempts")
+    engine: Optional[str] = Field(None, description="Use this engine's decider (default: the attempt's engine)")
+    min_row_range: Optional[float] = Field(None, ge=0, description="Contrast decider: minimum row range")
+    min_contrast: Optional[float] = Field(None, ge=0, description="Contrast decider: minimum contrast to second darkest")
+    persist: bool = Field(False, description="Store the new answers as the attempts' current answers")
+    include_answers: bool = Field(True, description="Return the full answer list per attempt")
+
+
+class RedecidedAttempt(BaseModel):
+    """Re-decision of one stored attempt."""
+
+    attempt_id: str
+    exam_id: Optional[str] = None
+    engine: Optional[str] = Field(None, description="Engine that sampled the attempt")
+    changed_questions: List[int] = Field(default_factory=list, description="Questions whose answer changed")
+    detected_answers: List[DetectedAnswer] = Field(default_factory=list)
+
+
+class RedecideResponse(BaseModel):
+    """Re-decision summary."""
+
+    attempts: int = Field(0, description="Stored attempts re-decided")
+    changed_attempts: int = Field(0, description="Attempts with at least one changed answer")
+    changed_answers: int = Field(0, description="Total changed answers")
+    processing_time_ms: int = Field(0, ge=0)
+    results: List[RedecidedAttempt] = Field(default_factory=list)
+
+
 class ImageValidationResult(BaseModel):
     """Image validation result."""
 
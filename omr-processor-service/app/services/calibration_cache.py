@@ -0,0 +1,189 @@
+"""
+Calibration cache for consecutive sheets of the same batch/device.
+
+Sheets fed through one scanner (or shot from one phone stand) share almost the
+same geometry. After a full region detection, the answer-region corners and
+small grayscale patches around them are cached under an exam/batch/device key.
+The next sheet only has to confirm each corner with a phase correlation of its
+patch (sub-pixel shift + peak response), which replaces the contour search
+when every corner agrees.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+GridGeometry = Tuple[List[float], List[List[float]]]
+
+
+def calibration_key(
+    exam_id: Optional[str],
+    batch_id: Optional[str] = None,
+    device_id: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Cache key for a sheet. A batch or device id is required: sheets of the
+    same exam shot on different phones do not share geometry.
+    """
+    if not batch_id and not device_id:
+        return None
+    return f"{exam_id or '-'}:{batch_id or '-'}:{device_id or '-'}"
+
+
+@dataclass
+class Calibration:
+    """Geometry of the last fully detected sheet for a key."""
+    corners: np.ndarray  # (4, 2) float32: TL, TR, BR, BL in source image pixels
+    image_shape: Tuple[int, int]  # (height, width) of the source image
+    crop_margins: bool  # Whether the GIB header/footer crop was applied
+    patches: List[np.ndarray]  # Float32 grayscale patch centered on each corner
+    # Grid geometry by grid mode, with the answer-region shape it was measured on
+    grid_geometry: Dict[str, Tuple[Tuple[int, int], GridGeometry]] = field(default_factory=dict)
+    stored_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+    def geometry_for(self, grid_mode: str, shape: Tuple[int, int]) -> Optional[GridGeometry]:
+        """Cached grid geometry rescaled to a region of `shape` (height, width)."""
+        cached = self.grid_geometry.get(grid_mode)
+        if cached is None:
+            return None
+        (h0, w0), (col_bounds, row_centers) = cached
+        sy, sx = shape[0] / h0, shape[1] / w0
+        return (
+            [x * sx for x in col_bounds],
+            [[y * sy for y in column] for column in row_centers],
+        )
+
+
+class CalibrationCache:
+    """Thread-safe LRU of calibrations with TTL and phase-correlation checks."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_s: float,
+        patch_size: int,
+        min_response: float,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.patch_size = patch_size
+        self.min_response = min_response
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._entries: "OrderedDict[str, Calibration]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._window = cv2.createHanningWindow((patch_size, patch_size), cv2.CV_32F)
+
+    def _patch(self, image: np.ndarray, point: np.ndarray) -> Optional[np.ndarray]:
+        """Float32 grayscale patch centered on `point`, None if it does not fit the image."""
+        half = self.patch_size // 2
+        x, y = int(round(point[0])) - half, int(round(point[1])) - half
+        h, w = image.shape[:2]
+        if x < 0 or y < 0 or x + self.patch_size > w or y + self.patch_size > h:
+            return None
+        patch = image[y:y + self.patch_size, x:x + self.patch_size]
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        return patch.astype(np.float32)
+
+    def get(self, key: str) -> Optional[Calibration]:
+        with self._lock:
+            calibration = self._entries.get(key)
+            if calibration is not None and time.monotonic() - calibration.stored_at > self.ttl_s:
+                del self._entries[key]
+                calibration = None
+            if calibration is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            return calibration
+
+    def store(
+        self,
+        key: str,
+        image: np.ndarray,
+        corners: np.ndarray,
+        crop_margins: bool,
+    ) -> Optional[Calibration]:
+        """
+        Cache a freshly detected corner set of `image` (BGR or grayscale).
+        Skipped if a corner patch does not fit inside the image.
+        """
+        corners = np.asarray(corners, dtype=np.float32).reshape(4, 2)
+        patches = [self._patch(image, corner) for corner in corners]
+        if any(patch is None for patch in patches):
+            return None
+        calibration = Calibration(
+            corners=corners,
+            image_shape=image.shape[:2],
+            crop_margins=crop_margins,
+            patches=patches,
+        )
+        with self._lock:
+            self._entries[key] = calibration
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return calibration
+
+    def verify(self, calibration: Calibration, image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Corners of `image` if every cached corner is found again, else None.
+
+        Each corner patch is phase-correlated with the same window of the new
+        image; a weak peak or a shift larger than a quarter patch rejects the
+        calibration. Per-corner shifts absorb small rotations and skew.
+        """
+        if tuple(image.shape[:2]) != tuple(calibration.image_shape):
+            self.rejected += 1
+            return None
+
+        max_shift = self.patch_size / 4
+        corners = calibration.corners.copy()
+        pairs = zip(calibration.corners, calibration.patches, strict=True)
+        for i, (corner, reference) in enumerate(pairs):
+            current = self._patch(image, corner)
+            if current is None:
+                self.rejected += 1
+                return None
+            (dx, dy), response = cv2.phaseCorrelate(reference, current, self._window)
+            if response < self.min_response or abs(dx) > max_shift or abs(dy) > max_shift:
+                self.rejected += 1
+                logger.info(
+                    "Calibration rejected", corner=i,
+                    response=round(response, 3), shift=(round(dx, 1), round(dy, 1)),
+                )
+                return None
+            corners[i] = corner + (dx, dy)
+
+        self.hits += 1
+        calibration.hits += 1
+        return corners
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache
+def get_calibration_cache() -> CalibrationCache:
+    """Get the process-wide calibration cache."""
+    return CalibrationCache(
+        max_entries=settings.CALIBRATION_CACHE_SIZE,
+        ttl_s=settings.CALIBRATION_CACHE_TTL_S,
+        patch_size=settings.CALIBRATION_PATCH_SIZE,
+        min_response=settings.CALIBRATION_MIN_RESPONSE,
+    )
@@ -0,0 +1,358 @@
+"""
+Detection engines.
+
+An engine is a region locator (find and flatten the answer area), a sampler
+(answer area -> questions x options matrix of mean bubble intensities, lower =
+darker), a decider (matrix -> DetectedAnswer per question) and optionally a
+refiner that re-examines the questions the decider was unsure about. Engines are
+registered by name and selected per request, per sheet template or through
+settings.OMR_ENGINE, so alternative strategies can be compared on the same
+sheets without forking OMRProcessor.
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+import structlog
+
+from app.core.config import settings
+from app.core.constants import AnswerStatus
+from app.schemas.processing import DetectedAnswer
+from app.services.image_utils import AdaptiveThreshold
+
+if TYPE_CHECKING:
+    from app.services.omr_processor import OMRProcessor, ProcessingContext
+
+logger = structlog.get_logger()
+
+
+@dataclass(frozen=True)
+class SheetLayout:
+    """Question grid of a sheet template."""
+    total_questions: int
+    options_per_question: int
+    num_columns: int
+    rows_per_column: int
+
+    @property
+    def capacity(self) -> int:
+        """Questions the printed grid holds; later questions have no bubbles."""
+        return self.num_columns * self.rows_per_column
+
+
+class RegionLocator(ABC):
+    """Finds the answer region and returns it flattened (BGR)."""
+    name: str
+
+    @abstractmethod
+    def locate(
+        self, processor: "OMRProcessor", image: np.ndarray, context: "ProcessingContext"
+    ) -> np.ndarray:
+        ...
+
+
+class Sampler(ABC):
+    """Measures every bubble of the layout."""
+    name: str
+
+    @abstractmethod
+    def sample(
+        self,
+        processor: "OMRProcessor",
+        gray: np.ndarray,
+        layout: SheetLayout,
+        context: "ProcessingContext",
+    ) -> Optional[np.ndarray]:
+        """
+        Mean intensity per bubble as a float32 (total_questions x options) matrix.
+        NaN marks bubbles that were not found. Returns None when the sampler
+        cannot handle the sheet (the engine fallback is used instead).
+        """
+
+
+class Decider(ABC):
+    """Turns a sampled intensity matrix into answers."""
+    name: str
+
+    @abstractmethod
+    def decide(
+        self, processor: "OMRProcessor", intensities: np.ndarray
+    ) -> List[DetectedAnswer]:
+        ...
+
+
+class Refiner(ABC):
+    """Second pass over the questions the decider was unsure about."""
+    name: str
+
+    @abstractmethod
+    def refine(
+        self,
+        processor: "OMRProcessor",
+        gray: np.ndarray,
+        layout: SheetLayout,
+        intensities: np.ndarray,
+        answers: List[DetectedAnswer],
+        context: "ProcessingContext",
+    ) -> List[DetectedAnswer]:
+        """Return the (possibly) improved answers; `intensities` may be updated in place."""
+
+
+@dataclass(frozen=True)
+class DetectionEngine:
+    """Locator + sampler + decider (+ refiner), with an optional engine to fall back to."""
+    name: str
+    locator: RegionLocator
+    sampler: Sampler
+    decider: Decider
+    refiner: Optional[Refiner] = None
+    fallback: Optional[str] = None
+    description: str = ""
+
+
+# ============================================
+# Region locators
+# ============================================
+
+class SmartRegionLocator(RegionLocator):
+    """Fiducials / corner markers / border rectangle / fixed crop."""
+    name = "smart"
+
+    def locate(self, processor, image, context):
+        return processor._find_answer_region_smart(image, context)
+
+
+class TimingMarkLocator(RegionLocator):
+    """Timing marks on the page margins (whole page, no warp); smart locator without them."""
+    name = "timing-marks"
+
+    def locate(self, processor, image, context):
+        return processor._find_answer_region_timing_marks(image, context)
+
+
+# ============================================
+# Samplers
+# ============================================
+
+class GridSampler(Sampler):
+    """Fixed layout grid ("uniform") or detected separators/rows ("adaptive")."""
+
+    def __init__(self, grid_mode: str):
+        self.grid_mode = grid_mode
+        self.name = f"grid:{grid_mode}"
+
+    def sample(self, processor, gray, layout, context):
+        return processor._sample_grid(gray, layout, self.grid_mode, context)
+
+
+class ComponentSampler(Sampler):
+    """Bubbles found as connected components of the thresholded region."""
+    name = "components"
+
+    def sample(self, processor, gray, layout, context):
+        return processor._sample_bubble_components(gray, layout, context)
+
+
+class TimingMarkSampler(Sampler):
+    """Bubbles at the row x column timing-mark positions (None without marks)."""
+    name = "timing-marks"
+
+    def sample(self, processor, gray, layout, context):
+        return processor._sample_timing_grid(gray, layout, context)
+
+
+# ============================================
+# Deciders
+# ============================================
+
+def _row_values(row: np.ndarray) -> List[float]:
+    """Row intensities with missing bubbles read as white paper."""
+    return [255.0 if np.isnan(v) else float(v) for v in row]
+
+
+class ContrastDecider(Decider):
+    """Darkest bubble of the row, judged by contrast to the rest of the row."""
+    name = "contrast"
+
+    # None = settings.CONTRAST_MIN_ROW_RANGE / CONTRAST_MIN_CONTRAST at decision time
+    def __init__(self, min_row_range: Optional[float] = None, min_contrast: Optional[float] = None):
+        self.min_row_range = min_row_range
+        self.min_contrast = min_contrast
+
+    def decide(self, processor, intensities):
+        return [
+            processor._determine_answer_by_contrast(
+                q_idx + 1, _row_values(row), self.min_row_range, self.min_contrast
+            )
+            for q_idx, row in enumerate(intensities)
+        ]
+
+
+class FillDecider(Decider):
+    """Absolute fill ratio (1 - intensity/255) of the found bubbles."""
+    name = "fill"
+
+    def decide(self, processor, intensities):
+        answers = []
+        for q_idx, row in enumerate(intensities):
+            option_scores = [
+                (opt_idx, 1.0 - float(value) / 255.0)
+                for opt_idx, value in enumerate(row)
+                if not np.isnan(value)
+            ]
+            answers.append(processor._determine_answer(q_idx + 1, option_scores))
+        return answers
+
+
+class ThresholdDecider(Decider):
+    """Global threshold over the whole sheet refined per row (AdaptiveThreshold)."""
+    name = "threshold"
+
+    # With ~1 mark per row the marked bubbles are a fifth of the sheet, so the
+    # default looseness (mean - 4 std) never separates them from paper.
+    def __init__(self, global_looseness: float = 1.0, local_looseness: float = 1.0):
+        self.global_looseness = global_looseness
+        self.local_looseness = local_looseness
+
+    def decide(self, processor, intensities):
+        _, confidence, local_thr = AdaptiveThreshold.threshold_matrix(
+            intensities,
+            global_looseness=self.global_looseness,
+            local_looseness=self.local_looseness,
+        )
+        answers = []
+        for q_idx, row in enumerate(intensities):
+            option_scores = list(enumerate(confidence[q_idx].tolist()))
+            answers.append(processor._determine_answer_adaptive(
+                q_idx + 1, option_scores, _row_values(row), float(local_thr[q_idx])
+            ))
+        return answers
+
+
+# ============================================
+# Refiners
+# ============================================
+
+class CascadeRefiner(Refiner):
+    """
+    Re-sample MULTIPLE and low-confidence marked questions with local row
+    alignment and circular masks; the new reading replaces the old one only if
+    it changes the decision with strictly higher confidence. BLANK rows are
+    left alone (a re-fit there can only find a neighbouring row's mark), and
+    clear rows (the vast majority) cost nothing beyond the fast grid pass.
+    """
+    name = "cascade"
+
+    def __init__(self, confidence_threshold: Optional[float] = None):
+        self.confidence_threshold = confidence_threshold
+
+    def refine(self, processor, gray, layout, intensities, answers, context):
+        threshold = (
+            settings.CASCADE_CONFIDENCE_THRESHOLD
+            if self.confidence_threshold is None
+            else self.confidence_threshold
+        )
+        hard = [
+            q_idx for q_idx, answer in enumerate(answers)
+            if answer.status == AnswerStatus.MULTIPLE or (
+                answer.status != AnswerStatus.BLANK and answer.confidence_score < threshold
+            )
+        ]
+        if not hard or context.should_skip("cascade_refine"):
+            return answers
+
+        resampled = processor._resample_questions(gray, layout, hard, context)
+        refined = list(answers)
+        changed = 0
+        for q_idx, row in zip(hard, resampled, strict=True):
+            candidate = processor._determine_answer_by_contrast(q_idx + 1, _row_values(row))
+            previous = answers[q_idx]
+            decision_changed = candidate.status != previous.status or (
+                candidate.selected_option != previous.selected_option
+            )
+            if decision_changed and candidate.confidence_score > previous.confidence_score:
+                refined[q_idx] = candidate
+                intensities[q_idx] = row
+                changed += 1
+
+        logger.info(
+            "Cascade refinement", reexamined=len(hard), changed=changed,
+            total=len(answers), threshold=threshold,
+        )
+        return refined
+
+
+# ============================================
+# Registry
+# ============================================
+
+_ENGINES: Dict[str, DetectionEngine] = {}
+
+
+def register_engine(engine: DetectionEngine) -> DetectionEngine:
+    """Register (or replace) an engine under its name."""
+    _ENGINES[engine.name] = engine
+    return engine
+
+
+def get_engine(name: str) -> DetectionEngine:
+    """Look up a registered engine; ValueError for unknown names."""
+    try:
+        return _ENGINES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown detection engine: {name} (available: {', '.join(available_engines())})"
+        ) from None
+
+
+def available_engines() -> List[str]:
+    return sorted(_ENGINES)
+
+
+register_engine(DetectionEngine(
+    name="grid",
+    locator=SmartRegionLocator(),
+    sampler=GridSampler("uniform"),
+    decider=ContrastDecider(),
+    description="Uniform layout grid + relative contrast (calibrated for GIB D'Nivel)",
+))
+register_engine(DetectionEngine(
+    name="adaptive-grid",
+    locator=SmartRegionLocator(),
+    sampler=GridSampler("adaptive"),
+    decider=ContrastDecider(),
+    description="Detected column separators and per-column rows + relative contrast",
+))
+register_engine(DetectionEngine(
+    name="cascade",
+    locator=SmartRegionLocator(),
+    sampler=GridSampler("uniform"),
+    decider=ContrastDecider(),
+    refiner=CascadeRefiner(),
+    description="Grid + contrast; ambiguous rows re-sampled with local alignment and circular masks",
+))
+register_engine(DetectionEngine(
+    name="contours",
+    locator=SmartRegionLocator(),
+    sampler=ComponentSampler(),
+    decider=FillDecider(),
+    fallback="grid",
+    description="Bubble connected components + absolute fill ratio",
+))
+register_engine(DetectionEngine(
+    name="threshold",
+    locator=SmartRegionLocator(),
+    sampler=GridSampler("uniform"),
+    decider=ThresholdDecider(),
+    description="Uniform layout grid + global/local adaptive threshold",
+))
+register_engine(DetectionEngine(
+    name="timing-marks",
+    locator=TimingMarkLocator(),
+    sampler=TimingMarkSampler(),
+    decider=ContrastDecider(),
+    fallback="grid",
+    description="Row/column timing marks read by 1D projections + relative contrast",
+))
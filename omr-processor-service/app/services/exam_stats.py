@@ -0,0 +1,196 @@
+"""
+Streaming per-exam statistics.
+
+The consumer folds every published result into running aggregates of its
+exam (score histogram, per-question correct/blank counts, mean confidence,
+review-needed count) in O(questions), so progress dashboards read a cheap
+in-memory snapshot instead of re-aggregating every attempt from the database.
+Aggregates are per process and lost on restart.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.constants import AnswerStatus
+
+# Score histogram over the percentage: 10 buckets of 10 points, 100% in the last
+HISTOGRAM_BUCKETS = 10
+
+_REVIEW_STATUSES = {AnswerStatus.AMBIGUOUS.value, AnswerStatus.MULTIPLE.value}
+
+
+def needs_review(result: Dict[str, Any], confidence_threshold: float) -> bool:
+    """Whether a successful result should be checked by a person."""
+    confidence = result.get("confidenceScore")
+    if confidence is not None and confidence < confidence_threshold:
+        return True
+    return any(answer.get("status") in _REVIEW_STATUSES for answer in result.get("answers", ()))
+
+
+@dataclass
+class ExamStatistics:
+    """Running aggregates of one exam."""
+    exam_id: str
+    attempts: int = 0
+    failed: int = 0
+    review_needed: int = 0
+    degraded: int = 0
+    score_sum: float = 0.0
+    score_sq_sum: float = 0.0
+    percentage_sum: float = 0.0
+    confidence_sum: float = 0.0
+    confidence_count: int = 0
+    histogram: np.ndarray = field(default_factory=lambda: np.zeros(HISTOGRAM_BUCKETS, np.int64))
+    question_correct: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    question_blank: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    question_seen: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    attempt_ids: Set[str] = field(default_factory=set)  # Graded attempts
+    failed_attempt_ids: Set[str] = field(default_factory=set)  # Failed, not (yet) graded
+    started_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def _grow(self, questions: int) -> None:
+        extra = questions - self.question_seen.size
+        if extra > 0:
+            pad = np.zeros(extra, np.int64)
+            self.question_correct = np.concatenate([self.question_correct, pad])
+            self.question_blank = np.concatenate([self.question_blank, pad])
+            self.question_seen = np.concatenate([self.question_seen, pad])
+
+    def add(self, result: Dict[str, Any], confidence_threshold: float) -> None:
+        """Fold one successful omr.results message into the aggregates."""
+        answers = result.get("answers", [])
+        numbers = np.fromiter((a["questionNumber"] for a in answers), np.int64, len(answers)) - 1
+        if numbers.size:
+            self._grow(int(numbers.max()) + 1)
+            correct = np.fromiter((bool(a.get("isCorrect")) for a in answers), bool, len(answers))
+            blank = np.fromiter(
+                (a.get("selectedOption") is None for a in answers), bool, len(answers)
+            )
+            np.add.at(self.question_seen, numbers, 1)
+            np.add.at(self.question_correct, numbers[correct], 1)
+            np.add.at(self.question_blank, numbers[blank], 1)
+
+        score = float(result.get("score", 0))
+        pct = float(result.get("percentage", 0))
+        bucket = min(int(pct // (100 / HISTOGRAM_BUCKETS)), HISTOGRAM_BUCKETS - 1)
+        self.histogram[max(bucket, 0)] += 1
+        self.attempts += 1
+        self.score_sum += score
+        self.score_sq_sum += score * score
+        self.percentage_sum += pct
+        if result.get("confidenceScore") is not None:
+            self.confidence_sum += float(result["confidenceScore"])
+            self.confidence_count += 1
+        if result.get("degraded"):
+            self.degraded += 1
+        if needs_review(result, confidence_threshold):
+            self.review_needed += 1
+        self.updated_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-data copy of the aggregates (means/rates derived here)."""
+        n = self.attempts
+        mean = self.score_sum / n if n else None
+        variance = max(self.score_sq_sum / n - mean * mean, 0.0) if n else None
+        seen = np.maximum(self.question_seen, 1)
+        return {
+            "exam_id": self.exam_id,
+            "attempts": n,
+            "failed": self.failed,
+            "review_needed": self.review_needed,
+            "degraded": self.degraded,
+            "mean_score": None if mean is None else round(mean, 4),
+            "std_score": None if variance is None else round(variance ** 0.5, 4),
+            "mean_percentage": round(self.percentage_sum / n, 2) if n else None,
+            "mean_confidence": (
+                round(self.confidence_sum / self.confidence_count, 4)
+                if self.confidence_count else None
+            ),
+            "score_histogram": self.histogram.tolist(),
+            "question_correct": self.question_correct.tolist(),
+            "question_blank": self.question_blank.tolist(),
+            "question_correct_rate": np.round(self.question_correct / seen, 4).tolist(),
+            "question_blank_rate": np.round(self.question_blank / seen, 4).tolist(),
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class ExamStatsRegistry:
+    """Thread-safe LRU of per-exam running statistics."""
+
+    def __init__(self, max_exams: int, confidence_threshold: float):
+        self.max_exams = max_exams
+        self.confidence_threshold = confidence_threshold
+        self._exams: "OrderedDict[str, ExamStatistics]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _exam(self, exam_id: str) -> ExamStatistics:
+        stats = self._exams.get(exam_id)
+        if stats is None:
+            stats = self._exams[exam_id] = ExamStatistics(exam_id=exam_id)
+            while len(self._exams) > self.max_exams:
+                self._exams.popitem(last=False)
+        self._exams.move_to_end(exam_id)
+        return stats
+
+    def record(self, result: Dict[str, Any]) -> bool:
+        """
+        Fold a result into its exam. Redelivered attempts are counted once,
+        successes and failures alike, and a failed attempt that later succeeds
+        moves from `failed` to the graded aggregates. Results without examId
+        are ignored.
+        """
+        exam_id = result.get("examId")
+        if not exam_id:
+            return False
+        with self._lock:
+            stats = self._exam(exam_id)
+            attempt_id = result.get("attemptId")
+            if attempt_id and attempt_id in stats.attempt_ids:
+                return False
+            if not result.get("success"):
+                if attempt_id:
+                    if attempt_id in stats.failed_attempt_ids:
+                        return False
+                    stats.failed_attempt_ids.add(attempt_id)
+                stats.failed += 1
+                stats.updated_at = time.time()
+                return True
+            if attempt_id in stats.failed_attempt_ids:
+                stats.failed_attempt_ids.discard(attempt_id)
+                stats.failed -= 1
+            stats.add(result, self.confidence_threshold)
+            if attempt_id:
+                stats.attempt_ids.add(attempt_id)
+            return True
+
+    def snapshot(self, exam_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stats = self._exams.get(exam_id)
+            return None if stats is None else stats.snapshot()
+
+    def exam_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._exams)
+
+    def reset(self, exam_id: str) -> bool:
+        with self._lock:
+            return self._exams.pop(exam_id, None) is not None
+
+
+@lru_cache
+def get_exam_stats() -> ExamStatsRegistry:
+    """Get the process-wide exam statistics registry."""
+    return ExamStatsRegistry(
+        max_exams=settings.EXAM_STATS_MAX_EXAMS,
+        confidence_threshold=settings.CONFIDENCE_THRESHOLD,
+    )
@@ -0,0 +1,147 @@
+"""
+Answer-key scoring.
+
+Answer keys arrive as lists ([[0], [3], ...] from the backend, or plain
+option indices) and are normalized to one correct option per question
+(-1 = no key). Stored attempts are scored together as an
+(attempts x questions) matrix of selected options (-1 = blank), so a
+corrected key re-grades a whole exam in one vectorized pass.
+"""
+
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+NO_OPTION = -1
+
+
+def correct_option(entry: Any) -> Optional[int]:
+    """Correct option of one answer-key entry ([option], option or empty)."""
+    if isinstance(entry, (list, tuple)):
+        entry = entry[0] if entry else None
+    return None if entry is None else int(entry)
+
+
+def answer_key_vector(answer_key: Sequence[Any], total_questions: int) -> np.ndarray:
+    """Correct option per question (int16, NO_OPTION where the key has none)."""
+    key = np.full(total_questions, NO_OPTION, dtype=np.int16)
+    for q_idx, entry in enumerate(answer_key[:total_questions]):
+        option = correct_option(entry)
+        if option is not None:
+            key[q_idx] = option
+    return key
+
+
+def selection_matrix(selections: Sequence[Sequence[Optional[int]]]) -> np.ndarray:
+    """(attempts x max questions) selected options, NO_OPTION for blanks/padding."""
+    width = max((len(s) for s in selections), default=0)
+    matrix = np.full((len(selections), width), NO_OPTION, dtype=np.int16)
+    for row, selected in enumerate(selections):
+        matrix[row, :len(selected)] = [NO_OPTION if s is None else s for s in selected]
+    return matrix
+
+
+@dataclass
+class GradeTotals:
+    """Per-attempt totals of a scored selection matrix."""
+    correct: np.ndarray  # (attempts x questions) bool
+    total_correct: np.ndarray
+    total_incorrect: np.ndarray
+    total_blank: np.ndarray
+
+
+def grade(selected: np.ndarray, key: np.ndarray, total_questions: np.ndarray) -> GradeTotals:
+    """
+    Score every attempt at once. `selected` is (attempts x questions), `key`
+    has one entry per question (padded with NO_OPTION) and `total_questions`
+    holds each attempt's own question count (padding is not counted blank).
+    """
+    answered = selected != NO_OPTION
+    correct = answered & (selected == key[None, :]) & (key[None, :] != NO_OPTION)
+    total_correct = correct.sum(axis=1)
+    total_answered = answered.sum(axis=1)
+    return GradeTotals(
+        correct=correct,
+        total_correct=total_correct,
+        total_incorrect=total_answered - total_correct,
+        total_blank=np.asarray(total_questions) - total_answered,
+    )
+
+
+def percentage(score: int, total_questions: int) -> float:
+    return round((score / total_questions) * 100, 2) if total_questions > 0 else 0
+
+
+def key_to_list(key: np.ndarray) -> List[Optional[int]]:
+    return [None if option == NO_OPTION else int(option) for option in key]
+
+
+# Fraction of the cohort in each of the upper/lower groups of the
+# discrimination index (Kelley's 27%).
+DISCRIMINATION_GROUP = 0.27
+
+
+@dataclass
+class ItemAnalysis:
+    """Cohort-level statistics of an exam, one entry per question."""
+    scores: np.ndarray  # per attempt
+    difficulty: np.ndarray  # proportion correct (NaN without key)
+    discrimination: np.ndarray  # upper - lower group proportion correct
+    point_biserial: np.ndarray  # item vs rest-of-exam score correlation
+    option_counts: np.ndarray  # (questions x options)
+    blank_rate: np.ndarray
+
+
+def item_analysis(selected: np.ndarray, key: np.ndarray, num_options: int) -> ItemAnalysis:
+    """
+    Item analysis of a non-empty (attempts x questions) selection matrix in a
+    few whole-matrix passes. Questions without key get NaN statistics, as do
+    correlations of questions without variance.
+    """
+    attempts, questions = selected.shape
+    keyed = key != NO_OPTION
+    answered = selected != NO_OPTION
+    correct = answered & (selected == key[None, :]) & keyed[None, :]
+    correct_f = correct.astype(np.float64)
+    scores = correct.sum(axis=1)
+
+    difficulty = np.where(keyed, correct_f.mean(axis=0), np.nan)
+    blank_rate = (~answered).mean(axis=0)
+
+    # Upper/lower groups by total score (stable order breaks ties by arrival)
+    discrimination = np.full(questions, np.nan)
+    if attempts >= 2:
+        group = max(1, int(round(attempts * DISCRIMINATION_GROUP)))
+        order = np.argsort(scores, kind="stable")
+        lower, upper = correct_f[order[:group]], correct_f[order[-group:]]
+        discrimination = np.where(keyed, upper.mean(axis=0) - lower.mean(axis=0), np.nan)
+
+    # Corrected point-biserial: each item against the score without that item
+    rest = scores[:, None] - correct_f
+    item_c = correct_f - correct_f.mean(axis=0)
+    rest_c = rest - rest.mean(axis=0)
+    cov = (item_c * rest_c).sum(axis=0)
+    norm = np.sqrt((item_c ** 2).sum(axis=0) * (rest_c ** 2).sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        point_biserial = np.where(keyed & (norm > 0), cov / norm, np.nan)
+
+    # Option distribution via one bincount over (question, option) pairs
+    valid = answered & (selected < num_options)
+    flat = (np.nonzero(valid)[1] * num_options + selected[valid]).astype(np.int64)
+    option_counts = np.bincount(flat, minlength=questions * num_options).reshape(
+        questions, num_options
+    )
+
+    return ItemAnalysis(
+        scores=scores,
+        difficulty=difficulty,
+        discrimination=discrimination,
+        point_biserial=point_biserial,
+        option_counts=option_counts,
+        blank_rate=blank_rate,
+    )
+
+
+def finite_or_none(value: float, digits: int = 4) -> Optional[float]:
+    return None if not np.isfinite(value) else round(float(value), digits)
@@ -1,8 +1,12 @@
 """Image utilities for OMR processing - inspired by OMRChecker."""
 
+import hashlib
+import threading
+from functools import lru_cache
+
 import cv2
 import numpy as np
-from typing import Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List
 import structlog
 
 logger = structlog.get_logger()
@@ -66,6 +70,30 @@ class ImageUtils:
         
         return rect
     
+    @staticmethod
+    def box_means(
+        gray: np.ndarray,
+        boxes: np.ndarray,
+        integral: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Mean intensity of many (x, y, w, h) boxes from one integral image.
+        Boxes are clipped to the image; empty boxes yield NaN.
+        Pass `integral` (cv2.integral(gray, sdepth=cv2.CV_64F)) to reuse it.
+        """
+        if integral is None:
+            integral = cv2.integral(gray, sdepth=cv2.CV_64F)
+        h, w = gray.shape[:2]
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        x0 = np.clip(boxes[:, 0], 0, w)
+        y0 = np.clip(boxes[:, 1], 0, h)
+        x1 = np.clip(boxes[:, 0] + boxes[:, 2], 0, w)
+        y1 = np.clip(boxes[:, 1] + boxes[:, 3], 0, h)
+        area = np.maximum(x1 - x0, 0) * np.maximum(y1 - y0, 0)
+        sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(area > 0, sums / np.maximum(area, 1), np.nan)
+    
     @staticmethod
     def adjust_gamma(image: np.ndarray, gamma: float = 1.0) -> np.ndarray:
         """Adjust image gamma for better contrast."""
@@ -79,19 +107,35 @@ class MarkerDetector:
     """
     Detect markers in corners of OMR sheet for precise alignment.
     Based on OMRChecker's CropOnMarkers approach.
+    
+    The search is restricted to corner regions and runs coarse-to-fine:
+    candidate scales are scored on an image pyramid, then the winner is
+    matched at full resolution only in a small window around the coarse hit.
+    Prepared templates are cached per scale, and the best scale is remembered
+    per template and image resolution so later sheets skip the scale search.
     """
     
+    # Shared across instances (OMRProcessor is created per request)
+    _template_cache: Dict[Tuple[str, float, int], np.ndarray] = {}
+    _scale_cache: Dict[Tuple[str, Tuple[int, int]], float] = {}
+    _cache_lock = threading.Lock()
+    MAX_CACHED_RESOLUTIONS = 256
+    
     def __init__(
         self,
         min_matching_threshold: float = 0.3,
         max_matching_variation: float = 0.41,
         marker_rescale_range: Tuple[int, int] = (35, 100),
         marker_rescale_steps: int = 10,
+        corner_roi_ratio: float = 0.3,
+        pyramid_levels: int = 2,
     ):
         self.min_matching_threshold = min_matching_threshold
         self.max_matching_variation = max_matching_variation
         self.marker_rescale_range = marker_rescale_range
         self.marker_rescale_steps = marker_rescale_steps
+        self.corner_roi_ratio = corner_roi_ratio
+        self.pyramid_levels = pyramid_levels
     
     def create_default_marker(self, size: int = 50) -> np.ndarray:
         """Create a default square marker for template matching."""
@@ -107,8 +151,8 @@ class MarkerDetector:
         marker: Optional[np.ndarray] = None
     ) -> Optional[np.ndarray]:
         """
-        Find markers in 4 quadrants of the image.
-        Returns 4 corner points if found, None otherwise.
+        Find markers in the 4 corner regions of the image.
+        Returns 4 corner points (TL, TR, BL, BR marker centres) if found, None otherwise.
         """
         if marker is None:
             marker = self.create_default_marker()
@@ -117,111 +161,266 @@ class MarkerDetector:
         if len(image.shape) == 3:
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         else:
-            gray = image.copy()
+            gray = image
+        
+        h, w = gray.shape[:2]
+        rois = [
+            (self._prepare_roi(gray[y0:y1, x0:x1]), (x0, y0))
+            for (x0, y0, x1, y1) in self._corner_rois(w, h)
+        ]
+        
+        template_key = self._template_key(marker)
+        resolution_key = (template_key, (h, w))
+        
+        # Fast path: scale remembered for this template/resolution
+        cached_scale = self._scale_cache.get(resolution_key)
+        if cached_scale is not None:
+            centres, _ = self._match_corners(rois, marker, template_key, cached_scale)
+            if centres is not None:
+                logger.info(f"Found all 4 markers at cached scale {cached_scale:.2f}")
+                return centres
+            with self._cache_lock:
+                self._scale_cache.pop(resolution_key, None)
+        
+        # Find best scale for marker (coarse, on the pyramid)
+        best_scale, coarse_hits = self._get_best_scale(rois, marker, template_key)
+        if best_scale is None:
+            logger.warning("Could not find optimal marker scale")
+            return None
         
-        # Normalize and apply CLAHE
-        gray = ImageUtils.normalize_util(gray)
+        # Refine at full resolution around the coarse hits
+        centres, score = self._match_corners(
+            rois, marker, template_key, best_scale, hints=coarse_hits
+        )
+        if centres is None:
+            return None
+        
+        with self._cache_lock:
+            if len(self._scale_cache) >= self.MAX_CACHED_RESOLUTIONS:
+                self._scale_cache.clear()
+            self._scale_cache[resolution_key] = best_scale
+        logger.info(f"Found all 4 markers at scale {best_scale:.2f}", score=round(score, 3))
+        return centres
+    
+    def _corner_rois(self, w: int, h: int) -> List[Tuple[int, int, int, int]]:
+        """Corner regions as (x0, y0, x1, y1): TL, TR, BL, BR."""
+        rw = max(1, int(w * self.corner_roi_ratio))
+        rh = max(1, int(h * self.corner_roi_ratio))
+        return [
+            (0, 0, rw, rh),
+            (w - rw, 0, w, rh),
+            (0, h - rh, rw, h),
+            (w - rw, h - rh, w, h),
+        ]
+    
+    @staticmethod
+    def _prepare_roi(roi: np.ndarray) -> List[np.ndarray]:
+        """Normalize, CLAHE and erode a corner region; returns its pyramid (level 0 first)."""
+        roi = ImageUtils.normalize_util(roi)
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray = clahe.apply(gray)
+        roi = clahe.apply(roi)
         
         # Apply erosion to enhance markers
-        eroded = gray - cv2.erode(gray, kernel=np.ones((5, 5)), iterations=2)
-        eroded = ImageUtils.normalize_util(eroded)
-        
-        h, w = eroded.shape[:2]
-        midh, midw = h // 2, w // 2
-        
-        # Define quadrants
-        quads = {
-            0: (eroded[0:midh, 0:midw], (0, 0)),          # Top-left
-            1: (eroded[0:midh, midw:w], (midw, 0)),       # Top-right
-            2: (eroded[midh:h, 0:midw], (0, midh)),       # Bottom-left
-            3: (eroded[midh:h, midw:w], (midw, midh)),    # Bottom-right
-        }
+        eroded = roi - cv2.erode(roi, kernel=np.ones((5, 5)), iterations=2)
+        return [ImageUtils.normalize_util(eroded)]
+    
+    @staticmethod
+    def _pyramid_level(pyramid: List[np.ndarray], level: int) -> np.ndarray:
+        """Get (lazily building) a pyramid level."""
+        while len(pyramid) <= level:
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+        return pyramid[level]
+    
+    @staticmethod
+    def _template_key(marker: np.ndarray) -> str:
+        digest = hashlib.blake2b(marker.tobytes(), digest_size=8).hexdigest()
+        return f"{marker.shape[0]}x{marker.shape[1]}:{digest}"
+    
+    def _candidate_scales(self) -> List[float]:
+        step = (self.marker_rescale_range[1] - self.marker_rescale_range[0]) / self.marker_rescale_steps
+        scales = np.arange(self.marker_rescale_range[1], self.marker_rescale_range[0], -step) / 100.0
+        return [round(float(s), 4) for s in scales if s > 0]
+    
+    def _prepared_template(
+        self, marker: np.ndarray, template_key: str, scale: float, level: int = 0
+    ) -> np.ndarray:
+        """Resized + normalized + eroded template for a scale and pyramid level (cached)."""
+        cache_key = (template_key, scale, level)
+        template = self._template_cache.get(cache_key)
+        if template is not None:
+            return template
+        
+        if level == 0:
+            template = cv2.resize(marker, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            template = ImageUtils.normalize_util(template)
+            template = template - cv2.erode(template, kernel=np.ones((5, 5)), iterations=2)
+        else:
+            template = cv2.pyrDown(self._prepared_template(marker, template_key, scale, level - 1))
         
-        # Find best scale for marker
-        best_scale = self._get_best_scale(eroded, marker)
-        if best_scale is None:
-            logger.warning("Could not find optimal marker scale")
-            return None
+        with self._cache_lock:
+            self._template_cache[cache_key] = template
+        return template
+    
+    def _coarse_level(self, marker: np.ndarray, scale: float) -> int:
+        """Deepest pyramid level at which the template keeps at least 8 px."""
+        size = min(marker.shape[:2]) * scale
+        level = self.pyramid_levels
+        while level > 0 and size / (2 ** level) < 8:
+            level -= 1
+        return level
+    
+    def _get_best_scale(
+        self,
+        rois: List[Tuple[List[np.ndarray], Tuple[int, int]]],
+        marker: np.ndarray,
+        template_key: str,
+    ) -> Tuple[Optional[float], Optional[List[Tuple[int, int]]]]:
+        """
+        Find the best scale for the marker template on the image pyramid.
+        Returns (scale, per-corner coarse locations mapped to full resolution).
+        """
+        best_scale = None
+        best_val = 0.0
+        best_hits = None
         
-        # Resize marker to optimal scale
-        optimal_marker = cv2.resize(
-            marker, 
-            None, 
-            fx=best_scale, 
-            fy=best_scale, 
-            interpolation=cv2.INTER_AREA
-        )
+        for scale in self._candidate_scales():
+            level = self._coarse_level(marker, scale)
+            template = self._prepared_template(marker, template_key, scale, level)
+            factor = 2 ** level
+            
+            values = []
+            hits = []
+            for pyramid, _ in rois:
+                roi = self._pyramid_level(pyramid, level)
+                if template.shape[0] > roi.shape[0] or template.shape[1] > roi.shape[1]:
+                    break
+                res = cv2.matchTemplate(roi, template, cv2.TM_CCOEFF_NORMED)
+                _, max_val, _, max_loc = cv2.minMaxLoc(res)
+                values.append(max_val)
+                hits.append((max_loc[0] * factor, max_loc[1] * factor))
+            
+            if len(values) != len(rois):
+                continue
+            
+            # The marker must be present in every corner
+            score = float(np.mean(values))
+            if score > best_val:
+                best_val = score
+                best_scale = scale
+                best_hits = hits
         
-        # Prepare marker for matching
-        optimal_marker = ImageUtils.normalize_util(optimal_marker)
-        optimal_marker = optimal_marker - cv2.erode(
-            optimal_marker, 
-            kernel=np.ones((5, 5)), 
-            iterations=2
-        )
+        if best_val < self.min_matching_threshold:
+            return None, None
         
-        mh, mw = optimal_marker.shape[:2]
-        centres = []
+        return best_scale, best_hits
+    
+    def _match_corners(
+        self,
+        rois: List[Tuple[List[np.ndarray], Tuple[int, int]]],
+        marker: np.ndarray,
+        template_key: str,
+        scale: float,
+        hints: Optional[List[Tuple[int, int]]] = None,
+    ) -> Tuple[Optional[np.ndarray], float]:
+        """
+        Full-resolution matching in each corner, restricted to a window around
+        `hints` when given. Returns (centres, mean score) or (None, 0).
+        """
+        template = self._prepared_template(marker, template_key, scale)
+        mh, mw = template.shape[:2]
+        margin = 2 ** (self.pyramid_levels + 1)
         
-        for k in range(4):
-            quad, origin = quads[k]
+        centres = []
+        values = []
+        for k, (pyramid, origin) in enumerate(rois):
+            roi = pyramid[0]
+            x_off, y_off = 0, 0
+            if hints is not None:
+                hx, hy = hints[k]
+                x_off = max(0, hx - margin)
+                y_off = max(0, hy - margin)
+                roi = roi[y_off:hy + mh + margin, x_off:hx + mw + margin]
+            
+            if mh > roi.shape[0] or mw > roi.shape[1]:
+                return None, 0.0
             
             # Template matching
-            res = cv2.matchTemplate(quad, optimal_marker, cv2.TM_CCOEFF_NORMED)
+            res = cv2.matchTemplate(roi, template, cv2.TM_CCOEFF_NORMED)
             _, max_val, _, max_loc = cv2.minMaxLoc(res)
             
             if max_val < self.min_matching_threshold:
-                logger.warning(f"Marker not found in quadrant {k+1}, max_val={max_val:.3f}")
-                return None
+                logger.warning(f"Marker not found in corner {k+1}, max_val={max_val:.3f}")
+                return None, 0.0
             
             # Calculate center of found marker
-            pt = (
-                origin[0] + max_loc[0] + mw // 2,
-                origin[1] + max_loc[1] + mh // 2
-            )
-            centres.append(pt)
+            centres.append((
+                origin[0] + x_off + max_loc[0] + mw // 2,
+                origin[1] + y_off + max_loc[1] + mh // 2,
+            ))
+            values.append(max_val)
         
-        logger.info(f"Found all 4 markers at scale {best_scale:.2f}")
-        return np.array(centres, dtype=np.float32)
+        return np.array(centres, dtype=np.float32), float(np.mean(values))
+
+
+class FiducialMarkerDetector:
+    """
+    Detect ArUco/AprilTag fiducials printed at the corners of our own sheet templates.
+    A single detection pass returns the four registration corners with subpixel
+    accuracy; there is no scale search (unlike MarkerDetector).
+    """
     
-    def _get_best_scale(self, image: np.ndarray, marker: np.ndarray) -> Optional[float]:
-        """Find the best scale for the marker template."""
-        best_scale = None
-        best_val = 0
-        
-        step = (self.marker_rescale_range[1] - self.marker_rescale_range[0]) / self.marker_rescale_steps
+    # For markers at TL, TR, BR, BL: index of the marker corner facing the answer area
+    # (ArUco corner order is TL, TR, BR, BL of the marker itself)
+    _INNER_CORNER = (2, 3, 0, 1)
+    
+    def __init__(
+        self,
+        dictionary: str = "DICT_4X4_50",
+        corner_ids: Tuple[int, int, int, int] = (0, 1, 2, 3),
+    ):
+        self.dictionary = dictionary
+        self.corner_ids = tuple(corner_ids)
+        self._detector = self._get_detector(dictionary)
+    
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _get_detector(dictionary: str) -> "cv2.aruco.ArucoDetector":
+        """Build (once per dictionary) an ArUco detector with subpixel corner refinement."""
+        params = cv2.aruco.DetectorParameters()
+        params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+        aruco_dict = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, dictionary))
+        return cv2.aruco.ArucoDetector(aruco_dict, params)
+    
+    def find_corners(self, image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Find the registration corners (TL, TR, BR, BL).
+        Returns None unless all four corner markers are found.
+        """
+        if len(image.shape) == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = image
         
-        for scale_percent in np.arange(
-            self.marker_rescale_range[1], 
-            self.marker_rescale_range[0], 
-            -step
-        ):
-            scale = scale_percent / 100.0
-            if scale <= 0:
-                continue
-            
-            rescaled = cv2.resize(marker, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-            
-            if rescaled.shape[0] > image.shape[0] or rescaled.shape[1] > image.shape[1]:
-                continue
-            
-            # Prepare for matching
-            rescaled = ImageUtils.normalize_util(rescaled)
-            rescaled = rescaled - cv2.erode(rescaled, kernel=np.ones((5, 5)), iterations=2)
-            
-            res = cv2.matchTemplate(image, rescaled, cv2.TM_CCOEFF_NORMED)
-            _, max_val, _, _ = cv2.minMaxLoc(res)
-            
-            if max_val > best_val:
-                best_val = max_val
-                best_scale = scale
+        marker_corners, ids, _ = self._detector.detectMarkers(gray)
+        if ids is None:
+            logger.warning("No fiducial markers found")
+            return None
         
-        if best_val < self.min_matching_threshold:
+        found = {
+            int(marker_id): corners.reshape(4, 2)
+            for marker_id, corners in zip(ids.flatten(), marker_corners, strict=True)
+        }
+        missing = [marker_id for marker_id in self.corner_ids if marker_id not in found]
+        if missing:
+            logger.warning(f"Fiducial markers missing: {missing}", found=sorted(found))
             return None
         
-        return best_scale
+        corners = np.array(
+            [found[marker_id][self._INNER_CORNER[pos]] for pos, marker_id in enumerate(self.corner_ids)],
+            dtype=np.float32,
+        )
+        logger.info("Found all 4 fiducial markers", dictionary=self.dictionary)
+        return corners
 
 
 class AdaptiveThreshold:
@@ -282,6 +481,64 @@ class AdaptiveThreshold:
         # Blend with global threshold
         return (local_threshold + global_threshold) / 2
     
+    @staticmethod
+    def threshold_matrix(
+        intensities: np.ndarray,
+        empty: Optional[np.ndarray] = None,
+        global_looseness: float = 4.0,
+        local_looseness: float = 2.0,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Global + local thresholding of a (rows x bubbles) intensity matrix.
+        
+        NaN cells are padding (ragged rows) and are ignored. `empty` flags
+        cells whose region was empty: they read as white (255) within their
+        row but are left out of the global statistics.
+        Same rules as get_global_threshold/get_local_threshold, as array ops.
+        
+        Returns: (marked bool matrix, confidence matrix, local threshold per row)
+        """
+        values = np.asarray(intensities, dtype=np.float64)
+        if values.ndim != 2:
+            values = values.reshape(len(values), -1)
+        present = ~np.isnan(values)
+        empty = np.zeros_like(present) if empty is None else (np.asarray(empty, bool) & present)
+        row_vals = np.where(empty, 255.0, values)
+        
+        # Global threshold over every non-empty bubble
+        sampled = row_vals[present & ~empty]
+        if sampled.size:
+            global_thr = float(np.clip(sampled.mean() - global_looseness * sampled.std(), 0, 255))
+        else:
+            global_thr = 128.0
+        
+        # Per-row statistics (masked)
+        counts = present.sum(axis=1)
+        safe_counts = np.maximum(counts, 1)
+        filled = np.where(present, row_vals, 0.0)
+        row_mean = filled.sum(axis=1) / safe_counts
+        row_std = np.sqrt(
+            np.where(present, (row_vals - row_mean[:, None]) ** 2, 0.0).sum(axis=1) / safe_counts
+        )
+        row_std = np.where(counts > 1, row_std, 0.0)
+        
+        # Rows whose spread is not an outlier keep the global threshold
+        if len(row_std):
+            std_thr = float(np.clip(row_std.mean() - 4.0 * row_std.std(), 0, 255))
+        else:
+            std_thr = 128.0
+        no_outliers = row_std < std_thr
+        
+        local = (row_mean - local_looseness * row_std + global_thr) / 2
+        use_global = no_outliers | (counts == 0) | (row_std < 10)
+        local_thr = np.where(use_global, global_thr, local)
+        
+        thr = local_thr[:, None]
+        marked = present & (row_vals < thr)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            confidence = np.where(marked, np.clip((thr - row_vals) / thr, 0, 1), 0.0)
+        return marked, confidence, local_thr
+    
     @staticmethod
     def detect_marked_bubbles(
         gray_image: np.ndarray,
@@ -290,58 +547,53 @@ class AdaptiveThreshold:
         """
         Detect marked bubbles using adaptive thresholding.
         Returns list of rows, each containing (bubble_index, confidence) pairs.
-        """
-        all_values = []
-        row_values_list = []
-        
-        # First pass: collect all intensity values
-        for row in row_regions:
-            row_values = []
-            for x, y, w, h in row:
-                region = gray_image[y:y+h, x:x+w]
-                if region.size > 0:
-                    mean_intensity = np.mean(region)
-                    row_values.append(mean_intensity)
-                    all_values.append(mean_intensity)
-                else:
-                    row_values.append(255)  # White = unmarked
-            row_values_list.append(row_values)
-        
-        # Calculate global threshold
-        global_thr, _, global_std = AdaptiveThreshold.get_global_threshold(all_values)
-        
-        # Calculate per-row std to detect uniform rows
-        row_stds = [np.std(rv) if len(rv) > 1 else 0 for rv in row_values_list]
-        global_std_thr, _, _ = AdaptiveThreshold.get_global_threshold(row_stds)
-        
-        results = []
-        
-        # Second pass: detect with adaptive threshold
-        for row_idx, (row_values, row_std) in enumerate(zip(row_values_list, row_stds)):
-            no_outliers = row_std < global_std_thr
-            local_thr = AdaptiveThreshold.get_local_threshold(
-                row_values, global_thr, no_outliers
-            )
-            
-            marked_bubbles = []
-            for bubble_idx, intensity in enumerate(row_values):
-                # Lower intensity = darker = more likely marked
-                is_marked = intensity < local_thr
-                confidence = (local_thr - intensity) / local_thr if is_marked else 0
-                confidence = max(0, min(1, confidence))
-                marked_bubbles.append((bubble_idx, confidence if is_marked else 0))
-            
-            results.append(marked_bubbles)
         
-        return results
+        All region means come from one integral image and the thresholds are
+        computed on the padded (rows x bubbles) matrix (see threshold_matrix).
+        """
+        if not row_regions:
+            return []
+        
+        widths = [len(row) for row in row_regions]
+        max_width = max(widths)
+        boxes = np.zeros((len(row_regions), max_width, 4), dtype=np.int64)
+        present = np.zeros((len(row_regions), max_width), dtype=bool)
+        for row_idx, row in enumerate(row_regions):
+            if row:
+                boxes[row_idx, :len(row)] = row
+                present[row_idx, :len(row)] = True
+        
+        means = ImageUtils.box_means(gray_image, boxes.reshape(-1, 4)).reshape(present.shape)
+        empty = present & np.isnan(means)
+        intensities = np.where(present, np.where(empty, 255.0, means), np.nan)
+        
+        _, confidence, _ = AdaptiveThreshold.threshold_matrix(intensities, empty=empty)
+        
+        return [
+            [(bubble_idx, float(confidence[row_idx, bubble_idx])) for bubble_idx in range(width)]
+            for row_idx, width in enumerate(widths)
+        ]
 
 
 class HorizontalLineDetector:
     """
     Detect horizontal lines in OMR sheet to dynamically adjust grid.
     This helps handle paper curvature by finding actual row positions.
+    
+    Projections are computed with cv2.reduce and peaks are found with
+    NumPy sign changes, so there is no per-pixel Python loop.
     """
     
+    # Detected rows may deviate at most this fraction of a row from the uniform grid
+    MAX_ROW_DEVIATION = 0.5
+    
+    @staticmethod
+    def _row_projection(binary: np.ndarray) -> np.ndarray:
+        """Normalized horizontal projection (white pixels per row)."""
+        projection = cv2.reduce(binary, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F).ravel()
+        peak = projection.max() if projection.size else 0
+        return projection / peak if peak > 0 else projection
+    
     @staticmethod
     def detect_row_positions(
         gray_image: np.ndarray,
@@ -363,7 +615,7 @@ class HorizontalLineDetector:
         
         # Apply morphological operations to enhance horizontal lines
         # Use a horizontal kernel to detect horizontal structures
-        h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (w // 4, 1))
+        h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, w // 4), 1))
         
         # Apply morphology to find horizontal lines
         morph = cv2.morphologyEx(gray_image, cv2.MORPH_OPEN, h_kernel)
@@ -371,22 +623,20 @@ class HorizontalLineDetector:
         # Threshold
         _, binary = cv2.threshold(morph, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
         
-        # Find horizontal projection (sum of white pixels per row)
-        projection = np.sum(binary, axis=1)
+        # Horizontal projection (sum of white pixels per row), normalized
+        projection = HorizontalLineDetector._row_projection(binary)
         
-        # Normalize projection
-        projection = projection / np.max(projection) if np.max(projection) > 0 else projection
-        
-        # Find peaks in projection (these are the row separators)
-        # We look for valleys actually (where there are lines/gaps between rows)
-        min_distance = h // (expected_rows + 5)  # Minimum distance between rows
+        # Minimum distance between rows
+        min_distance = h // (expected_rows + 5)
         
         # Find row centers by detecting transitions
         row_positions = HorizontalLineDetector._find_row_centers_from_projection(
             projection, expected_rows, min_distance
         )
         
-        if len(row_positions) == expected_rows:
+        if len(row_positions) == expected_rows and HorizontalLineDetector._is_plausible(
+            row_positions, h, expected_rows
+        ):
             logger.info(f"Detected {len(row_positions)} row positions dynamically")
             return row_positions
         
@@ -394,13 +644,21 @@ class HorizontalLineDetector:
         logger.warning(f"Dynamic row detection found {len(row_positions)} rows, expected {expected_rows}. Using uniform distribution.")
         return HorizontalLineDetector._uniform_row_positions(h, expected_rows)
     
+    @staticmethod
+    def _is_plausible(row_positions: List[int], height: int, num_rows: int) -> bool:
+        """Reject detections that stray too far from the uniform grid (e.g. header lines)."""
+        row_height = height / num_rows
+        uniform = (np.arange(num_rows) + 0.5) * row_height
+        deviation = np.abs(np.asarray(row_positions) - uniform).max()
+        return bool(deviation <= row_height * HorizontalLineDetector.MAX_ROW_DEVIATION)
+    
     @staticmethod
     def _find_row_centers_from_projection(
         projection: np.ndarray,
         expected_rows: int,
         min_distance: int
     ) -> List[int]:
-        """Find row centers from horizontal projection."""
+        """Find row centers (peaks) from horizontal projection."""
         h = len(projection)
         
         # Smooth the projection to reduce noise
@@ -409,91 +667,93 @@ class HorizontalLineDetector:
             kernel_size += 1
         smoothed = np.convolve(projection, np.ones(kernel_size) / kernel_size, mode='same')
         
-        # Find local maxima (row areas) and minima (separators)
-        # We want to find where the content is (maxima = rows with bubbles)
-        
-        # Use gradient to find transitions
+        # Peaks = gradient sign change from positive to non-positive
         gradient = np.gradient(smoothed)
-        
-        # Find zero crossings (transitions between rows)
-        crossings = []
-        for i in range(1, len(gradient)):
-            if gradient[i-1] > 0 and gradient[i] <= 0:  # Positive to negative = peak
-                crossings.append(i)
-        
-        # Filter crossings by minimum distance
-        filtered = []
-        for c in crossings:
-            if not filtered or (c - filtered[-1]) >= min_distance:
-                filtered.append(c)
-        
-        if len(filtered) < expected_rows:
+        peaks = np.flatnonzero((gradient[:-1] > 0) & (gradient[1:] <= 0)) + 1
+        
+        # Non-maximum suppression: keep the most prominent peaks at least
+        # min_distance apart (loop is over peaks, not pixels)
+        kept: List[int] = []
+        for peak in peaks[np.argsort(-smoothed[peaks], kind="stable")]:
+            if all(abs(peak - k) >= min_distance for k in kept):
+                kept.append(int(peak))
+                if len(kept) == expected_rows:
+                    break
+        
+        if len(kept) < expected_rows:
             # Not enough rows found, try different approach
             return HorizontalLineDetector._find_rows_by_intensity(projection, expected_rows)
         
-        # Take the expected number of most prominent peaks
-        return filtered[:expected_rows]
+        return sorted(kept)
     
     @staticmethod
     def _find_rows_by_intensity(
         projection: np.ndarray,
         expected_rows: int
     ) -> List[int]:
-        """Alternative method: divide into expected rows and find center of each."""
+        """Alternative method: divide into expected rows and take each band's center of mass."""
         h = len(projection)
-        row_height = h / expected_rows
+        bounds = (np.arange(expected_rows + 1) * (h / expected_rows)).astype(int)
         
-        row_positions = []
-        for i in range(expected_rows):
-            start = int(i * row_height)
-            end = int((i + 1) * row_height)
-            
-            # Find the center of mass of this section
-            section = projection[start:end]
-            if np.sum(section) > 0:
-                # Weighted center
-                indices = np.arange(len(section))
-                center = int(start + np.average(indices, weights=section + 0.001))
-            else:
-                center = int(start + row_height / 2)
-            
-            row_positions.append(center)
+        # Weighted centers of all bands at once via cumulative sums
+        weights = projection.astype(np.float64) + 0.001
+        cum_w = np.concatenate(([0.0], np.cumsum(weights)))
+        cum_wi = np.concatenate(([0.0], np.cumsum(weights * np.arange(h))))
+        starts, ends = bounds[:-1], np.maximum(bounds[1:], bounds[:-1] + 1)
+        centers = (cum_wi[ends] - cum_wi[starts]) / (cum_w[ends] - cum_w[starts])
         
-        return row_positions
+        return centers.astype(int).tolist()
     
     @staticmethod
     def _uniform_row_positions(height: int, num_rows: int) -> List[int]:
         """Generate uniform row positions (fallback)."""
-        row_height = height / num_rows
-        return [int((i + 0.5) * row_height) for i in range(num_rows)]
+        return ((np.arange(num_rows) + 0.5) * (height / num_rows)).astype(int).tolist()
     
     @staticmethod
     def detect_column_separators(
         gray_image: np.ndarray,
-        expected_cols: int = 3
+        expected_cols: int = 3,
+        search_ratio: float = 0.15,
+        min_line_coverage: float = 0.3,
     ) -> List[int]:
         """
         Detect vertical column separators.
         
+        Each interior boundary is searched within ±search_ratio of a column width
+        around its uniform position; the vertical projection peak is used when a
+        line covers at least min_line_coverage of the height.
+        
         Returns:
             List of X positions for column boundaries (including start and end)
         """
         h, w = gray_image.shape[:2]
+        col_width = w / expected_cols
+        uniform = (np.arange(expected_cols + 1) * col_width).astype(int)
+        if expected_cols < 2:
+            return uniform.tolist()
         
-        # Use vertical kernel to detect vertical lines
-        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, h // 4))
-        morph = cv2.morphologyEx(gray_image, cv2.MORPH_OPEN, v_kernel)
+        # Use vertical kernel to detect vertical lines: closing keeps only dark
+        # structures taller than the kernel (separators), not bubble columns
+        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, h // 4)))
+        morph = cv2.morphologyEx(gray_image, cv2.MORPH_CLOSE, v_kernel)
         
         # Threshold
         _, binary = cv2.threshold(morph, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
         
-        # Vertical projection
-        projection = np.sum(binary, axis=0)
+        # Vertical projection, as fraction of the height covered by dark pixels
+        projection = cv2.reduce(binary, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32F).ravel() / (255.0 * h)
         
-        # Find peaks (column separators are usually dark vertical lines)
-        # But for now, use uniform distribution as fallback
-        col_width = w / expected_cols
-        return [int(i * col_width) for i in range(expected_cols + 1)]
+        # Search windows for all interior boundaries at once
+        radius = max(1, int(col_width * search_ratio))
+        offsets = np.arange(-radius, radius + 1)
+        windows = np.clip(uniform[1:-1, None] + offsets[None, :], 0, w - 1)
+        values = projection[windows]
+        best = values.argmax(axis=1)
+        found = values[np.arange(len(best)), best] >= min_line_coverage
+        
+        boundaries = uniform.copy()
+        boundaries[1:-1] = np.where(found, windows[np.arange(len(best)), best], uniform[1:-1])
+        return boundaries.tolist()
     
     @staticmethod
     def get_adaptive_grid(
@@ -531,4 +791,3 @@ class HorizontalLineDetector:
         
         logger.info(f"Adaptive grid: {num_cols} columns, {rows_per_col} rows each")
         return col_boundaries, row_positions_per_col
-
@@ -0,0 +1,233 @@
+"""
+Per-attempt intensity store.
+
+The decision stage only needs the sampled (questions x options) intensity
+matrix, so each processed attempt can keep that matrix plus its geometry
+metadata and the answers it produced in a local SQLite file. Retuned
+decision thresholds are then applied to past exams by re-running the decider
+over the stored matrices, without downloading or decoding any image.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import structlog
+
+from app.core.config import settings
+from app.core.constants import AnswerStatus
+from app.schemas.processing import DetectedAnswer
+from app.services.engines import Decider, get_engine
+
+logger = structlog.get_logger()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempt_intensities (
+    attempt_id   TEXT PRIMARY KEY,
+    exam_id      TEXT,
+    engine       TEXT,
+    questions    INTEGER NOT NULL,
+    options      INTEGER NOT NULL,
+    intensities  BLOB NOT NULL,   -- float32, row-major, NaN = bubble not found
+    selections   TEXT NOT NULL,   -- JSON [[selected_option, status], ...]
+    geometry     TEXT NOT NULL,   -- JSON metadata (template, region shape, grid)
+    stored_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempt_intensities_exam ON attempt_intensities (exam_id);
+CREATE TABLE IF NOT EXISTS exam_answer_keys (
+    exam_id      TEXT PRIMARY KEY,
+    answer_key   TEXT NOT NULL,   -- JSON [correct_option | null, ...]
+    updated_at   REAL NOT NULL
+);
+"""
+
+Selection = Tuple[Optional[int], str]
+
+
+@dataclass
+class IntensityRecord:
+    """Stored decision input (and output) of one attempt."""
+    attempt_id: str
+    exam_id: Optional[str]
+    engine: Optional[str]
+    intensities: np.ndarray  # float32 (questions x options)
+    selections: List[Selection]  # (selected_option, status) per question
+    geometry: Dict[str, Any] = field(default_factory=dict)
+    stored_at: float = field(default_factory=time.time)
+
+    def selected_options(self) -> List[Optional[int]]:
+        """Selected option per question, None for blanks."""
+        return [
+            None if status == AnswerStatus.BLANK.value else selected
+            for selected, status in self.selections
+        ]
+
+
+class IntensityStore:
+    """Thread-safe SQLite store of intensity matrices keyed by attempt."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def save(self, record: IntensityRecord) -> None:
+        """Insert or replace the attempt (re-processing overwrites it)."""
+        matrix = np.ascontiguousarray(record.intensities, dtype=np.float32)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attempt_intensities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.attempt_id,
+                    record.exam_id,
+                    record.engine,
+                    matrix.shape[0],
+                    matrix.shape[1],
+                    matrix.tobytes(),
+                    json.dumps(record.selections, separators=(",", ":")),
+                    json.dumps(record.geometry, separators=(",", ":")),
+                    record.stored_at,
+                ),
+            )
+
+    def get(self, attempt_id: str) -> Optional[IntensityRecord]:
+        records = self.find(attempt_ids=[attempt_id])
+        return records[0] if records else None
+
+    def find(
+        self,
+        exam_id: Optional[str] = None,
+        attempt_ids: Optional[Iterable[str]] = None,
+    ) -> List[IntensityRecord]:
+        """Attempts of an exam and/or with the given ids (ordered by store time)."""
+        clauses, params = [], []
+        if exam_id is not None:
+            clauses.append("exam_id = ?")
+            params.append(exam_id)
+        if attempt_ids is not None:
+            ids = list(attempt_ids)
+            if not ids:
+                return []
+            clauses.append(f"attempt_id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT attempt_id, exam_id, engine, questions, options, intensities, "
+                f"selections, geometry, stored_at FROM attempt_intensities{where} "
+                "ORDER BY stored_at",
+                params,
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def save_answer_key(self, exam_id: str, answer_key: List[Optional[int]]) -> None:
+        """Answer key the exam's attempts were last graded with (for re-grade deltas)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO exam_answer_keys VALUES (?, ?, ?)",
+                (exam_id, json.dumps(answer_key, separators=(",", ":")), time.time()),
+            )
+
+    def get_answer_key(self, exam_id: str) -> Optional[List[Optional[int]]]:
+        """Stored key of the exam; None if there is none or it has no correct option."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer_key FROM exam_answer_keys WHERE exam_id = ?", (exam_id,)
+            ).fetchone()
+        key = json.loads(row[0]) if row else None
+        return key if key and any(option is not None for option in key) else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM attempt_intensities").fetchone()[0]
+
+    @staticmethod
+    def _record(row: tuple) -> IntensityRecord:
+        attempt_id, exam_id, engine, questions, options, blob, selections, geometry, stored_at = row
+        return IntensityRecord(
+            attempt_id=attempt_id,
+            exam_id=exam_id,
+            engine=engine,
+            intensities=np.frombuffer(blob, dtype=np.float32).reshape(questions, options),
+            selections=[tuple(s) for s in json.loads(selections)],
+            geometry=json.loads(geometry),
+            stored_at=stored_at,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def store_attempt(
+    attempt_id: str,
+    exam_id: Optional[str],
+    result: Any,
+    answer_key: Optional[List[Optional[int]]] = None,
+) -> bool:
+    """
+    Persist an OMRResult's intensities for `attempt_id` (and the normalized
+    answer key it was graded with) when ENABLE_INTENSITY_STORE is set.
+    Storage errors are logged, never raised: the attempt itself succeeded.
+    """
+    if not settings.ENABLE_INTENSITY_STORE or result.intensities is None:
+        return False
+    record = IntensityRecord(
+        attempt_id=attempt_id,
+        exam_id=exam_id,
+        engine=result.engine,
+        intensities=result.intensities,
+        selections=[(a.selected_option, a.status.value) for a in result.answers],
+        geometry=result.geometry,
+    )
+    try:
+        store = get_intensity_store()
+        store.save(record)
+        if exam_id is not None and answer_key is not None:
+            store.save_answer_key(exam_id, answer_key)
+    except Exception as e:
+        logger.warning("Could not store intensities", attempt_id=attempt_id, error=str(e))
+        return False
+    return True
+
+
+def redecide(
+    processor: Any, record: IntensityRecord, decider: Optional[Decider] = None
+) -> Tuple[List[DetectedAnswer], List[int]]:
+    """
+    Re-run only the decision stage on a stored matrix: answers plus the
+    question numbers whose selection or status changed. Without `decider`,
+    the decider of the engine that processed the attempt is used (refiners
+    are not re-run: the stored matrix already includes their re-samples).
+    """
+    if decider is None:
+        try:
+            decider = get_engine(record.engine or settings.OMR_ENGINE).decider
+        except ValueError:
+            decider = get_engine(settings.OMR_ENGINE).decider
+    answers = decider.decide(processor, record.intensities)
+    changed = [
+        answer.question_number
+        for answer, (selected, status) in zip(answers, record.selections, strict=True)
+        if answer.selected_option != selected or answer.status.value != status
+    ]
+    return answers, changed
+
+
+@lru_cache
+def get_intensity_store() -> IntensityStore:
+    """Get the process-wide intensity store (INTENSITY_STORE_PATH)."""
+    store = IntensityStore(settings.INTENSITY_STORE_PATH)
+    logger.info("Intensity store opened", path=store.path, attempts=store.count())
+    return store
@@ -1,7 +1,9 @@
 """OMR Processing service - optimized for phone photos with adaptive thresholding."""
 
+from contextlib import nullcontext
 from dataclasses import dataclass, field
-from typing import List, Optional, Tuple, Dict
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple, Dict
 import io
 import base64
 
@@ -10,15 +12,88 @@ import numpy as np
 from PIL import Image
 import structlog
 
+from app.core.config import settings
 from app.core.constants import (
     ANSWER_LABELS,
+    DEFAULT_SHEET_TEMPLATE,
+    SHEET_TEMPLATES,
     AnswerStatus,
+    ErrorCode,
 )
+from app.core.deadline import Deadline
+from app.core.executor import get_column_executor
+from app.core.timing import StageTimer
 from app.schemas.processing import DetectedAnswer
-from app.services.image_utils import ImageUtils, MarkerDetector, AdaptiveThreshold, HorizontalLineDetector
+from app.services.calibration_cache import Calibration, get_calibration_cache
+from app.services.engines import DetectionEngine, SheetLayout, get_engine
+from app.services.scanner import (
+    CAPTURE_MODE_AUTO,
+    CAPTURE_MODE_SCANNER,
+    CAPTURE_MODES,
+    ScannerReference,
+    detect_capture_mode,
+    get_scanner_registrar,
+    reference_path,
+)
+from app.services.timing_marks import TimingGrid, TimingMarkDetector
+from app.services.image_utils import (
+    ImageUtils,
+    MarkerDetector,
+    FiducialMarkerDetector,
+    AdaptiveThreshold,
+    HorizontalLineDetector,
+)
 
 logger = structlog.get_logger()
 
+# Grid localization modes for _sample_grid
+GRID_MODE_UNIFORM = "uniform"
+GRID_MODE_ADAPTIVE = "adaptive"
+GRID_MODES = (GRID_MODE_UNIFORM, GRID_MODE_ADAPTIVE)
+
+
+@lru_cache(maxsize=4)
+def _load_marker_template(path: Optional[str]) -> Optional[np.ndarray]:
+    """Load the corner marker template (None = MarkerDetector default square)."""
+    if not path:
+        return None
+    template = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if template is None:
+        logger.warning("Could not load marker template, using default", path=path)
+    return template
+
+
+def resolve_engine(engine: Optional[str] = None, template: Optional[str] = None) -> DetectionEngine:
+    """Engine for a request: explicit name > sheet template engine > settings.OMR_ENGINE."""
+    if engine:
+        return get_engine(engine)
+    template_config = get_sheet_template(template)
+    return get_engine(template_config.get("engine") or settings.OMR_ENGINE)
+
+
+def sheet_template_name(template: Optional[str] = None) -> str:
+    return template or settings.OMR_TEMPLATE or DEFAULT_SHEET_TEMPLATE
+
+
+def get_sheet_template(template: Optional[str] = None) -> dict:
+    """Sheet template config (None = settings.OMR_TEMPLATE); ValueError if unknown."""
+    name = sheet_template_name(template)
+    if name not in SHEET_TEMPLATES:
+        raise ValueError(
+            f"Unknown sheet template: {name} (available: {', '.join(sorted(SHEET_TEMPLATES))})"
+        )
+    return SHEET_TEMPLATES[name]
+
+
+def resolve_capture_mode(capture_mode: Optional[str], image_data: Optional[bytes] = None) -> str:
+    """photo/scanner for a request; "auto" (default OMR_CAPTURE_MODE) reads image metadata."""
+    mode = capture_mode or settings.OMR_CAPTURE_MODE
+    if mode not in CAPTURE_MODES:
+        raise ValueError(f"Unknown capture mode: {mode} (available: {', '.join(CAPTURE_MODES)})")
+    if mode == CAPTURE_MODE_AUTO and image_data is not None:
+        return detect_capture_mode(image_data)
+    return mode
+
 
 @dataclass
 class OMRResult:
@@ -26,8 +101,52 @@ class OMRResult:
     answers: List[DetectedAnswer] = field(default_factory=list)
     confidence_score: float = 0.0
     warnings: List[str] = field(default_factory=list)
-    processed_image: Optional[np.ndarray] = None
+    processed_image: Optional[np.ndarray] = None  # Binary region, engines that threshold it
     debug_image_base64: Optional[str] = None  # For debugging alignment
+    degraded: bool = False  # Slow stages skipped to meet the deadline
+    engine: Optional[str] = None  # Detection engine that produced the answers
+    stage_timings_ms: Dict[str, float] = field(default_factory=dict)
+    calibration_hit: bool = False  # Region located from the calibration cache
+    capture_mode: Optional[str] = None  # photo | scanner
+    # Decision input: (questions x options) bubble intensities + geometry metadata
+    intensities: Optional[np.ndarray] = None
+    geometry: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ProcessingContext:
+    """Per-call pipeline state shared between stages."""
+    deadline: Optional[Deadline] = None
+    degraded: bool = False
+    skipped_stages: List[str] = field(default_factory=list)
+    timer: StageTimer = field(default_factory=StageTimer)
+    # Column bounds and per-column row centers used by the grid sampler
+    grid_geometry: Optional[Tuple[List[float], List[List[float]]]] = None
+    # Source corners + crop_margins of the last perspective warp
+    warp: Optional[Tuple[np.ndarray, bool]] = None
+    calibration: Optional[Calibration] = None
+    calibration_hit: bool = False
+    template: Optional[str] = None
+    capture_mode: Optional[str] = None
+    layout: Optional[SheetLayout] = None
+    timing_grid: Optional[TimingGrid] = None  # Timing marks found by the locator
+    binary: Optional[np.ndarray] = None  # Thresholded region (contours sampler)
+    warnings: List[str] = field(default_factory=list)
+
+    def check(self, stage: str) -> None:
+        """Abort with DeadlineExceededError if the deadline passed before `stage`."""
+        if self.deadline is not None:
+            self.deadline.check(stage)
+
+    def should_skip(self, stage: str) -> bool:
+        """Whether an optional slow stage must be skipped (budget is tight)."""
+        if self.deadline is None or not self.deadline.is_tight():
+            return False
+        self.degraded = True
+        self.skipped_stages.append(stage)
+        logger.warning("Skipping stage to meet deadline", stage=stage,
+                       remaining_ms=round(self.deadline.remaining_ms()))
+        return True
 
 
 class OMRProcessor:
@@ -46,16 +165,60 @@ class OMRProcessor:
         image_data: bytes,
         total_questions: int,
         options_per_question: int,
-        # Optional manual calibration coordinates
+        # Optional calibration: {"corners": [[x, y] * 4]} and/or {"key": cache key}
         calibration: Optional[Dict] = None,
+        deadline: Optional[Deadline] = None,
+        engine: Optional[str] = None,
+        template: Optional[str] = None,
+        capture_mode: Optional[str] = None,
+        timer: Optional[StageTimer] = None,
     ) -> OMRResult:
-        """Process an OMR image and detect marked answers."""
+        """
+        Process an OMR image and detect marked answers.
+        
+        `engine` names a registered detection engine (see app.services.engines);
+        by default the sheet template's engine or settings.OMR_ENGINE is used.
+        `template` selects the sheet layout (SHEET_TEMPLATES, default OMR_TEMPLATE).
+        `calibration` may give manual answer-region corners ("corners") or a
+        calibration cache key ("key", see calibration_cache.calibration_key): sheets
+        sharing a key reuse the verified corners and grid of the previous sheet.
+        `capture_mode` "scanner" registers the page against a reference scan of the
+        template instead of searching for the answer rectangle; "auto" (default
+        OMR_CAPTURE_MODE) decides from the image metadata.
+        With a deadline, each stage checks the remaining budget: expired jobs raise
+        DeadlineExceededError and tight budgets skip slow stages (result flagged degraded).
+        `timer` lets the caller collect these stages next to its own (download,
+        validate, scoring, ...).
+        """
         warnings: List[str] = []
-        self.options_per_question = options_per_question
+        context = ProcessingContext(deadline=deadline, timer=timer or StageTimer())
+        timer = context.timer
+        context.template = sheet_template_name(template)
+        context.capture_mode = resolve_capture_mode(capture_mode, image_data)
+        
+        template_config = get_sheet_template(template)
+        detection_engine = resolve_engine(engine, template)
+        layout = SheetLayout(
+            total_questions=total_questions,
+            options_per_question=options_per_question,
+            num_columns=template_config.get("columns", self.num_columns),
+            rows_per_column=template_config.get("rows_per_column", self.rows_per_column),
+        )
+        context.layout = layout
+        if total_questions > layout.capacity:
+            # Questions past the printed grid are reported blank, never read elsewhere
+            logger.warning("More questions than the layout holds",
+                           total_questions=total_questions, capacity=layout.capacity)
+            context.warnings.append(
+                f"Questions {layout.capacity + 1}-{total_questions} are outside the "
+                f"'{context.template}' layout ({layout.capacity} questions)"
+            )
         
         # Decode image
-        np_array = np.frombuffer(image_data, np.uint8)
-        original = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+        context.check("decode")
+        with timer.stage("decode"):
+            np_array = np.frombuffer(image_data, np.uint8)
+            original = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
 
         if original is None:
             logger.error("Failed to decode image")
@@ -65,24 +228,48 @@ class OMRProcessor:
         logger.info(f"Image decoded: {width}x{height}")
 
         # Step 1: Find answer region
-        answer_region = self._find_answer_region_smart(original)
+        context.check("region_detection")
+        with timer.stage("locate"):
+            answer_region = self._locate_answer_region(
+                detection_engine, original, calibration, context
+            )
         
         h, w = answer_region.shape[:2]
         logger.info(f"Answer region: {w}x{h}")
         
-        # Step 2: Preprocess
-        gray = cv2.cvtColor(answer_region, cv2.COLOR_BGR2GRAY)
+        # Step 2: Grayscale (samplers that need a binary image threshold it themselves)
+        context.check("preprocess")
+        with timer.stage("preprocess"):
+            gray = cv2.cvtColor(answer_region, cv2.COLOR_BGR2GRAY)
         
-        # Enhance contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
+        # Step 3: Sample every bubble, then decide (engine fallback if the sampler gives up)
+        context.check("sampling")
+        with timer.stage("sample"):
+            intensities = detection_engine.sampler.sample(self, gray, layout, context)
         
-        # Threshold
-        _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        if intensities is None and detection_engine.fallback:
+            warnings.append(
+                f"Engine '{detection_engine.name}' could not sample the sheet, "
+                f"using '{detection_engine.fallback}'"
+            )
+            detection_engine = get_engine(detection_engine.fallback)
+            with timer.stage("sample"):
+                intensities = detection_engine.sampler.sample(self, gray, layout, context)
+        
+        if intensities is None:
+            raise ValueError(f"Engine '{detection_engine.name}' could not sample the sheet")
+        
+        with timer.stage("decide"):
+            answers = detection_engine.decider.decide(self, intensities)
         
-        # Step 3: Use grid-based detection (contour detection was not reliable)
-        # The grid method is calibrated specifically for GIB D'Nivel layout
-        answers = self._analyze_grid(binary, gray, total_questions, options_per_question)
+        if detection_engine.refiner is not None:
+            context.check("refine")
+            with timer.stage("refine"):
+                answers = detection_engine.refiner.refine(
+                    self, gray, layout, intensities, answers, context
+                )
+        
+        warnings[:0] = context.warnings
         
         # Calculate statistics
         detected_count = sum(1 for a in answers if a.status == AnswerStatus.DETECTED)
@@ -95,29 +282,175 @@ class OMRProcessor:
             elif a.status == AnswerStatus.MULTIPLE:
                 warnings.append(f"Question {a.question_number}: Multiple marks detected")
         
+        if context.degraded:
+            warnings.append(
+                f"Degraded processing (deadline): skipped {', '.join(context.skipped_stages)}"
+            )
+        
         self._log_results(answers, overall_confidence)
+        logger.info("Stage timings", engine=detection_engine.name, **timer.rounded(1))
         
         return OMRResult(
             answers=answers,
             confidence_score=round(overall_confidence, 4),
             warnings=warnings,
-            processed_image=binary,
+            processed_image=context.binary,
+            degraded=context.degraded,
+            engine=detection_engine.name,
+            stage_timings_ms=timer.rounded(),
+            calibration_hit=context.calibration_hit,
+            capture_mode=context.capture_mode,
+            intensities=intensities,
+            geometry=self._geometry_metadata(answer_region, context),
         )
 
-    def _find_answer_region_smart(self, image: np.ndarray) -> np.ndarray:
+    @staticmethod
+    def _geometry_metadata(region: np.ndarray, context: ProcessingContext) -> Dict[str, Any]:
+        """JSON-friendly description of where the intensities were sampled."""
+        metadata: Dict[str, Any] = {
+            "template": context.template,
+            "capture_mode": context.capture_mode,
+            "region_shape": list(region.shape[:2]),
+            "calibration_hit": context.calibration_hit,
+        }
+        if context.warp is not None:
+            metadata["corners"] = np.asarray(context.warp[0]).round(1).tolist()
+        if context.grid_geometry is not None:
+            col_bounds, row_centers = context.grid_geometry
+            metadata["col_bounds"] = [round(float(x), 1) for x in col_bounds]
+            metadata["row_centers"] = [[round(float(y), 1) for y in col] for col in row_centers]
+        if context.timing_grid is not None:
+            metadata["timing_rows"] = context.timing_grid.rows.centers.round(1).tolist()
+            metadata["timing_columns"] = context.timing_grid.columns.centers.round(1).tolist()
+        return metadata
+
+    def _locate_answer_region(
+        self,
+        detection_engine: DetectionEngine,
+        image: np.ndarray,
+        calibration: Optional[Dict],
+        context: ProcessingContext,
+    ) -> np.ndarray:
+        """
+        Answer region from, in order: manual corners, a verified calibration
+        cache entry, registration against the template's reference scan
+        (scanner mode), or the engine's region locator (whose corners are then
+        cached for the next sheet with the same key).
+        """
+        calibration = calibration or {}
+        
+        if calibration.get("corners") is not None:
+            corners = np.asarray(calibration["corners"], dtype=np.float32).reshape(4, 2)
+            logger.info("Using manual calibration corners")
+            return self._apply_perspective_transform(
+                image, corners, crop_margins=calibration.get("crop_margins", True), context=context
+            )
+        
+        key = calibration.get("key")
+        cache = get_calibration_cache() if key and settings.ENABLE_CALIBRATION_CACHE else None
+        
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                corners = cache.verify(cached, image)
+                if corners is not None:
+                    logger.info("Calibration cache hit", key=key, hits=cached.hits)
+                    context.calibration = cached
+                    context.calibration_hit = True
+                    return self._apply_perspective_transform(
+                        image, corners, crop_margins=cached.crop_margins, context=context
+                    )
+        
+        scanner_reference = None
+        if context.capture_mode == CAPTURE_MODE_SCANNER:
+            scanner_reference = self._scanner_reference(context.template)
+            if scanner_reference is not None:
+                corners = get_scanner_registrar().register(scanner_reference, image)
+                if corners is not None:
+                    logger.info("Scanned page registered to reference", template=context.template)
+                    region = self._apply_perspective_transform(
+                        image, corners, crop_margins=scanner_reference.crop_margins, context=context
+                    )
+                    if cache is not None:
+                        context.calibration = cache.store(key, image, corners, scanner_reference.crop_margins)
+                    return region
+        
+        region = detection_engine.locator.locate(self, image, context)
+        
+        if context.warp is not None:
+            corners, crop_margins = context.warp
+            if cache is not None:
+                context.calibration = cache.store(key, image, corners, crop_margins)
+            if context.capture_mode == CAPTURE_MODE_SCANNER and scanner_reference is None:
+                # First scan of the template becomes the reference
+                get_scanner_registrar().set_reference(context.template, image, corners, crop_margins)
+        
+        return region
+
+    def _scanner_reference(self, template: str) -> Optional[ScannerReference]:
+        """Reference scan of a template (loaded once from SCANNER_REFERENCE_DIR)."""
+        registrar = get_scanner_registrar()
+        reference = registrar.get_reference(template)
+        if reference is not None or not registrar.claim_load(template):
+            return reference
+        
+        path = reference_path(template)
+        if path is None:
+            return None
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning("Could not load scanner reference", path=path)
+            return None
+        context = ProcessingContext()
+        self._find_answer_region_smart(image, context)
+        if context.warp is None:
+            logger.warning("No answer region found in scanner reference", path=path)
+            return None
+        return registrar.set_reference(template, image, *context.warp)
+
+    def _find_answer_region_smart(
+        self, image: np.ndarray, context: Optional[ProcessingContext] = None
+    ) -> np.ndarray:
         """
         Detect the answer region using multiple strategies:
+        0a. ArUco/AprilTag fiducials, single pass (ENABLE_FIDUCIAL_ALIGNMENT)
+        0b. Corner marker template matching (ENABLE_MARKER_ALIGNMENT)
         1. Rectangle contour detection (works for GIB D'Nivel)
         2. Fallback to fixed coordinates
         
-        Note: Marker detection disabled for GIB D'Nivel as it doesn't have
+        Note: Marker detection disabled by default as GIB D'Nivel doesn't have
         corner markers. Enable only for sheets with specific corner markers.
+        
+        When the deadline is tight, slow fallbacks are skipped and the fixed
+        coordinate crop is used instead (context is flagged as degraded).
         """
+        context = context or ProcessingContext()
         height, width = image.shape[:2]
         
+        # Strategy 0a: Fiducial markers (own sheet templates)
+        if settings.ENABLE_FIDUCIAL_ALIGNMENT:
+            corners = FiducialMarkerDetector(
+                settings.FIDUCIAL_DICTIONARY, tuple(settings.FIDUCIAL_CORNER_IDS)
+            ).find_corners(image)
+            if corners is not None:
+                logger.info("Fiducial markers detected - using perspective correction")
+                return self._apply_perspective_transform(
+                    image, corners, crop_margins=False, context=context
+                )
+        
+        # Strategy 0b: Corner markers (multi-scale search, skipped on tight deadlines)
+        if settings.ENABLE_MARKER_ALIGNMENT and not context.should_skip("marker_search"):
+            marker = _load_marker_template(settings.MARKER_TEMPLATE_PATH)
+            corners = MarkerDetector().find_markers_in_quadrants(image, marker)
+            if corners is not None:
+                logger.info("Corner markers detected - using perspective correction")
+                return self._apply_perspective_transform(
+                    image, corners, crop_margins=False, context=context
+                )
+        
         # Strategy 1: Try to detect the main rectangle (black border)
         # This works well for GIB D'Nivel sheets
-        detected_region = self._detect_main_rectangle(image)
+        detected_region = self._detect_main_rectangle(image, context)
         
         if detected_region is not None:
             logger.info("Rectangle detected - using perspective correction")
@@ -140,6 +473,35 @@ class OMRProcessor:
         
         return cropped
     
+    def _find_answer_region_timing_marks(
+        self, image: np.ndarray, context: ProcessingContext
+    ) -> np.ndarray:
+        """
+        Read the template's timing marks on the whole page (no warp): the page
+        itself is the region and the marks give every bubble position. Without
+        marks, the smart locator is used and the sampler falls back.
+        """
+        layout = context.layout
+        detector = TimingMarkDetector.for_template(get_sheet_template(context.template))
+        grid = detector.detect(
+            image, layout.rows_per_column, layout.num_columns * layout.options_per_question,
+            column_group=layout.options_per_question,
+        )
+        if grid is None:
+            context.warnings.append(
+                f"{ErrorCode.TIMING_MARKS_NOT_FOUND.value}: timing marks not found, "
+                "using the answer rectangle"
+            )
+            return self._find_answer_region_smart(image, context)
+        
+        logger.info(
+            "Timing marks detected",
+            row_pitch=round(grid.rows.pitch, 1), column_pitch=round(grid.columns.pitch, 1),
+            skew=round(float(np.degrees(np.arctan(grid.columns.slope))), 2),
+        )
+        context.timing_grid = grid
+        return image
+    
     def _crop_header_footer(self, image: np.ndarray, top_percent: float = 0.02, bottom_percent: float = 0.01) -> np.ndarray:
         """Crop header and footer from warped image."""
         h, w = image.shape[:2]
@@ -147,7 +509,9 @@ class OMRProcessor:
         y_end = int(h * (1 - bottom_percent))
         return image[y_start:y_end, :]
 
-    def _detect_main_rectangle(self, image: np.ndarray) -> Optional[np.ndarray]:
+    def _detect_main_rectangle(
+        self, image: np.ndarray, context: Optional[ProcessingContext] = None
+    ) -> Optional[np.ndarray]:
         """
         Detect the main black rectangle that contains the answer bubbles.
         Apply perspective transform to "flatten" the image.
@@ -192,13 +556,17 @@ class OMRProcessor:
                 best_area = area
         
         if best_contour is None:
-            # Try edge detection as alternative
-            return self._detect_rectangle_by_edges(image)
+            # Try edge detection as alternative (too slow when the deadline is tight)
+            if context is not None and context.should_skip("edge_detection"):
+                return None
+            return self._detect_rectangle_by_edges(image, context)
         
         # Apply perspective transform
-        return self._apply_perspective_transform(image, best_contour)
+        return self._apply_perspective_transform(image, best_contour, context=context)
 
-    def _detect_rectangle_by_edges(self, image: np.ndarray) -> Optional[np.ndarray]:
+    def _detect_rectangle_by_edges(
+        self, image: np.ndarray, context: Optional[ProcessingContext] = None
+    ) -> Optional[np.ndarray]:
         """
         Alternative method: detect rectangle using Canny edges and Hough lines.
         """
@@ -223,17 +591,28 @@ class OMRProcessor:
             if len(approx) == 4:
                 area = cv2.contourArea(approx)
                 if area > (width * height) * 0.1:
-                    return self._apply_perspective_transform(image, approx)
+                    return self._apply_perspective_transform(image, approx, context=context)
         
         return None
 
-    def _apply_perspective_transform(self, image: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    def _apply_perspective_transform(
+        self,
+        image: np.ndarray,
+        corners: np.ndarray,
+        crop_margins: bool = True,
+        context: Optional[ProcessingContext] = None,
+    ) -> np.ndarray:
         """
         Apply perspective transform to flatten the detected rectangle.
+        `crop_margins` removes the header/footer strip calibrated for the
+        GIB D'Nivel border rectangle (not wanted for marker-based corners).
+        The ordered corners are recorded on `context` (calibration cache).
         """
         # Order points: top-left, top-right, bottom-right, bottom-left
         corners = corners.reshape(4, 2)
         ordered = self._order_points(corners)
+        if context is not None:
+            context.warp = (ordered, crop_margins)
         
         (tl, tr, br, bl) = ordered
         
@@ -260,8 +639,13 @@ class OMRProcessor:
         # Calculate perspective transform matrix
         matrix = cv2.getPerspectiveTransform(src, dst)
         
-        # Apply perspective transform
-        warped = cv2.warpPerspective(image, matrix, (max_width, max_height))
+        # Apply perspective transform (own stage, excluded from "locate")
+        with context.timer.stage("warp") if context is not None else nullcontext():
+            warped = cv2.warpPerspective(image, matrix, (max_width, max_height))
+        
+        if not crop_margins:
+            logger.info(f"Perspective corrected: {warped.shape[1]}x{warped.shape[0]}")
+            return warped
         
         # CALIBRATION v14: Crop top (header) and bottom (extra space)
         # The detected rectangle includes a small header area with row numbers
@@ -294,235 +678,441 @@ class OMRProcessor:
         
         return rect
 
-    def _detect_bubbles_by_contours(
+    @staticmethod
+    def _binarize(gray: np.ndarray, tile_grid: Tuple[int, int] = (8, 8)) -> np.ndarray:
+        """CLAHE + inverted Otsu threshold of a grayscale image."""
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=tile_grid)
+        enhanced = clahe.apply(gray)
+        _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return binary
+
+    def _sample_bubble_components(
         self, 
-        binary: np.ndarray, 
         gray: np.ndarray,
-        total_questions: int,
-        options_per_question: int
-    ) -> List[DetectedAnswer]:
+        layout: SheetLayout,
+        context: Optional[ProcessingContext] = None,
+    ) -> Optional[np.ndarray]:
         """
-        Detect bubbles using contour detection and circle fitting.
+        Sample bubbles found as connected components of the thresholded region.
+        
+        With OMR_PARALLEL_COLUMNS, thresholding and the component pass run per
+        layout column in the column executor (OpenCV releases the GIL); CLAHE
+        tiles keep their size and Otsu picks one threshold per column. A
+        bubble's option comes from its X position against the option columns
+        fitted to the found bubbles; components outside the option area
+        (question numbers, row lines) are dropped. Returns None if too few
+        bubbles are found.
         """
-        h, w = binary.shape[:2]
+        h, w = gray.shape[:2]
+        total_questions = layout.total_questions
+        options_per_question = layout.options_per_question
+        
+        # Bubble size from the whole region, so every column filters alike
+        bubble_radius = min(w, h) / 60  # Rough estimate
+        binary = np.empty((h, w), dtype=np.uint8)
+        if settings.OMR_PARALLEL_COLUMNS and layout.num_columns > 1:
+            bounds = np.linspace(0, w, layout.num_columns + 1).astype(int)
+            tile_grid = (max(1, round(8 / layout.num_columns)), 8)
+            
+            def work(x0: int, x1: int) -> Tuple[np.ndarray, int]:
+                return self._bubble_candidates(
+                    gray[:, x0:x1], binary[:, x0:x1], bubble_radius, tile_grid, x_offset=x0
+                )
+            
+            # list() re-raises any worker exception here
+            parts = list(get_column_executor().map(work, bounds[:-1], bounds[1:]))
+        else:
+            parts = [self._bubble_candidates(gray, binary, bubble_radius)]
+        if context is not None:
+            context.binary = binary
         
-        # Find all contours
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        found = np.concatenate([candidates for candidates, _ in parts])
+        logger.info(f"Found {len(found)} potential bubbles",
+                    components=sum(count for _, count in parts))
+        
+        if len(found) < total_questions:
+            # Not enough bubbles found, let the engine fall back
+            return None
         
-        # Filter contours that look like bubbles (roughly circular, right size)
-        bubbles = []
-        estimated_bubble_radius = min(w, h) / 60  # Rough estimate
+        xs_arr, ys_arr, means, papers = found.T
+        # Relative to the paper around each bubble: an empty bubble under a
+        # shadow must not read as filled by the absolute fill ratio
+        means_arr = np.minimum(255.0 * means / np.maximum(papers, 1.0), 255.0).astype(np.float32)
         
-        for contour in contours:
+        # Assign bubbles to questions (vectorized)
+        num_cols = layout.num_columns
+        rows_per_col = layout.rows_per_column
+        col_width = w / num_cols
+        col = np.minimum((xs_arr / col_width).astype(int), num_cols - 1)
+        row = np.minimum((ys_arr / (h / rows_per_col)).astype(int), rows_per_col - 1)
+        q_nums = col * rows_per_col + row + 1
+        
+        # Options: X within the layout column against the option columns of the
+        # bubble area (same CALIBRATION v19 span as the grid sampler)
+        bubble_area_start = 0.22
+        bubble_area_end = 0.98
+        pitch = (bubble_area_end - bubble_area_start) / options_per_question
+        rel_x = xs_arr / col_width - col
+        nominal = bubble_area_start + (np.arange(options_per_question) + 0.5) * pitch
+        option = np.floor((rel_x - bubble_area_start) / pitch).astype(int)
+        inside = (option >= 0) & (option < options_per_question)
+        
+        # Fit each option column to the median X of its bubbles (>= 3 found)
+        centers = np.tile(nominal, (num_cols, 1))
+        for c in range(num_cols):
+            for o in range(options_per_question):
+                members = rel_x[inside & (col == c) & (option == o)]
+                if len(members) >= 3:
+                    centers[c, o] = np.median(members)
+        
+        # Nearest fitted column; farther than 0.4 pitch is not a bubble of this row
+        offsets = rel_x[:, None] - centers[col]
+        option = np.argmin(np.abs(offsets), axis=1)
+        near = np.abs(offsets[np.arange(len(option)), option]) <= pitch * 0.4
+        
+        keep = near & (q_nums >= 1) & (q_nums <= total_questions)
+        q_nums, option, means_arr = q_nums[keep], option[keep], means_arr[keep]
+        
+        # Several components on one bubble (broken outline): keep the darkest
+        intensities = np.full((total_questions, options_per_question), np.nan, dtype=np.float32)
+        np.fmin.at(intensities, (q_nums - 1, option), means_arr)
+        return intensities
+
+    def _bubble_candidates(
+        self,
+        gray: np.ndarray,
+        binary: np.ndarray,
+        bubble_radius: float,
+        tile_grid: Tuple[int, int] = (8, 8),
+        x_offset: int = 0,
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Threshold `gray` into `binary` and measure its bubble-like components.
+        
+        Size/aspect filters run on the component stats arrays. Circularity and
+        mean intensity are measured on each candidate's filled outline drawn into
+        a mask the size of its bounding box (no full-image masks), next to the
+        paper level around it. Returns (x, y, mean, paper) rows, X shifted by
+        `x_offset`, and the number of components.
+        """
+        thresholded = self._binarize(gray, tile_grid)
+        binary[:] = thresholded
+        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            thresholded, connectivity=8
+        )
+        
+        # Filter components that could be bubbles (right size, roughly square bbox)
+        min_radius = bubble_radius * 0.3
+        max_radius = bubble_radius * 2
+        
+        bw = stats[1:, cv2.CC_STAT_WIDTH]
+        bh = stats[1:, cv2.CC_STAT_HEIGHT]
+        half_extent = np.maximum(bw, bh) / 2
+        aspect = bw / np.maximum(bh, 1)
+        candidates = np.flatnonzero(
+            (half_extent > min_radius * 0.8)
+            & (half_extent < max_radius * 1.3)
+            & (aspect > 0.5)
+            & (aspect < 2.0)
+        ) + 1  # Labels (0 is background)
+        
+        found = []
+        for label in candidates:
+            x, y, bw_i, bh_i = stats[label, :4]
+            component = (labels[y:y + bh_i, x:x + bw_i] == label).astype(np.uint8)
+            contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            if not contours:
+                continue
+            contour = contours[0]
+            
             area = cv2.contourArea(contour)
             perimeter = cv2.arcLength(contour, True)
-            
             if perimeter == 0:
                 continue
             
             # Circularity check
             circularity = 4 * np.pi * area / (perimeter * perimeter)
             
-            # Size check (bubbles should be roughly 10-40 pixels in diameter)
+            # Size check
             radius = np.sqrt(area / np.pi) if area > 0 else 0
             
-            if 0.5 < circularity < 1.5 and estimated_bubble_radius * 0.3 < radius < estimated_bubble_radius * 2:
-                # Get centroid
-                M = cv2.moments(contour)
-                if M["m00"] > 0:
-                    cx = int(M["m10"] / M["m00"])
-                    cy = int(M["m01"] / M["m00"])
-                    
-                    # Calculate fill ratio using the gray image
-                    mask = np.zeros_like(gray)
-                    cv2.drawContours(mask, [contour], -1, 255, -1)
-                    mean_val = cv2.mean(gray, mask=mask)[0]
-                    fill_ratio = 1.0 - (mean_val / 255.0)  # Darker = more filled
-                    
-                    bubbles.append({
-                        'x': cx,
-                        'y': cy,
-                        'radius': radius,
-                        'fill': fill_ratio,
-                        'area': area
-                    })
-        
-        logger.info(f"Found {len(bubbles)} potential bubbles")
-        
-        if len(bubbles) < total_questions:
-            # Not enough bubbles found, return empty to trigger fallback
-            return []
-        
-        # Group bubbles by rows (Y coordinate)
-        bubbles.sort(key=lambda b: b['y'])
-        
-        num_cols = 3
-        rows_per_col = 30
-        col_width = w / num_cols
-        row_height = h / rows_per_col
-        
-        # Assign bubbles to questions
-        question_bubbles: Dict[int, List[dict]] = {i: [] for i in range(1, total_questions + 1)}
+            if 0.5 < circularity < 1.5 and min_radius < radius < max_radius:
+                # Mean intensity on the filled outline (bbox-local mask)
+                cv2.drawContours(component, [contour], -1, 1, -1)
+                found.append((
+                    centroids[label][0] + x_offset,
+                    centroids[label][1],
+                    cv2.mean(gray[y:y + bh_i, x:x + bw_i], mask=component)[0],
+                    self._paper_level(gray, x, y, bw_i, bh_i),
+                ))
         
-        for bubble in bubbles:
-            # Determine column
-            col = int(bubble['x'] / col_width)
-            col = min(col, num_cols - 1)
-            
-            # Determine row
-            row = int(bubble['y'] / row_height)
-            row = min(row, rows_per_col - 1)
-            
-            # Calculate question number
-            q_num = col * rows_per_col + row + 1
-            
-            if 1 <= q_num <= total_questions:
-                question_bubbles[q_num].append(bubble)
+        return np.asarray(found, dtype=np.float64).reshape(-1, 4), num_labels - 1
+
+    @staticmethod
+    def _paper_level(gray: np.ndarray, x: int, y: int, bw: int, bh: int) -> float:
+        """Median gray of a ring half a bubble wide around a bounding box."""
+        h, w = gray.shape[:2]
+        pad = max(bw, bh) // 2 + 1
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        window = gray[y0:min(y + bh + pad, h), x0:min(x + bw + pad, w)]
+        ring = np.ones(window.shape, dtype=bool)
+        ring[y - y0:y - y0 + bh, x - x0:x - x0 + bw] = False
+        return float(np.median(window[ring])) if ring.any() else 255.0
+
+    def _sample_grid(
+        self, 
+        gray: np.ndarray,
+        layout: SheetLayout,
+        grid_mode: str = GRID_MODE_UNIFORM,
+        context: Optional[ProcessingContext] = None,
+    ) -> np.ndarray:
+        """
+        Mean intensity of every bubble cell of the layout grid.
+        Cells use a LARGE row tolerance (96% of the local row pitch) to capture
+        bubbles even on curved paper.
         
-        # For each question, determine the answer
-        answers = []
+        grid_mode "uniform" splits the region evenly; "adaptive" locates column
+        separators and per-column row positions (curved paper).
+        """
+        h, w = gray.shape[:2]
+        options_per_question = layout.options_per_question
+        rows_per_col = layout.rows_per_column
+        
+        # Row positions cached with the calibration (same batch/device) skip detection
+        calibration = context.calibration if context is not None else None
+        geometry = None
+        if calibration is not None and grid_mode != GRID_MODE_UNIFORM:
+            geometry = calibration.geometry_for(grid_mode, gray.shape[:2])
+        if geometry is None:
+            geometry = self._grid_geometry(gray, layout, grid_mode)
+            if calibration is not None:
+                calibration.grid_geometry[grid_mode] = (gray.shape[:2], geometry)
+        col_bounds, row_centers = geometry
+        if context is not None:
+            context.grid_geometry = geometry
         
-        for q_num in range(1, total_questions + 1):
-            bubbles_for_q = question_bubbles[q_num]
-            
-            if len(bubbles_for_q) == 0:
-                answers.append(DetectedAnswer(
-                    question_number=q_num,
-                    selected_option=None,
-                    selected_option_label=None,
-                    confidence_score=0,
-                    status=AnswerStatus.BLANK,
-                ))
-                continue
-            
-            # Sort by X coordinate (left to right = A, B, C, D, E)
-            bubbles_for_q.sort(key=lambda b: b['x'])
-            
-            # Find the most filled bubble
-            best_idx = 0
-            best_fill = 0
-            second_fill = 0
-            
-            for i, bubble in enumerate(bubbles_for_q):
-                if bubble['fill'] > best_fill:
-                    second_fill = best_fill
-                    best_fill = bubble['fill']
-                    best_idx = i
-                elif bubble['fill'] > second_fill:
-                    second_fill = bubble['fill']
-            
-            # Determine option index
-            # If we have exactly 5 bubbles, indices 0-4 map to A-E
-            option_idx = min(best_idx, options_per_question - 1)
-            
-            # Decision thresholds
-            if best_fill < 0.3:
-                status = AnswerStatus.BLANK
-                option_idx = None
-                label = None
-            elif best_fill - second_fill < 0.1 and second_fill > 0.25:
-                status = AnswerStatus.MULTIPLE
-                label = ANSWER_LABELS[option_idx]
-            else:
-                status = AnswerStatus.DETECTED
-                label = ANSWER_LABELS[option_idx]
-            
-            answers.append(DetectedAnswer(
-                question_number=q_num,
-                selected_option=option_idx,
-                selected_option_label=label,
-                confidence_score=best_fill if status == AnswerStatus.DETECTED else best_fill - second_fill,
-                status=status,
-            ))
+        # CALIBRATION v19 - Relative contrast approach (no absolute threshold)
+        bubble_area_start = 0.22
+        bubble_area_end = 0.98
         
-        return answers
+        # Cell boxes for every (question, option) inside the grid, built as arrays
+        q_idx = np.arange(min(layout.total_questions, layout.capacity))
+        col_idx = q_idx // rows_per_col
+        row_idx = q_idx % rows_per_col
+        
+        # Row boundaries with LARGE tolerance for curvature
+        cells = list(zip(col_idx, row_idx, strict=True))
+        y_center = np.array([row_centers[c][r] for c, r in cells])
+        row_height = np.array([self._local_row_height(row_centers[c], r, h) for c, r in cells])
+        y_start = np.clip((y_center - row_height * 0.48).astype(int), 0, h - 1)
+        y_end = np.maximum(y_start + 1, np.minimum((y_center + row_height * 0.48).astype(int), h))
+        
+        # Column boundaries
+        bounds = np.asarray(col_bounds, dtype=np.float64)
+        x_col_start = bounds[col_idx].astype(int)
+        col_width = bounds[col_idx + 1] - bounds[col_idx]
+        bubble_start = x_col_start + (col_width * bubble_area_start).astype(int)
+        bubble_end = x_col_start + (col_width * bubble_area_end).astype(int)
+        bubble_width = ((bubble_end - bubble_start) / options_per_question)[:, None]
+        
+        opt_idx = np.arange(options_per_question)[None, :]
+        x_start = (bubble_start[:, None] + opt_idx * bubble_width + bubble_width * 0.08).astype(int)
+        x_end = (bubble_start[:, None] + (opt_idx + 1) * bubble_width - bubble_width * 0.08).astype(int)
+        
+        # Clamp to image bounds
+        x_start = np.clip(x_start, 0, w - 1)
+        x_end = np.maximum(x_start + 1, np.minimum(x_end, w))
+        
+        boxes = np.stack([
+            x_start,
+            np.broadcast_to(y_start[:, None], x_start.shape),
+            x_end - x_start,
+            np.broadcast_to((y_end - y_start)[:, None], x_start.shape),
+        ], axis=-1)
+        
+        # Mean intensity from one integral image (lower = darker = more likely marked);
+        # questions past the layout capacity stay white (blank)
+        means = ImageUtils.box_means(gray, boxes.reshape(-1, 4)).reshape(x_start.shape)
+        intensities = np.full((layout.total_questions, options_per_question), 255, dtype=np.float32)
+        intensities[q_idx] = np.where(np.isnan(means), 255, means)
+        
+        logger.info("Grid sampled", grid_mode=grid_mode, questions=layout.total_questions)
+        return intensities
 
-    def _analyze_grid(
-        self, 
-        binary: np.ndarray, 
+    def _sample_timing_grid(
+        self,
         gray: np.ndarray,
-        total_questions: int, 
-        options_per_question: int
-    ) -> List[DetectedAnswer]:
+        layout: SheetLayout,
+        context: ProcessingContext,
+    ) -> Optional[np.ndarray]:
         """
-        Grid-based analysis with RELATIVE CONTRAST detection.
-        Uses the darkest bubble in each row as the answer, with confidence based on contrast.
-        This is more robust for curved paper and varying lighting.
+        Mean intensity of every bubble at the timing-mark positions: row mark
+        of the question x column mark of the option, skew corrected. The box
+        spans 80% of the mark pitch in each direction. None without marks.
         """
-        answers = []
-        h, w = binary.shape[:2]
+        grid = context.timing_grid
+        if grid is None:
+            return None
         
-        num_cols = 3
-        rows_per_col = 30
+        options_per_question = layout.options_per_question
+        q_idx = np.arange(min(layout.total_questions, layout.capacity))
+        col_idx = q_idx // layout.rows_per_column
+        row_idx = (q_idx % layout.rows_per_column)[:, None]
+        mark_idx = col_idx[:, None] * options_per_question + np.arange(options_per_question)[None, :]
+        
+        x, y = grid.bubble_centers(row_idx, mark_idx)
+        half_w = 0.4 * grid.columns.pitch
+        half_h = 0.4 * grid.rows.pitch
+        x_start = np.round(x - half_w).astype(int)
+        y_start = np.round(y - half_h).astype(int)
+        boxes = np.stack([
+            x_start,
+            y_start,
+            np.full(x_start.shape, max(1, int(round(2 * half_w)))),
+            np.full(x_start.shape, max(1, int(round(2 * half_h)))),
+        ], axis=-1)
+        
+        means = ImageUtils.box_means(gray, boxes.reshape(-1, 4)).reshape(x_start.shape)
+        intensities = np.full((layout.total_questions, options_per_question), 255, dtype=np.float32)
+        intensities[q_idx] = np.where(np.isnan(means), 255, means)
+        
+        logger.info("Timing grid sampled", questions=layout.total_questions)
+        return intensities
+
+    def _resample_questions(
+        self,
+        gray: np.ndarray,
+        layout: SheetLayout,
+        question_indices: List[int],
+        context: Optional[ProcessingContext] = None,
+    ) -> np.ndarray:
+        """
+        Careful re-sample of selected questions (cascade second pass).
         
-        col_width = w / num_cols
-        row_height = h / rows_per_col
+        The row center is re-aligned locally: the darkest band over the bubble
+        span (where the bubbles actually are) wins, as long as the band stays
+        inside the row's own pitch (it cannot reach a neighbouring row). Each option is then measured with a circular mask,
+        so printed row lines and bubble corners do not dilute the mark.
+        Returns a (len(question_indices) x options) intensity matrix.
+        """
+        h, w = gray.shape[:2]
+        options_per_question = layout.options_per_question
+        rows_per_col = layout.rows_per_column
+        num_cols = layout.num_columns
+        
+        if context is not None and context.grid_geometry is not None:
+            col_bounds, row_centers = context.grid_geometry
+        else:
+            col_bounds, row_centers = self._grid_geometry(gray, layout, GRID_MODE_UNIFORM)
         
-        # CALIBRATION v19 - Relative contrast approach (no absolute threshold)
         bubble_area_start = 0.22
         bubble_area_end = 0.98
         
-        # Process each question
-        for q_num in range(1, total_questions + 1):
-            col_idx = (q_num - 1) // rows_per_col
-            row_idx = (q_num - 1) % rows_per_col
-            
-            # Calculate row boundaries with LARGE tolerance for curvature
-            # Use 95% of row height to capture bubbles even with curvature
-            y_center = (row_idx + 0.5) * row_height
-            y_start = max(0, int(y_center - row_height * 0.48))
-            y_end = min(h, int(y_center + row_height * 0.48))
+        intensities = np.full((len(question_indices), options_per_question), 255, dtype=np.float32)
+        masks: Dict[int, np.ndarray] = {}
+        
+        for out_idx, q_idx in enumerate(question_indices):
+            col_idx = q_idx // rows_per_col
+            if col_idx >= num_cols:
+                continue  # Outside the layout: stays blank
+            row_idx = q_idx % rows_per_col
+            y_center = row_centers[col_idx][row_idx]
+            pitch = self._local_row_height(row_centers[col_idx], row_idx, h)
             
-            # Column boundaries
-            x_col_start = int(col_idx * col_width)
-            bubble_start = x_col_start + int(col_width * bubble_area_start)
-            bubble_end = x_col_start + int(col_width * bubble_area_end)
+            x_col_start = int(col_bounds[col_idx])
+            col_width = col_bounds[col_idx + 1] - col_bounds[col_idx]
+            bubble_start = max(0, x_col_start + int(col_width * bubble_area_start))
+            bubble_end = min(w, x_col_start + int(col_width * bubble_area_end))
             bubble_width = (bubble_end - bubble_start) / options_per_question
+            if bubble_end <= bubble_start or pitch <= 2:
+                continue
             
-            # Collect intensity for each option
-            option_intensities = []
+            # Local row alignment: darkest bubble-height band near the grid row
+            band_top = max(0, int(y_center - pitch))
+            band_bottom = min(h, int(y_center + pitch) + 1)
+            profile = cv2.reduce(
+                gray[band_top:band_bottom, bubble_start:bubble_end], 1, cv2.REDUCE_AVG,
+                dtype=cv2.CV_32F,
+            ).ravel()
+            window = max(1, min(len(profile), int(pitch * 0.6)))
+            sums = np.convolve(profile, np.ones(window, dtype=np.float32), mode="valid")
+            centers = band_top + np.arange(len(sums)) + window / 2
+            allowed = np.abs(centers - y_center) + window / 2 <= pitch * 0.5
+            if allowed.any():
+                y_center = float(centers[np.flatnonzero(allowed)[np.argmin(sums[allowed])]])
             
-            for opt_idx in range(options_per_question):
-                x_start = int(bubble_start + opt_idx * bubble_width + bubble_width * 0.08)
-                x_end = int(bubble_start + (opt_idx + 1) * bubble_width - bubble_width * 0.08)
-                
-                # Clamp to image bounds
-                x_start = max(0, min(x_start, w - 1))
-                x_end = max(x_start + 1, min(x_end, w))
-                y_start_b = max(0, min(y_start, h - 1))
-                y_end_b = max(y_start_b + 1, min(y_end, h))
-                
-                # Get mean intensity (lower = darker = more likely marked)
-                region = gray[y_start_b:y_end_b, x_start:x_end]
-                
-                if region.size > 0:
-                    mean_intensity = np.mean(region)
-                else:
-                    mean_intensity = 255  # White = unmarked
-                
-                option_intensities.append(mean_intensity)
+            # Circular masks centered on each bubble
+            radius = max(1, int(min(bubble_width, pitch) * 0.38))
+            mask = masks.get(radius)
+            if mask is None:
+                mask = np.zeros((2 * radius + 1, 2 * radius + 1), np.uint8)
+                cv2.circle(mask, (radius, radius), radius, 1, -1)
+                masks[radius] = mask
             
-            # Determine answer using RELATIVE CONTRAST
-            answer = self._determine_answer_by_contrast(q_num, option_intensities)
-            answers.append(answer)
+            cy = int(round(y_center))
+            for opt_idx in range(options_per_question):
+                cx = int(bubble_start + (opt_idx + 0.5) * bubble_width)
+                y0, y1 = cy - radius, cy + radius + 1
+                x0, x1 = cx - radius, cx + radius + 1
+                if y0 < 0 or x0 < 0 or y1 > h or x1 > w:
+                    patch = gray[max(0, y0):min(h, y1), max(0, x0):min(w, x1)]
+                    if patch.size:
+                        intensities[out_idx, opt_idx] = float(np.mean(patch))
+                    continue
+                intensities[out_idx, opt_idx] = cv2.mean(gray[y0:y1, x0:x1], mask=mask)[0]
+        
+        return intensities
+
+    def _grid_geometry(
+        self, gray: np.ndarray, layout: SheetLayout, grid_mode: str
+    ) -> Tuple[List[float], List[List[float]]]:
+        """
+        Column boundaries (num_columns + 1 X positions) and row centers per column.
+        """
+        h, w = gray.shape[:2]
+        num_cols = layout.num_columns
+        rows_per_col = layout.rows_per_column
         
-        # Log summary stats
-        detected = sum(1 for a in answers if a.status == AnswerStatus.DETECTED)
-        logger.info(f"Grid analysis complete: {detected}/{len(answers)} detected")
+        if grid_mode == GRID_MODE_ADAPTIVE:
+            col_bounds, row_centers = HorizontalLineDetector.get_adaptive_grid(
+                gray, num_cols, rows_per_col
+            )
+            return [float(x) for x in col_bounds], [[float(y) for y in col] for col in row_centers]
+        
+        if grid_mode != GRID_MODE_UNIFORM:
+            raise ValueError(f"Unknown grid mode: {grid_mode}")
         
-        return answers
+        col_width = w / num_cols
+        row_height = h / rows_per_col
+        col_bounds = [i * col_width for i in range(num_cols + 1)]
+        uniform_rows = [(i + 0.5) * row_height for i in range(rows_per_col)]
+        return col_bounds, [uniform_rows] * num_cols
+
+    @staticmethod
+    def _local_row_height(centers: List[float], row_idx: int, height: int) -> float:
+        """Row pitch around a row (from neighbouring centers; uniform if single row)."""
+        if len(centers) < 2:
+            return height / max(1, len(centers))
+        if row_idx == 0:
+            return centers[1] - centers[0]
+        if row_idx == len(centers) - 1:
+            return centers[-1] - centers[-2]
+        return (centers[row_idx + 1] - centers[row_idx - 1]) / 2
 
     def _determine_answer_by_contrast(
         self, 
         question_num: int, 
-        intensities: List[float]
+        intensities: List[float],
+        min_row_range: Optional[float] = None,
+        min_contrast: Optional[float] = None,
     ) -> DetectedAnswer:
         """
         Determine answer using RELATIVE CONTRAST within the row.
         The darkest bubble is selected if it's significantly darker than others.
         This works regardless of absolute lighting conditions.
         
-        Thresholds optimized for phone camera photos with varying lighting.
+        Thresholds optimized for phone camera photos with varying lighting
+        (default CONTRAST_MIN_ROW_RANGE / CONTRAST_MIN_CONTRAST).
         """
         if not intensities:
             return DetectedAnswer(
@@ -543,12 +1133,14 @@ class OMRProcessor:
         row_range = lightest_val - darkest_val  # Range of intensities in this row
         contrast_to_second = second_darkest_val - darkest_val  # How much darker than second
         
-        # Decision thresholds - RELAXED for phone camera photos
-        MIN_ROW_RANGE = 15  # Minimum range to consider that there's a marked bubble (was 20)
-        MIN_CONTRAST = 5   # Minimum contrast to second darkest (was 10)
+        # Decision thresholds - RELAXED for phone camera photos (settings, was 20/10)
+        if min_row_range is None:
+            min_row_range = settings.CONTRAST_MIN_ROW_RANGE
+        if min_contrast is None:
+            min_contrast = settings.CONTRAST_MIN_CONTRAST
         
         # Check if there's enough contrast to detect a mark
-        if row_range < MIN_ROW_RANGE:
+        if row_range < min_row_range:
             # All bubbles look similar - probably blank
             return DetectedAnswer(
                 question_number=question_num,
@@ -560,7 +1152,7 @@ class OMRProcessor:
         
         # Check if darkest is significantly darker than second
         # Only mark as MULTIPLE if contrast is very low
-        if contrast_to_second < MIN_CONTRAST and len(sorted_opts) > 1:
+        if contrast_to_second < min_contrast and len(sorted_opts) > 1:
             # Multiple marks or ambiguous - but still pick the darkest
             return DetectedAnswer(
                 question_number=question_num,
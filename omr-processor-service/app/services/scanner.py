@@ -0,0 +1,215 @@
+"""
+Flatbed/ADF scanner fast path.
+
+Scanned pages differ from the sheet template only by a small translation and
+rotation, so instead of searching for the answer rectangle (contours,
+approxPolyDP) each page is registered against a reference scan of the same
+template: ECC (seeded by phase correlation) on a downsampled pyramid gives a
+euclidean transform (shift + rotation), and the reference answer-region
+corners are mapped through it. The region is then warped once, like any other
+detected quadrilateral.
+"""
+
+import io
+import os
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+import structlog
+from PIL import Image
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+CAPTURE_MODE_AUTO = "auto"
+CAPTURE_MODE_PHOTO = "photo"
+CAPTURE_MODE_SCANNER = "scanner"
+CAPTURE_MODES = (CAPTURE_MODE_AUTO, CAPTURE_MODE_PHOTO, CAPTURE_MODE_SCANNER)
+
+# EXIF tags written by cameras (phones) but not by scanner drivers
+_EXIF_IFD = 0x8769
+_CAMERA_EXIF_TAGS = (0x829A, 0x920A, 0x8827)  # ExposureTime, FocalLength, ISOSpeedRatings
+_MIN_SCANNER_DPI = 150
+
+# ECC pyramid: downsampled copy + pyrDown halvings; the coarsest picks the initial alignment
+_PYRAMID_LEVELS = 2
+
+REFERENCE_EXTENSIONS = (".png", ".tif", ".tiff", ".jpg", ".jpeg")
+
+
+def detect_capture_mode(image_data: bytes) -> str:
+    """
+    Guess photo vs scanner from image metadata (header only, no decode).
+    Camera EXIF (exposure, focal length, ISO) means photo; TIFF or a
+    resolution of 150 DPI or more otherwise means scanner.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            exif_ifd = img.getexif().get_ifd(_EXIF_IFD)
+            if any(tag in exif_ifd for tag in _CAMERA_EXIF_TAGS):
+                return CAPTURE_MODE_PHOTO
+            if img.format == "TIFF":
+                return CAPTURE_MODE_SCANNER
+            dpi = img.info.get("dpi")
+            if dpi and min(float(d) for d in dpi) >= _MIN_SCANNER_DPI:
+                return CAPTURE_MODE_SCANNER
+    except Exception:
+        pass
+    return CAPTURE_MODE_PHOTO
+
+
+def reference_path(template: str) -> Optional[str]:
+    """Reference scan for a template in SCANNER_REFERENCE_DIR (<template>.png, ...)."""
+    if not settings.SCANNER_REFERENCE_DIR:
+        return None
+    for ext in REFERENCE_EXTENSIONS:
+        path = os.path.join(settings.SCANNER_REFERENCE_DIR, template + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+@dataclass(frozen=True)
+class ScannerReference:
+    """Downsampled reference scan and its answer-region corners."""
+    pyramid: Tuple[np.ndarray, ...]  # Float32 grayscale, downsampled, then pyrDown levels
+    image_shape: Tuple[int, int]  # Full-resolution (height, width)
+    corners: np.ndarray  # (4, 2) float32 TL, TR, BR, BL, full-resolution pixels
+    crop_margins: bool
+
+
+class ScannerRegistrar:
+    """Per-template references and page registration against them."""
+
+    def __init__(self, downsample: float, min_correlation: float, iterations: int):
+        self.downsample = downsample
+        self.min_correlation = min_correlation
+        self.iterations = iterations
+        self._references: Dict[str, ScannerReference] = {}
+        self._load_attempted: Set[str] = set()
+        self._lock = threading.Lock()
+        self._window_cache: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def _small(self, image: np.ndarray, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if size is None:
+            h, w = gray.shape[:2]
+            size = (max(1, int(w * self.downsample)), max(1, int(h * self.downsample)))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    @staticmethod
+    def _pyramid(small: np.ndarray) -> Tuple[np.ndarray, ...]:
+        levels = [small]
+        for _ in range(_PYRAMID_LEVELS - 1):
+            levels.append(cv2.pyrDown(levels[-1]))
+        return tuple(levels)
+
+    def _window(self, shape: Tuple[int, int]) -> np.ndarray:
+        window = self._window_cache.get(shape)
+        if window is None:
+            window = cv2.createHanningWindow((shape[1], shape[0]), cv2.CV_32F)
+            self._window_cache[shape] = window
+        return window
+
+    def get_reference(self, template: str) -> Optional[ScannerReference]:
+        return self._references.get(template)
+
+    def claim_load(self, template: str) -> bool:
+        """True only the first time a template's reference file should be loaded."""
+        with self._lock:
+            if template in self._load_attempted:
+                return False
+            self._load_attempted.add(template)
+            return True
+
+    def set_reference(
+        self, template: str, image: np.ndarray, corners: np.ndarray, crop_margins: bool
+    ) -> ScannerReference:
+        reference = ScannerReference(
+            pyramid=self._pyramid(self._small(image)),
+            image_shape=image.shape[:2],
+            corners=np.asarray(corners, dtype=np.float32).reshape(4, 2),
+            crop_margins=crop_margins,
+        )
+        with self._lock:
+            self._references[template] = reference
+        logger.info("Scanner reference set", template=template, shape=reference.image_shape)
+        return reference
+
+    def register(self, reference: ScannerReference, image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Answer-region corners of `image` (full-resolution pixels), or None if
+        the page cannot be registered to the reference.
+        """
+        ref_small = reference.pyramid[0]
+        pyramid = self._pyramid(
+            self._small(image, size=(ref_small.shape[1], ref_small.shape[0]))
+        )
+
+        # Initial alignment on the coarsest level. Phase correlation is exact
+        # for pure shifts but unreliable once the page is rotated, so ECC starts
+        # from both the phase shift and the identity and the better fit wins.
+        ref_top, top = reference.pyramid[-1], pyramid[-1]
+        (dx, dy), _ = cv2.phaseCorrelate(ref_top, top, self._window(ref_top.shape))
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, self.iterations, 1e-4)
+        best: Optional[Tuple[float, np.ndarray]] = None
+        for shift in ((0.0, 0.0), (dx, dy)):
+            warp = np.array([[1, 0, shift[0]], [0, 1, shift[1]]], dtype=np.float32)
+            try:
+                correlation, warp = cv2.findTransformECC(
+                    ref_top, top, warp, cv2.MOTION_EUCLIDEAN, criteria, None, 3
+                )
+            except cv2.error:
+                continue
+            if best is None or correlation > best[0]:
+                best = (correlation, warp)
+        if best is None:
+            logger.warning("Scanner registration did not converge")
+            return None
+
+        # Coarse-to-fine refinement (warp maps reference -> page)
+        correlation, warp = best
+        for level in range(len(pyramid) - 2, -1, -1):
+            warp = warp.copy()
+            warp[:, 2] *= 2
+            try:
+                correlation, warp = cv2.findTransformECC(
+                    reference.pyramid[level], pyramid[level], warp,
+                    cv2.MOTION_EUCLIDEAN, criteria, None, 3,
+                )
+            except cv2.error as e:
+                logger.warning(
+                    "Scanner registration did not converge", error=str(e).splitlines()[-1]
+                )
+                return None
+
+        if correlation < self.min_correlation:
+            logger.warning(
+                "Scanner registration rejected", correlation=round(float(correlation), 3)
+            )
+            return None
+
+        # Reference full-res -> reference small -> page small -> page full-res
+        ref_h, ref_w = reference.image_shape
+        page_h, page_w = image.shape[:2]
+        small_h, small_w = ref_small.shape
+        ref_scale = np.array([small_w / ref_w, small_h / ref_h], dtype=np.float32)
+        page_scale = np.array([small_w / page_w, small_h / page_h], dtype=np.float32)
+        points = reference.corners * ref_scale
+        mapped = points @ warp[:, :2].T + warp[:, 2]
+        return (mapped / page_scale).astype(np.float32)
+
+
+@lru_cache
+def get_scanner_registrar() -> ScannerRegistrar:
+    """Get the process-wide scanner registrar."""
+    return ScannerRegistrar(
+        downsample=settings.SCANNER_DOWNSAMPLE,
+        min_correlation=settings.SCANNER_MIN_CORRELATION,
+        iterations=settings.SCANNER_ECC_ITERATIONS,
+    )
@@ -0,0 +1,210 @@
+"""
+Timing-mark registration.
+
+Sheets with timing marks print a strip of short dark bars along one side
+margin (one per question row) and along the top or bottom margin (one per
+bubble column). Each strip is read with 1D projections only: the column
+profile of the margin finds the strip, the row profile of the strip gives
+one peak per mark, and the mark centroids give the page skew. Bubble
+positions then follow directly from the mark positions, so no rectangle
+search, perspective warp or uniform-grid assumption is needed.
+
+The model is a flat page under rotation only. A strip is rejected if its mark
+count is not the expected one, or if its marks stray from an evenly spaced
+straight line. The two strips are rejected together if they disagree on the
+skew, which happens with perspective or curvature. The caller then falls
+back to the answer rectangle.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+import structlog
+
+from app.core.constants import TIMING_MARK_DEFAULTS
+
+logger = structlog.get_logger()
+
+
+@dataclass(frozen=True)
+class TimingMarks:
+    """Marks of one strip, in page pixels."""
+    centers: np.ndarray  # Position of each mark along the strip (float32)
+    cross: np.ndarray  # Position of each mark across the strip (float32)
+    pitch: float  # Median distance between consecutive marks
+    slope: float  # d(cross)/d(along): page skew seen by the strip
+
+
+@dataclass(frozen=True)
+class TimingGrid:
+    """Row marks (one per question row) and column marks (one per bubble column)."""
+    rows: TimingMarks
+    columns: TimingMarks
+
+    def bubble_centers(self, row_idx: np.ndarray, col_idx: np.ndarray):
+        """
+        (x, y) centers of the bubbles at mark indices `row_idx` x `col_idx`
+        (broadcast), corrected for skew: rows run perpendicular to the row
+        strip and columns perpendicular to the column strip.
+        """
+        rows, cols = self.rows, self.columns
+        x0 = cols.centers[col_idx]
+        y0 = rows.centers[row_idx]
+        # x along a column line drifts with y, y along a row line drifts with x
+        x = x0 - cols.slope * (y0 - cols.cross[col_idx])
+        y = y0 - rows.slope * (x - rows.cross[row_idx])
+        return x, y
+
+
+class TimingMarkDetector:
+    """Finds row and column timing marks of a page with 1D projections."""
+
+    def __init__(
+        self,
+        row_edge: str = TIMING_MARK_DEFAULTS["row_edge"],
+        column_edge: str = TIMING_MARK_DEFAULTS["column_edge"],
+        strip_percent: float = TIMING_MARK_DEFAULTS["strip_percent"],
+        max_residual: float = TIMING_MARK_DEFAULTS["max_residual"],
+        max_skew_mismatch: float = TIMING_MARK_DEFAULTS["max_skew_mismatch"],
+    ):
+        if row_edge not in ("left", "right") or column_edge not in ("top", "bottom"):
+            raise ValueError(f"Invalid timing mark edges: {row_edge}/{column_edge}")
+        self.row_edge = row_edge
+        self.column_edge = column_edge
+        self.strip_percent = strip_percent
+        self.max_residual = max_residual
+        self.max_skew_mismatch = max_skew_mismatch
+
+    @classmethod
+    def for_template(cls, template_config: dict) -> "TimingMarkDetector":
+        """Detector configured by the template's optional "timing_marks" entry."""
+        return cls(**{**TIMING_MARK_DEFAULTS, **template_config.get("timing_marks", {})})
+
+    def detect(
+        self, image: np.ndarray, rows: int, columns: int, column_group: Optional[int] = None
+    ) -> Optional[TimingGrid]:
+        """
+        Timing grid with exactly `rows` row marks and `columns` column marks,
+        or None if either strip cannot be read or the fit is not trusted.
+        Column marks come in groups of `column_group` (options per layout
+        column), with a wider gap between groups.
+        """
+        h, w = image.shape[:2]
+        strip_w = max(1, int(w * self.strip_percent))
+        strip_h = max(1, int(h * self.strip_percent))
+
+        # Row marks: vertical strip, marks stacked along y
+        x_off = 0 if self.row_edge == "left" else w - strip_w
+        row_strip = self._darkness(image[:, x_off:x_off + strip_w])
+        row_marks = self._read_strip(row_strip, rows, offset=x_off)
+
+        # Column marks: horizontal strip, transposed so marks stack along axis 0
+        y_off = 0 if self.column_edge == "top" else h - strip_h
+        col_strip = self._darkness(image[y_off:y_off + strip_h, :]).T
+        col_marks = self._read_strip(col_strip, columns, offset=y_off, group=column_group)
+
+        if row_marks is None or col_marks is None:
+            logger.info(
+                "Timing marks not found",
+                rows_found=row_marks is not None, columns_found=col_marks is not None,
+            )
+            return None
+
+        # Under rotation alone, the row strip's dx/dy is minus the column strip's dy/dx
+        mismatch = abs(row_marks.slope + col_marks.slope)
+        if mismatch > self.max_skew_mismatch:
+            logger.info(
+                "Timing marks rejected: strips disagree on skew",
+                row_slope=round(row_marks.slope, 4), column_slope=round(col_marks.slope, 4),
+            )
+            return None
+        return TimingGrid(rows=row_marks, columns=col_marks)
+
+    @staticmethod
+    def _darkness(strip: np.ndarray) -> np.ndarray:
+        if strip.ndim == 3:
+            strip = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+        return 255.0 - strip.astype(np.float32)
+
+    @staticmethod
+    def _runs(mask: np.ndarray):
+        """(start, end) of every run of True values (end exclusive)."""
+        edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+        return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+    def _read_strip(
+        self, darkness: np.ndarray, expected: int, offset: int, group: Optional[int] = None
+    ) -> Optional[TimingMarks]:
+        """
+        Marks of a strip laid out with marks stacked along axis 0.
+        `offset` converts axis-1 positions back to page pixels. Marks are
+        evenly spaced within groups of `group` (default: a single group).
+        """
+        if expected < 2:
+            return None
+
+        # 1. Strip location: the band of axis-1 positions crossed by the marks
+        across = darkness.mean(axis=0)
+        level = across.min() + 0.5 * (across.max() - across.min())
+        starts, ends = self._runs(across >= level)
+        if len(starts) == 0:
+            return None
+        best = int(np.argmax([across[s:e].sum() for s, e in zip(starts, ends, strict=True)]))
+        band_start = int(starts[best])
+        band = darkness[:, band_start:ends[best]]
+
+        # 2. Mark peaks: runs of the along-strip profile above mid level
+        profile = band.mean(axis=1)
+        low, high = float(profile.min()), float(profile.max())
+        if high - low < 40:  # No dark marks at all
+            return None
+        starts, ends = self._runs(profile >= low + 0.5 * (high - low))
+        lengths = ends - starts
+        keep = np.abs(lengths - np.median(lengths)) <= 0.5 * np.median(lengths)
+        starts, ends = starts[keep], ends[keep]
+        if len(starts) != expected:
+            logger.info("Timing strip rejected: mark count", found=len(starts), expected=expected)
+            return None
+
+        # 3. Intensity-weighted centroid of each mark along and across the strip.
+        # Across, each mark is measured over its own extent in the whole strip:
+        # on a skewed page the marks drift out of the common band, and a
+        # centroid clipped to the band underestimates the skew.
+        centers = np.empty(len(starts), dtype=np.float32)
+        cross = np.empty(len(starts), dtype=np.float32)
+        for i, (s, e) in enumerate(zip(starts, ends, strict=True)):
+            weights = profile[s:e] - low
+            centers[i] = s + float(np.dot(np.arange(e - s), weights) / weights.sum())
+            line = darkness[s:e].mean(axis=0)
+            peak = band_start + int(np.argmax(line[band_start:ends[best]]))
+            mark_level = line.min() + 0.5 * (line[peak] - line.min())
+            run_starts, run_ends = self._runs(line >= mark_level)
+            run = int(np.searchsorted(run_ends, peak, side="right"))
+            lo, hi = int(run_starts[run]), int(run_ends[run])
+            weights = line[lo:hi] - mark_level
+            cross[i] = lo + float(np.dot(np.arange(hi - lo), weights) / max(weights.sum(), 1e-6))
+
+        spacing = np.diff(centers)
+        pitch = float(np.median(spacing))
+        if pitch <= 0 or spacing.min() < 0.5 * pitch:
+            return None
+
+        # 4. Fit checks: along the strip, position = a + b * index + c * group
+        # (even spacing plus a constant gap between groups); across, a line.
+        index = np.arange(expected)
+        design = np.stack([np.ones(expected), index, index // (group or expected)], axis=1)
+        coef = np.linalg.lstsq(design, centers, rcond=None)[0]
+        along_residual = float(np.abs(centers - design @ coef).max()) / pitch
+        line = np.polyfit(centers, cross, 1)
+        across_residual = float(np.abs(cross - np.polyval(line, centers)).max()) / pitch
+        if max(along_residual, across_residual) > self.max_residual:
+            logger.info(
+                "Timing strip rejected: marks off the fitted line",
+                along=round(along_residual, 3), across=round(across_residual, 3),
+            )
+            return None
+
+        cross += offset
+        return TimingMarks(centers=centers, cross=cross, pitch=pitch, slope=float(line[0]))
@@ -0,0 +1 @@
+"""Offline benchmarks for the OMR pipeline (run from omr-processor-service/)."""
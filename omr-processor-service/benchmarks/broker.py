@@ -0,0 +1,148 @@
+"""
+In-process stand-in for RabbitMQ.
+
+Implements the part of the aio-pika channel API that ProcessingConsumer
+uses (set_qos, declare_queue, queue.iterator, message.process,
+default_exchange.publish, declaration_result.message_count) on asyncio
+queues in the same event loop, with RabbitMQ's delivery rules: messages
+are handed out in order, at most `prefetch_count` unacknowledged at a time,
+and a message whose processing raises is rejected (requeued only if asked,
+as in aio-pika). Nothing touches the network, so a load test measures the
+consumer and not the broker.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+
+class MemoryMessage:
+    """Delivered message: body, headers and timestamp like aio_pika.IncomingMessage."""
+
+    def __init__(self, queue: "MemoryQueue", body: bytes, headers: Optional[dict],
+                 timestamp: Optional[datetime]):
+        self.queue = queue
+        self.body = body
+        self.headers = headers or {}
+        self.timestamp = timestamp
+        self.redelivered = False
+        self.processed = False
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, **_: Any) -> AsyncIterator["MemoryMessage"]:
+        """Ack on success; reject (requeue if asked) and re-raise on error."""
+        try:
+            yield self
+        except BaseException:
+            self.queue.settle(self, ack=False, requeue=requeue)
+            raise
+        self.queue.settle(self, ack=True)
+
+
+class MemoryQueue:
+    """FIFO queue with prefetch-limited delivery to one consumer (same event loop)."""
+
+    def __init__(self, name: str, channel: "MemoryChannel"):
+        self.name = name
+        self.channel = channel
+        self.ready: Deque[MemoryMessage] = deque()
+        self.unacked = 0
+        self.acked = 0
+        self.rejected = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def declaration_result(self) -> SimpleNamespace:
+        return SimpleNamespace(message_count=len(self.ready), consumer_count=0)
+
+    def put(self, body: bytes, headers: Optional[dict] = None,
+            timestamp: Optional[datetime] = None) -> None:
+        self.ready.append(MemoryMessage(self, body, headers, timestamp))
+        self._notify()
+
+    def settle(self, message: MemoryMessage, ack: bool, requeue: bool = False) -> None:
+        if message.processed:
+            return
+        message.processed = True
+        self.unacked -= 1
+        if ack:
+            self.acked += 1
+        elif requeue:
+            message.processed = False
+            message.redelivered = True
+            self.ready.appendleft(message)
+        else:
+            self.rejected += 1
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+
+    def _deliverable(self) -> bool:
+        prefetch = self.channel.prefetch_count
+        return bool(self.ready) and (prefetch == 0 or self.unacked < prefetch)
+
+    async def get(self) -> MemoryMessage:
+        """Next message, once one is ready and the prefetch window allows it."""
+        while not self._deliverable():
+            self._changed.clear()
+            await self._changed.wait()
+        message = self.ready.popleft()
+        self.unacked += 1
+        return message
+
+    @asynccontextmanager
+    async def iterator(self) -> AsyncIterator["_QueueIterator"]:
+        yield _QueueIterator(self)
+
+
+class _QueueIterator:
+    def __init__(self, queue: MemoryQueue):
+        self.queue = queue
+
+    def __aiter__(self) -> "_QueueIterator":
+        return self
+
+    async def __anext__(self) -> MemoryMessage:
+        return await self.queue.get()
+
+
+class _DefaultExchange:
+    def __init__(self, channel: "MemoryChannel"):
+        self.channel = channel
+
+    async def publish(self, message: Any, routing_key: str, **_: Any) -> None:
+        queue = await self.channel.declare_queue(routing_key)
+        queue.put(message.body, getattr(message, "headers", None),
+                  getattr(message, "timestamp", None))
+
+
+class MemoryChannel:
+    """Channel with named queues and the default (direct-to-queue) exchange."""
+
+    def __init__(self) -> None:
+        self.prefetch_count = 0
+        self.queues: Dict[str, MemoryQueue] = {}
+        self.default_exchange = _DefaultExchange(self)
+
+    async def set_qos(self, prefetch_count: int = 0, **_: Any) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, passive: bool = False, **_: Any) -> MemoryQueue:
+        queue = self.queues.get(name)
+        if queue is None:
+            if passive:
+                raise LookupError(f"Queue {name} not declared")
+            queue = self.queues[name] = MemoryQueue(name, self)
+        return queue
+
+    def publish(self, routing_key: str, body: bytes, headers: Optional[dict] = None) -> None:
+        """Publisher side: enqueue `body` with the current time as its timestamp."""
+        queue = self.queues.get(routing_key)
+        if queue is None:
+            queue = self.queues[routing_key] = MemoryQueue(routing_key, self)
+        queue.put(body, headers, datetime.fromtimestamp(time.time(), timezone.utc))
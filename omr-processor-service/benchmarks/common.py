@@ -0,0 +1,95 @@
+"""Helpers shared by the benchmark scripts."""
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import structlog
+
+from benchmarks.sheets import NO_MARK
+
+
+def quiet_logging(level: int = logging.ERROR) -> None:
+    """Silence the service's per-sheet logs so they don't dominate the run."""
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(level))
+    logging.getLogger().setLevel(level)
+
+
+def percentiles(values: Sequence[float], points: Iterable[int] = (50, 95, 99)) -> Dict[str, float]:
+    """{"p50": ..., "p95": ...} rounded to 3 decimals ({} without values)."""
+    if not len(values):
+        return {}
+    data = np.asarray(values, dtype=np.float64)
+    return {f"p{p}": round(float(np.percentile(data, p)), 3) for p in points}
+
+
+def answer_errors(detected: List[Optional[int]], expected: List[int]) -> Dict[str, int]:
+    """
+    Compare detected options (None = blank) with the rendered marks:
+    missed (mark read as blank), false marks (blank read as a mark) and
+    wrong option.
+    """
+    missed = false_marks = wrong = 0
+    for got, want in zip(detected, expected, strict=True):
+        got = NO_MARK if got is None else got
+        if got == want:
+            continue
+        if got == NO_MARK:
+            missed += 1
+        elif want == NO_MARK:
+            false_marks += 1
+        else:
+            wrong += 1
+    return {"missed": missed, "falseMarks": false_marks, "wrong": wrong}
+
+
+class SheetServer:
+    """
+    Serves pre-rendered sheets at http://127.0.0.1:<port>/<bucket>/<index>.jpg,
+    the shape of a MinIO/S3 object URL (query strings such as presigned
+    signatures are ignored). `delay_s` adds object-store latency per request.
+    """
+
+    def __init__(self, images: List[bytes], bucket: str = "omr-sheets", delay_s: float = 0.0):
+        self.images = images
+        self.bucket = bucket
+        self.delay_s = delay_s
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                name = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                try:
+                    body = server.images[int(name.split(".")[0])]
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+                if server.delay_s:
+                    time.sleep(server.delay_s)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, index: int) -> str:
+        port = self.httpd.server_port
+        return f"http://127.0.0.1:{port}/{self.bucket}/{index % len(self.images)}.jpg"
+
+    def __enter__(self) -> "SheetServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
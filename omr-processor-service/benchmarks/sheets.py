@@ -0,0 +1,271 @@
+"""
+Synthetic answer sheets with known answers.
+
+A sheet is rendered flat from a layout (SHEET_TEMPLATES geometry, number of
+questions and options, optional timing marks) and then degraded like a phone
+photo or a scan: page curvature, rotation and perspective onto a desk
+background, a soft shadow, blur, sensor noise and JPEG compression. Every
+degradation amount is a maximum; the actual value is drawn per sheet from
+its seed, so a batch covers the whole range and is reproducible.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from app.core.constants import SHEET_TEMPLATES, TIMING_MARK_DEFAULTS
+
+NO_MARK = -1
+# Geometry assumed by the uniform grid sampler (OMRProcessor._sample_grid):
+# question number in the first 22% of each column, bubbles over the rest,
+# 2% header / 1% footer inside the answer rectangle
+BUBBLE_AREA_START = 0.22
+BUBBLE_AREA_END = 0.98
+HEADER_FRACTION = 0.02
+FOOTER_FRACTION = 0.01
+# Portrait A4 sizes by scan resolution
+RESOLUTIONS: Dict[str, tuple] = {
+    "100dpi": (827, 1169),
+    "150dpi": (1240, 1754),
+    "200dpi": (1654, 2339),
+    "300dpi": (2480, 3508),
+}
+
+
+@dataclass(frozen=True)
+class SheetSpec:
+    """What is printed on the sheet."""
+    template: str = "gib-dnivel"
+    total_questions: Optional[int] = None  # None = the template's
+    options: Optional[int] = None  # None = the template's
+    timing_marks: bool = False  # Row/column marks read by the "timing-marks" engine
+    blank_rate: float = 0.05  # Questions left blank
+
+    @property
+    def config(self) -> dict:
+        return SHEET_TEMPLATES[self.template]
+
+    @property
+    def questions(self) -> int:
+        return self.total_questions or self.config["total_questions"]
+
+    @property
+    def options_per_question(self) -> int:
+        return self.options or self.config["options_per_question"]
+
+
+@dataclass(frozen=True)
+class Distortion:
+    """Maximum amount of each degradation (0 = off)."""
+    perspective: float = 0.0  # Corner displacement, fraction of the page size
+    rotation: float = 0.0  # Degrees, either direction
+    curvature: float = 0.0  # Page bow, fraction of the page height
+    shadow: float = 0.0  # Darkening at the shadowed edge (0..1)
+    blur: float = 0.0  # Gaussian sigma in pixels at 150 dpi (scales with resolution)
+    noise: float = 6.0  # Gaussian noise sigma (gray levels)
+    jpeg_quality: int = 90  # Lowest quality drawn (up to 95)
+    framing: float = 1.0  # Page size in the frame; below 1 the background shows around it
+    background: int = 85  # Gray level around the page (desk; ~240 for a scanner lid)
+
+
+LAYOUTS: Dict[str, SheetSpec] = {
+    "gib-dnivel": SheetSpec(),
+    "gib-dnivel-60x4": SheetSpec(total_questions=60, options=4),
+    "gib-dnivel-timing": SheetSpec(timing_marks=True),
+}
+
+DISTORTIONS: Dict[str, Distortion] = {
+    "clean": Distortion(),
+    "scan": Distortion(rotation=1.0, blur=0.6, noise=4.0, jpeg_quality=85, background=240),
+    "photo": Distortion(
+        perspective=0.02, rotation=2.0, curvature=0.004, shadow=0.3, blur=1.0,
+        noise=6.0, jpeg_quality=75,
+    ),
+    "harsh": Distortion(
+        perspective=0.04, rotation=4.0, curvature=0.01, shadow=0.5, blur=1.8,
+        noise=10.0, jpeg_quality=55,
+    ),
+    # Whole page on a desk: the paper edge competes with the answer rectangle
+    "desk": Distortion(
+        perspective=0.03, rotation=3.0, curvature=0.004, shadow=0.3, blur=1.0,
+        noise=6.0, jpeg_quality=75, framing=0.85,
+    ),
+}
+
+
+@dataclass
+class SyntheticSheet:
+    """A rendered sheet and the option marked on each question (NO_MARK = blank)."""
+    image: bytes
+    answers: List[int]
+    width: int
+    height: int
+    spec: SheetSpec = SheetSpec()
+
+    @property
+    def options(self) -> int:
+        return self.spec.options_per_question
+
+
+def _draw_header(page: np.ndarray, rng: np.random.Generator, answers_left: int, top: int) -> None:
+    """Printed parts outside the answer area: title band and a student ID grid."""
+    height, width = page.shape[:2]
+    cv2.rectangle(page, (int(width * 0.1), top), (width, top + int(height * 0.05)), (45, 45, 45), -1)
+    cv2.rectangle(page, (int(width * 0.1), int(height * 0.16)),
+                  (answers_left - int(width * 0.04), int(height * 0.30)), (90, 90, 90), -1)
+    digits_top = int(height * 0.36)
+    pitch_x = (answers_left - width * 0.16) / 8
+    pitch_y = height * 0.055
+    radius = int(min(pitch_x, pitch_y) * 0.3)
+    for digit in range(8):
+        chosen = int(rng.integers(10))
+        for value in range(10):
+            center = (int(width * 0.12 + digit * pitch_x), int(digits_top + value * pitch_y))
+            cv2.circle(page, center, radius, (60, 60, 60), 1, cv2.LINE_AA)
+            if value == chosen:
+                cv2.circle(page, center, radius - 1, (25, 25, 25), -1, cv2.LINE_AA)
+
+
+def _draw_page(spec: SheetSpec, rng: np.random.Generator, width: int, height: int):
+    """Flat page image and the marked option of every question."""
+    config = spec.config
+    columns = config["columns"]
+    rows = config["rows_per_column"]
+    options = spec.options_per_question
+
+    page = np.full((height, width, 3), 238, np.uint8)
+    left = int(width * config["answer_area_left_percent"])
+    right = int(width * config["answer_area_right_percent"])
+    top = int(height * config["answer_area_top_percent"])
+    bottom = int(height * config["answer_area_bottom_percent"])
+    cv2.rectangle(page, (left, top), (right, bottom), (0, 0, 0), max(2, width // 300))
+    # Timing marks use the top strip, so the title band moves below it
+    strip = TIMING_MARK_DEFAULTS["strip_percent"]
+    _draw_header(page, rng, left, int(height * (strip + 0.01)) if spec.timing_marks else 0)
+
+    column_w = (right - left) / columns
+    bubble_w = column_w * (BUBBLE_AREA_END - BUBBLE_AREA_START) / options
+    grid_top = top + (bottom - top) * HEADER_FRACTION
+    row_h = (bottom - top) * (1 - HEADER_FRACTION - FOOTER_FRACTION) / rows
+    radius = max(3, int(min(bubble_w, row_h) * 0.34))
+    font_scale = row_h / 40
+
+    def bubble_x(column: int, option: int) -> int:
+        return int(left + column * column_w + column_w * BUBBLE_AREA_START + (option + 0.5) * bubble_w)
+
+    def row_y(row: int) -> int:
+        return int(grid_top + (row + 0.5) * row_h)
+
+    answers: List[int] = []
+    for question in range(spec.questions):
+        column, row = divmod(question, rows)
+        marked = NO_MARK if rng.random() < spec.blank_rate else int(rng.integers(options))
+        answers.append(marked)
+        y = row_y(row)
+        cv2.putText(page, str(question + 1),
+                    (int(left + column * column_w + column_w * 0.03), y + radius // 2),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (70, 70, 70), 1, cv2.LINE_AA)
+        # Pencil marks vary in darkness and rarely fill the bubble exactly
+        darkness = int(rng.integers(15, 60))
+        for option in range(options):
+            x = bubble_x(column, option)
+            cv2.circle(page, (x, y), radius, (60, 60, 60), 1, cv2.LINE_AA)
+            if option == marked:
+                fill = max(2, radius - int(rng.integers(0, 3)))
+                cv2.circle(page, (x, y), fill, (darkness,) * 3, -1, cv2.LINE_AA)
+
+    if spec.timing_marks:
+        # One mark per question row on the left margin, one per bubble column on top
+        strip_w, strip_h = int(width * strip), int(height * strip)
+        half = max(2, int(row_h * 0.2))
+        for row in range(rows):
+            y = row_y(row)
+            cv2.rectangle(page, (int(strip_w * 0.3), y - half), (int(strip_w * 0.8), y + half),
+                          (20, 20, 20), -1)
+        half = max(2, int(bubble_w * 0.2))
+        for column in range(columns):
+            for option in range(options):
+                x = bubble_x(column, option)
+                cv2.rectangle(page, (x - half, int(strip_h * 0.3)), (x + half, int(strip_h * 0.8)),
+                              (20, 20, 20), -1)
+    return page, answers
+
+
+def _bend(page: np.ndarray, amount: float) -> np.ndarray:
+    """Bow the page: rows sag towards the middle of the width (curved paper)."""
+    height, width = page.shape[:2]
+    xs = np.arange(width, dtype=np.float32)
+    offset = (amount * height * np.sin(np.pi * xs / width)).astype(np.float32)
+    map_x = np.tile(xs, (height, 1))
+    map_y = np.arange(height, dtype=np.float32)[:, None] - offset[None, :]
+    return cv2.remap(page, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def _project(page: np.ndarray, rng: np.random.Generator, distortion: Distortion) -> np.ndarray:
+    """Rotate and tilt the page onto the background, as framed by a camera or scanner."""
+    height, width = page.shape[:2]
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    center = np.float32([width / 2, height / 2])
+    angle = np.radians(rng.uniform(-distortion.rotation, distortion.rotation))
+    rotation = np.float32([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    target = (corners - center) * distortion.framing @ rotation.T + center
+    jitter = rng.uniform(-1, 1, (4, 2)) * distortion.perspective * np.float32([width, height])
+    homography = cv2.getPerspectiveTransform(corners, np.float32(target + jitter))
+    if distortion.framing < 1:
+        border = {"borderMode": cv2.BORDER_CONSTANT, "borderValue": (distortion.background,) * 3}
+    else:
+        # The page fills the frame: the corners that moved in show more paper
+        border = {"borderMode": cv2.BORDER_REPLICATE}
+    return cv2.warpPerspective(page, homography, (width, height), flags=cv2.INTER_LINEAR,
+                               **border)
+
+
+def _shadow(page: np.ndarray, rng: np.random.Generator, strength: float) -> np.ndarray:
+    """Linear shadow falling from a random edge."""
+    height, width = page.shape[:2]
+    angle = rng.uniform(0, 2 * np.pi)
+    ramp = (
+        (np.arange(width, dtype=np.float32)[None, :] / width - 0.5) * np.cos(angle)
+        + (np.arange(height, dtype=np.float32)[:, None] / height - 0.5) * np.sin(angle)
+    )
+    factor = 1 - strength * np.clip(ramp + 0.5, 0, 1)
+    return (page * factor[..., None]).astype(np.uint8)
+
+
+def render_sheet(
+    seed: int,
+    width: int = 1240,
+    height: int = 1754,
+    spec: SheetSpec = SheetSpec(),
+    distortion: Optional[Distortion] = None,
+) -> SyntheticSheet:
+    """
+    Render a sheet (A4 at 150 dpi by default) with one mark per answered
+    question, degraded by `distortion` (clean when None).
+    """
+    rng = np.random.default_rng(seed)
+    distortion = distortion or DISTORTIONS["clean"]
+    page, answers = _draw_page(spec, rng, width, height)
+
+    if distortion.curvature:
+        page = _bend(page, rng.uniform(-distortion.curvature, distortion.curvature))
+    if distortion.rotation or distortion.perspective:
+        page = _project(page, rng, distortion)
+    if distortion.shadow:
+        page = _shadow(page, rng, rng.uniform(0, distortion.shadow))
+    if distortion.blur:
+        sigma = rng.uniform(0, distortion.blur) * width / 1240
+        if sigma > 0.1:
+            page = cv2.GaussianBlur(page, (0, 0), sigma)
+    if distortion.noise:
+        page = np.clip(page + rng.normal(0, distortion.noise, page.shape), 0, 255).astype(np.uint8)
+
+    quality = int(rng.integers(min(distortion.jpeg_quality, 95), 96))
+    ok, encoded = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Could not encode synthetic sheet")
+    return SyntheticSheet(
+        image=encoded.tobytes(), answers=answers, width=width, height=height, spec=spec
+    )
@@ -0,0 +1,252 @@
+"""
+Long-running soak test: push thousands of sheets through the pipeline and
+watch memory.
+
+Runs OMRProcessor.process_image directly (--mode processor) or the full
+consumer path, process_student_answer with the download served by a local
+HTTP server, executor, admission and scoring (--mode consumer; no broker is
+needed). Every --report-every sheets it prints RSS, tracemalloc current/peak
+and gc counts; at the end it fits the RSS growth per sheet after warm-up and
+the worst per-stage allocation peaks.
+
+    python -m benchmarks.soak --sheets 5000 --mode consumer --max-growth-mb 50
+
+Exits with status 1 when RSS grew more than --max-growth-mb after warm-up,
+so it can gate a release. --memory turns tracemalloc on (per-stage peaks,
+top allocation growth) at the cost of ~2x slower Python allocations.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.timing import StageTimer, current_rss_bytes
+from benchmarks.common import SheetServer, answer_errors, quiet_logging
+from benchmarks.sheets import DISTORTIONS, LAYOUTS, NO_MARK, render_sheet
+
+MB = 1024 * 1024
+
+
+def slope(xs: List[float], ys: List[float]) -> float:
+    """Least-squares slope of ys over xs (0 with fewer than two points)."""
+    n = len(xs)
+    if n < 2:
+        return 0.0
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys, strict=True)) / var
+
+
+class SoakReport:
+    """Memory samples and per-stage peaks collected during the run."""
+
+    def __init__(self, warmup: int):
+        self.warmup = warmup
+        self.samples: List[Dict[str, float]] = []
+        self.stage_peaks: Dict[str, int] = {}
+        self.stage_ms: Dict[str, float] = {}
+        self.errors = 0
+        self.mismatches = 0
+        self.started = time.perf_counter()
+
+    def add_timer(self, timer: StageTimer) -> None:
+        for stage, peak in timer.peak_bytes.items():
+            self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak)
+        for stage, ms in timer.timings_ms.items():
+            self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + ms
+
+    def sample(self, sheets: int) -> Dict[str, float]:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        point = {
+            "sheets": sheets,
+            "elapsedS": round(time.perf_counter() - self.started, 2),
+            "rssMb": round(current_rss_bytes() / MB, 2),
+            "tracedMb": round(current / MB, 2),
+            "tracedPeakMb": round(peak / MB, 2),
+            "gc": list(gc.get_count()),
+            "errors": self.errors,
+        }
+        self.samples.append(point)
+        return point
+
+    def summary(self, sheets: int) -> Dict[str, Any]:
+        steady = [s for s in self.samples if s["sheets"] >= self.warmup]
+        xs = [s["sheets"] for s in steady]
+        rss_slope_mb = slope(xs, [s["rssMb"] for s in steady])
+        traced_slope_mb = slope(xs, [s["tracedMb"] for s in steady])
+        measured = (xs[-1] - xs[0]) if len(xs) > 1 else 0
+        elapsed = time.perf_counter() - self.started
+        return {
+            "sheets": sheets,
+            "errors": self.errors,
+            "answerMismatches": self.mismatches,
+            "elapsedS": round(elapsed, 2),
+            "sheetsPerS": round(sheets / elapsed, 2) if elapsed else 0.0,
+            "rssStartMb": steady[0]["rssMb"] if steady else None,
+            "rssEndMb": steady[-1]["rssMb"] if steady else None,
+            "rssGrowthBytesPerSheet": round(rss_slope_mb * MB),
+            "rssGrowthMb": round(rss_slope_mb * measured, 2),
+            "tracedGrowthBytesPerSheet": round(traced_slope_mb * MB),
+            "stagePeakMb": {k: round(v / MB, 2) for k, v in sorted(self.stage_peaks.items())},
+            "stageMeanMs": {k: round(v / max(sheets, 1), 3) for k, v in sorted(self.stage_ms.items())},
+        }
+
+
+def _count_mismatches(answers: List[Optional[int]], expected: List[int]) -> int:
+    return sum(answer_errors(answers, expected).values())
+
+
+def run_processor(args: argparse.Namespace, sheets, report: SoakReport, tick: Callable) -> None:
+    from app.services.omr_processor import OMRProcessor
+
+    processor = OMRProcessor()
+    for index in range(args.sheets):
+        sheet = sheets[index % len(sheets)]
+        timer = StageTimer()
+        try:
+            result = processor.process_image(
+                sheet.image, len(sheet.answers), sheet.options, engine=args.engine,
+                template=sheet.spec.template, timer=timer,
+            )
+            report.mismatches += _count_mismatches(
+                [a.selected_option for a in result.answers], sheet.answers
+            )
+        except Exception:
+            report.errors += 1
+        report.add_timer(timer)
+        tick(index + 1)
+
+
+async def run_consumer(args: argparse.Namespace, sheets, report: SoakReport, tick: Callable) -> None:
+    from app.consumers.processing_consumer import ProcessingConsumer
+    from app.core.executor import shutdown_processing_executor
+
+    consumer = ProcessingConsumer()
+    done = 0
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def one(index: int, url: str) -> None:
+        nonlocal done
+        sheet = sheets[index % len(sheets)]
+        message = {
+            "attemptId": f"soak-{index}",
+            "examId": "soak",
+            "studentId": f"student-{index}",
+            "imageUrl": url,
+            "answerKey": [[option] if option != NO_MARK else [] for option in sheet.answers],
+            "totalQuestions": len(sheet.answers),
+            "optionsPerQuestion": sheet.options,
+            "engine": args.engine,
+            "template": sheet.spec.template,
+        }
+        async with semaphore:
+            result = await consumer.process_student_answer(message)
+        if not result.get("success"):
+            report.errors += 1
+        else:
+            report.mismatches += _count_mismatches(
+                [a["selectedOption"] for a in result["answers"]], sheet.answers
+            )
+        for stage, peak in result.get("stagePeakBytes", {}).items():
+            report.stage_peaks[stage] = max(report.stage_peaks.get(stage, 0), peak)
+        for stage, ms in result.get("stageTimingsMs", {}).items():
+            report.stage_ms[stage] = report.stage_ms.get(stage, 0.0) + ms
+        done += 1
+        tick(done)
+
+    with SheetServer([sheet.image for sheet in sheets]) as server:
+        try:
+            pending: set = set()
+            for index in range(args.sheets):
+                pending.add(asyncio.ensure_future(one(index, server.url(index))))
+                if len(pending) >= args.concurrency * 2:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            shutdown_processing_executor()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=2000)
+    parser.add_argument("--mode", choices=("processor", "consumer"), default="processor")
+    parser.add_argument("--concurrency", type=int, default=1, help="Sheets in flight (consumer mode)")
+    parser.add_argument("--variants", type=int, default=16, help="Distinct synthetic sheets to cycle")
+    parser.add_argument("--width", type=int, default=1240)
+    parser.add_argument("--height", type=int, default=1754)
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="gib-dnivel")
+    parser.add_argument("--distortion", choices=sorted(DISTORTIONS), default="clean")
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--warmup", type=int, default=100, help="Sheets excluded from the growth fit")
+    parser.add_argument("--report-every", type=int, default=100)
+    parser.add_argument("--memory", action="store_true", help="tracemalloc: per-stage peaks and top growth")
+    parser.add_argument("--max-growth-mb", type=float, default=None)
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the summary and samples here")
+    parser.add_argument("--verbose", action="store_true", help="Keep the service's info logs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.verbose:
+        quiet_logging()
+
+    sheets = [
+        render_sheet(
+            seed, width=args.width, height=args.height,
+            spec=LAYOUTS[args.layout], distortion=DISTORTIONS[args.distortion],
+        )
+        for seed in range(max(1, args.variants))
+    ]
+    if args.memory:
+        tracemalloc.start()
+    report = SoakReport(warmup=min(args.warmup, max(args.sheets - args.report_every, 0)))
+    baseline_snapshot = None
+
+    def tick(done: int) -> None:
+        nonlocal baseline_snapshot
+        if done % args.report_every and done != args.sheets:
+            return
+        point = report.sample(done)
+        print(json.dumps(point), flush=True)
+        if args.memory and baseline_snapshot is None and done >= report.warmup:
+            baseline_snapshot = tracemalloc.take_snapshot()
+
+    report.sample(0)
+    if args.mode == "processor":
+        run_processor(args, sheets, report, tick)
+    else:
+        asyncio.run(run_consumer(args, sheets, report, tick))
+
+    summary = report.summary(args.sheets)
+    if args.memory and baseline_snapshot is not None:
+        growth = tracemalloc.take_snapshot().compare_to(baseline_snapshot, "lineno")
+        summary["topAllocationGrowth"] = [
+            {"where": str(stat.traceback), "sizeDiffKb": round(stat.size_diff / 1024, 1)}
+            for stat in growth if stat.size_diff > 0
+        ][:10]
+    print(json.dumps(summary, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"summary": summary, "samples": report.samples}, fh, indent=2)
+
+    if args.max_growth_mb is not None and summary["rssGrowthMb"] > args.max_growth_mb:
+        print(
+            f"RSS grew {summary['rssGrowthMb']} MB after warm-up (limit {args.max_growth_mb} MB)",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
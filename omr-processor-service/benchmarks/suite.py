@@ -0,0 +1,239 @@
+"""
+Speed and accuracy of OMRProcessor.process_image on synthetic sheets.
+
+Every combination of layout x distortion x resolution x engine processes the
+same seeded sheets and reports detection accuracy (answers, whole sheets,
+missed / false / wrong marks) next to latency percentiles, per-stage medians
+and throughput. Sheets are rendered before timing starts.
+
+    python -m benchmarks.suite --engines grid,cascade --distortions clean,photo \\
+        --resolutions 150dpi,300dpi --sheets 20 --json after.json --baseline before.json
+
+With --baseline, each combination is compared with the same one in an
+earlier --json run; --max-slowdown (fraction of p50) and
+--max-accuracy-drop (fraction of answers) make the run exit with status 1,
+so a performance change is checked for speed and correctness at once.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+
+from app.core.config import settings
+from app.core.timing import StageTimer
+from app.services.engines import available_engines
+from app.services.omr_processor import OMRProcessor
+from benchmarks.common import answer_errors, percentiles, quiet_logging
+from benchmarks.sheets import DISTORTIONS, LAYOUTS, RESOLUTIONS, SyntheticSheet, render_sheet
+
+
+def _resolution(name: str) -> Tuple[int, int]:
+    """Preset name (150dpi) or WIDTHxHEIGHT."""
+    if name in RESOLUTIONS:
+        return RESOLUTIONS[name]
+    try:
+        width, height = name.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Unknown resolution '{name}' (use {', '.join(RESOLUTIONS)} or WIDTHxHEIGHT)"
+        ) from None
+
+
+def _names(value: str, known: List[str], kind: str) -> List[str]:
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown {kind}: {', '.join(unknown)} (available: {', '.join(known)})"
+        )
+    return names
+
+
+def _process(processor: OMRProcessor, sheet: SyntheticSheet, engine: str) -> Dict[str, Any]:
+    timer = StageTimer(track_memory=False)
+    start = time.perf_counter()
+    try:
+        result = processor.process_image(
+            sheet.image, len(sheet.answers), sheet.options,
+            engine=engine, template=sheet.spec.template, timer=timer,
+        )
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "ms": (time.perf_counter() - start) * 1000}
+    ms = (time.perf_counter() - start) * 1000
+    detected: List[Optional[int]] = [None] * len(sheet.answers)
+    for answer in result.answers:
+        if 1 <= answer.question_number <= len(detected):
+            detected[answer.question_number - 1] = answer.selected_option
+    return {
+        "ms": ms,
+        "stages": dict(timer.timings_ms),
+        "errors": answer_errors(detected, sheet.answers),
+        "multiple": sum(1 for a in result.answers if a.status.value == "multiple"),
+        "degraded": result.degraded,
+        "engine": result.engine,
+    }
+
+
+def run_case(
+    processor: OMRProcessor, sheets: List[SyntheticSheet], engine: str, workers: int
+) -> Dict[str, Any]:
+    """Process every sheet with `engine` and summarize speed and accuracy."""
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="omr-bench") as pool:
+            runs = list(pool.map(lambda sheet: _process(processor, sheet, engine), sheets))
+    else:
+        runs = [_process(processor, sheet, engine) for sheet in sheets]
+    elapsed = time.perf_counter() - start
+
+    questions = sum(len(sheet.answers) for sheet in sheets)
+    failed = [run for run in runs if "error" in run]
+    done = [run for run in runs if "error" not in run]
+    totals = {"missed": 0, "falseMarks": 0, "wrong": 0}
+    exact = 0
+    for run in done:
+        for key, count in run["errors"].items():
+            totals[key] += count
+        exact += not any(run["errors"].values())
+    # A failed sheet counts all its questions as wrong
+    incorrect = sum(totals.values()) + sum(
+        len(sheet.answers) for sheet, run in zip(sheets, runs, strict=True) if "error" in run
+    )
+    stage_names = sorted({stage for run in done for stage in run["stages"]})
+    return {
+        "sheets": len(sheets),
+        "failed": len(failed),
+        "firstError": failed[0]["error"] if failed else None,
+        "accuracy": round(1 - incorrect / max(questions, 1), 4),
+        "sheetAccuracy": round(exact / max(len(sheets), 1), 4),
+        **totals,
+        "flaggedMultiple": sum(run["multiple"] for run in done),
+        "degraded": sum(bool(run["degraded"]) for run in done),
+        "latencyMs": {
+            **percentiles([run["ms"] for run in runs]),
+            "mean": round(sum(run["ms"] for run in runs) / max(len(runs), 1), 3),
+        },
+        "stageP50Ms": {
+            stage: percentiles([run["stages"].get(stage, 0.0) for run in done], (50,))["p50"]
+            for stage in stage_names
+        },
+        "sheetsPerS": round(len(sheets) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def _environment(workers: int) -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpus": os.cpu_count(),
+        "workers": workers,
+        "parallelColumns": settings.OMR_PARALLEL_COLUMNS,
+        "defaultEngine": settings.OMR_ENGINE,
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    max_slowdown: Optional[float],
+    max_accuracy_drop: Optional[float],
+) -> List[str]:
+    """Print the change of every case present in both runs; return gate failures."""
+    failures = []
+    print(f"\n{'case':56} {'p50 ms':>19} {'accuracy':>19}")
+    for key, case in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        p50, old_p50 = case["latencyMs"].get("p50", 0.0), old["latencyMs"].get("p50", 0.0)
+        change = (p50 - old_p50) / old_p50 if old_p50 else 0.0
+        drop = old["accuracy"] - case["accuracy"]
+        print(f"{key:56} {old_p50:8.1f} -> {p50:7.1f} {old['accuracy']:9.4f} -> {case['accuracy']:.4f}"
+              f"  ({change:+.1%})")
+        if max_slowdown is not None and change > max_slowdown:
+            failures.append(f"{key}: p50 {change:+.1%} (limit +{max_slowdown:.0%})")
+        if max_accuracy_drop is not None and drop > max_accuracy_drop:
+            failures.append(f"{key}: accuracy -{drop:.4f} (limit {max_accuracy_drop})")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", default=",".join(available_engines()))
+    parser.add_argument("--layouts", default="gib-dnivel")
+    parser.add_argument("--distortions", default="clean,scan,photo")
+    parser.add_argument("--resolutions", default="150dpi")
+    parser.add_argument("--sheets", type=int, default=20, help="Sheets per case")
+    parser.add_argument("--seed", type=int, default=0, help="First sheet seed")
+    parser.add_argument("--workers", type=int, default=1, help="Sheets processed concurrently")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the results here")
+    parser.add_argument("--baseline", default=None, help="Earlier --json results to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=None)
+    parser.add_argument("--max-accuracy-drop", type=float, default=None)
+    args = parser.parse_args(argv)
+    try:
+        args.engines = _names(args.engines, available_engines(), "engine")
+        args.layouts = _names(args.layouts, list(LAYOUTS), "layout")
+        args.distortions = _names(args.distortions, list(DISTORTIONS), "distortion")
+        args.resolutions = [
+            (name, _resolution(name)) for name in args.resolutions.split(",") if name
+        ]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    quiet_logging()
+    processor = OMRProcessor()
+    results: Dict[str, Dict[str, Any]] = {}
+
+    print(f"{'case':56} {'acc':>7} {'sheet':>6} {'miss':>5} {'false':>5} {'wrong':>5} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'sheets/s':>8}")
+    for layout in args.layouts:
+        for distortion in args.distortions:
+            for resolution, (width, height) in args.resolutions:
+                sheets = [
+                    render_sheet(
+                        args.seed + i, width=width, height=height,
+                        spec=LAYOUTS[layout], distortion=DISTORTIONS[distortion],
+                    )
+                    for i in range(args.sheets)
+                ]
+                for engine in args.engines:
+                    key = f"{layout}/{distortion}/{resolution}/{engine}"
+                    case = run_case(processor, sheets, engine, args.workers)
+                    results[key] = case
+                    latency = case["latencyMs"]
+                    print(f"{key:56} {case['accuracy']:7.4f} {case['sheetAccuracy']:6.2f} "
+                          f"{case['missed']:5d} {case['falseMarks']:5d} {case['wrong']:5d} "
+                          f"{latency.get('p50', 0):8.1f} {latency.get('p95', 0):8.1f} "
+                          f"{case['sheetsPerS']:8.2f}", flush=True)
+                    if case["failed"]:
+                        print(f"  {case['failed']} sheet(s) failed: {case['firstError']}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"environment": _environment(args.workers), "results": results}, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)["results"]
+        failures = compare(results, baseline, args.max_slowdown, args.max_accuracy_drop)
+        if failures:
+            print("\n" + "\n".join(failures), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())